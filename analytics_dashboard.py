@@ -1,47 +1,37 @@
 # analytics_dashboard.py
-import sqlite3
+import csv
+import io
 import json
-from datetime import datetime, timedelta
+import tempfile
+from datetime import date, timedelta
+from db_pool import get_pool
+from metrics_store import get_metrics
+from progression import current_streak, get_progression, level_bounds
 
 class AnalyticsDashboard:
     def __init__(self, db_path='fitness_bot.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        # Отчёты строятся по дневным показателям, а не по сырым записям
+        self.metrics = get_metrics(self.pool)
+        self.progression = get_progression(self.pool)
     
     def generate_progress_text(self, user_id, days=30):
-        """Генерация текстового отчета прогресса"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Получаем базовую статистику
-        cursor.execute('''
-            SELECT COUNT(*) as workout_count,
-                   MIN(date) as first_date,
-                   MAX(date) as last_date
-            FROM workouts 
-            WHERE user_id = ? AND date >= date('now', ?)
-        ''', (user_id, f'-{days} days'))
-        
-        stats = cursor.fetchone()
-        conn.close()
+        """Отчёт о прогрессе за последние days дней (из кэша, пока нет новой активности)"""
+        return self.metrics.reports.get_or_render(
+            (user_id, 'progress', days), lambda: self._render_progress(user_id, days))
+    
+    def generate_profile_stats(self, user_id):
+        """Блок фитнес-статистики профиля: уровень, опыт, тренировки, серия"""
+        return self.metrics.reports.get_or_render(
+            (user_id, 'profile'), lambda: self._render_profile_stats(user_id))
+    
+    def _render_progress(self, user_id, days):
+        today = date.today()
+        totals = self.metrics.last_days(user_id, days, today)
         
-        if stats and stats[0] > 0:
-            workout_count, first_date, last_date = stats
-            
-            progress_text = f"""
-📊 <b>Ваш прогресс за последние {days} дней</b>
-
-✅ <b>Тренировки:</b>
-• Выполнено: {workout_count} тренировок
-• Первая тренировка: {first_date}
-• Последняя тренировка: {last_date}
-• Средняя частота: {round(workout_count / days, 1)} тренировок в неделю
-
-🏆 <b>Рекомендации:</b>
-• {'Отличная работа! Продолжайте в том же духе! 💪' if workout_count >= 12 else 'Можно увеличить частоту тренировок!'}
-• {'🔥 Идеальная регулярность!' if workout_count >= 15 else 'Старайтесь заниматься 3-4 раза в неделю'}
-"""
-        else:
-            progress_text = f"""
+        if not totals.workouts and not totals.meals:
+            return f"""
 📊 <b>Ваш прогресс за последние {days} дней</b>
 
 😔 Пока нет данных о тренировках за этот период.
@@ -52,35 +42,191 @@ class AnalyticsDashboard:
 • Присоединитесь к челленджам: /challenges
 """
         
-        return progress_text
-    
-    def export_user_data(self, user_id):
-        """Экспорт данных пользователя в текстовом формате"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Тот же по длине период перед текущим - для сравнения
+        previous = self.metrics.totals(user_id, today - timedelta(days=2 * days - 1), today - timedelta(days=days))
+        progress = self.progression.get(user_id)
+        per_week = totals.workouts / days * 7
         
-        export_data = "ФИТНЕС ОТЧЕТ\n"
-        export_data += "=" * 50 + "\n\n"
+        text = f"📊 <b>Ваш прогресс за последние {days} дней</b>\n\n"
+        text += "✅ <b>Тренировки:</b>\n"
+        text += f"• Выполнено: {totals.workouts} ({_change(totals.workouts, previous.workouts)})\n"
+        if totals.workouts:
+            text += f"• Дней с тренировками: {totals.active_days}\n"
+            text += f"• Общее время: {_duration(totals.duration)}\n"
+            text += f"• Средняя продолжительность: {round(totals.duration / totals.workouts)} мин\n"
+            text += f"• Сожжено калорий: {totals.calories_burned:,}".replace(',', ' ') + "\n"
+        text += f"• Средняя частота: {per_week:.1f} тренировок в неделю\n"
+        text += f"• Текущая серия: {plural_days(current_streak(progress, today))}\n\n"
         
-        # Данные здоровья
-        cursor.execute('SELECT * FROM health_questionnaire WHERE user_id = ?', (user_id,))
-        health_data = cursor.fetchone()
-        if health_data:
-            export_data += "ДАННЫЕ ЗДОРОВЬЯ:\n"
-            export_data += f"Возраст: {health_data[1]}\n"
-            export_data += f"Вес: {health_data[2]} кг\n"
-            export_data += f"Рост: {health_data[3]} см\n"
-            export_data += f"Пол: {health_data[4]}\n"
-            export_data += f"Уровень подготовки: {health_data[5]}\n\n"
+        if totals.meal_days:
+            text += "🍎 <b>Питание</b> (в среднем за день с записями):\n"
+            text += f"• Калории: {round(totals.calories_consumed / totals.meal_days)} ккал\n"
+            text += (f"• Белки / жиры / углеводы: {round(totals.protein / totals.meal_days)} / "
+                     f"{round(totals.fat / totals.meal_days)} / {round(totals.carbs / totals.meal_days)} г\n")
+            text += f"• Дней с записями: {totals.meal_days} из {days}\n\n"
         
-        # Тренировки
-        cursor.execute('SELECT * FROM workouts WHERE user_id = ? ORDER BY date', (user_id,))
-        workouts = cursor.fetchall()
-        if workouts:
-            export_data += f"ТРЕНИРОВКИ ({len(workouts)}):\n"
-            for workout in workouts:
-                export_data += f"- {workout[2]}: {workout[3]}\n"
-            export_data += "\n"
+        text += "🏆 <b>Рекомендации:</b>\n"
+        if per_week >= 3:
+            text += "• Отличная работа! Продолжайте в том же духе! 💪\n"
+        else:
+            text += "• Старайтесь заниматься 3-4 раза в неделю\n"
+        if totals.workouts < previous.workouts:
+            text += "• Тренировок меньше, чем в прошлом периоде - самое время вернуться в ритм\n"
+        if not totals.meal_days:
+            text += "• Записывайте питание: /nutrition\n"
+        return text
+    
+    def _render_profile_stats(self, user_id):
+        progress = self.progression.get(user_id)
+        lower, upper = level_bounds(progress.current_level)
+        totals = self.metrics.totals(user_id)
+        
+        text = "<b>Фитнес-статистика:</b>\n"
+        text += f"• Уровень: {progress.current_level}\n"
+        text += (f"• Опыт: {progress.total_xp}/{upper} XP (до уровня {progress.current_level + 1}: "
+                 f"{upper - progress.total_xp} XP)\n" if upper is not None
+                 else f"• Опыт: {progress.total_xp} XP (максимальный уровень)\n")
+        text += f"• Тренировок выполнено: {progress.workouts_completed}\n"
+        text += f"• Текущая серия: {plural_days(current_streak(progress))}\n"
+        text += f"• Время в тренировках: {_duration(totals.duration)}\n"
+        text += f"• Сожжено калорий: {totals.calories_burned:,}".replace(',', ' ') + "\n"
+        return text
+    
+    def export_user_data(self, user_id, fmt='txt'):
+        """Экспорт всех данных пользователя во временный файл (txt, csv или jsonl).
+
+        История читается порциями и сразу пишется в файл: большие выгрузки
+        уходят из памяти на диск. Возвращает бинарный файл, открытый на чтение
+        с начала; закрыть его должен вызывающий.
+        """
+        if fmt not in EXPORT_WRITERS:
+            raise ValueError(f'Неизвестный формат экспорта: {fmt!r}')
+        
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        try:
+            text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+            with self.pool.connection() as conn:
+                EXPORT_WRITERS[fmt](conn.cursor(), user_id, text)
+            text.flush()
+            # Отвязываем обёртку, чтобы она не закрыла файл вместе с собой
+            text.detach()
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        return output
+
+
+def plural_days(count):
+    """'1 день', '3 дня', '5 дней'"""
+    if count % 10 == 1 and count % 100 != 11:
+        return f"{count} день"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return f"{count} дня"
+    return f"{count} дней"
+
+
+def _duration(minutes):
+    hours, minutes = divmod(minutes or 0, 60)
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+
+
+def _change(current, previous):
+    """Сравнение с прошлым периодом: '+25% к прошлому периоду'"""
+    if not previous:
+        return "в прошлом периоде не было" if current else "как и в прошлом периоде"
+    return f"{(current - previous) / previous:+.0%} к прошлому периоду"
+
+
+# Строк истории в одной порции чтения
+EXPORT_CHUNK = 1000
+# Размер выгрузки, после которого временный файл переносится на диск
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+# Разделы экспорта: (ключ, заголовок, таблица, колонки, порядок строк)
+EXPORT_SECTIONS = [
+    ('health', 'ДАННЫЕ ЗДОРОВЬЯ', 'health_questionnaire',
+     ('age', 'weight', 'height', 'gender', 'fitness_level', 'goals', 'injuries', 'limitations',
+      'medical_conditions', 'sleep_hours', 'stress_level', 'updated_at'), 'user_id'),
+    ('workout', 'ТРЕНИРОВКИ', 'workouts',
+     ('date', 'workout_name', 'duration', 'calories_burned'), 'date, id'),
+    ('nutrition', 'ПИТАНИЕ', 'nutrition',
+     ('date', 'meal_type', 'food_name', 'calories', 'protein', 'carbs', 'fat'), 'date, id'),
+    ('meal', 'ПРИЁМЫ ПИЩИ', 'meals',
+     ('date', 'meal_type', 'food_items', 'total_calories', 'total_protein', 'total_carbs', 'total_fat'), 'date, id'),
+    ('achievement', 'ДОСТИЖЕНИЯ', 'user_achievements',
+     ('earned_at', 'achievement_name', 'earned_xp'), 'earned_at, id'),
+]
+
+# Текстовый формат: подписи анкеты и строка на запись в остальных разделах
+HEALTH_LABELS = [
+    ('age', 'Возраст', ''), ('weight', 'Вес', ' кг'), ('height', 'Рост', ' см'),
+    ('gender', 'Пол', ''), ('fitness_level', 'Уровень подготовки', ''),
+    ('sleep_hours', 'Сон', ' ч'), ('stress_level', 'Стресс', '/10'),
+]
+TEXT_LINES = {
+    'workout': '- {date}: {workout_name}, {duration} мин, {calories_burned} ккал',
+    'nutrition': '- {date} {meal_type}: {food_name}, {calories} ккал (Б {protein} / Ж {fat} / У {carbs})',
+    'meal': '- {date} {meal_type}: {total_calories} ккал (Б {total_protein} / Ж {total_fat} / У {total_carbs})',
+    'achievement': '- {earned_at}: {achievement_name} (+{earned_xp} XP)',
+}
+
+
+def iter_section(cursor, user_id, table, columns, order, chunk=EXPORT_CHUNK):
+    """Строки раздела пользователя, прочитанные порциями по chunk"""
+    cursor.execute(f'SELECT {", ".join(columns)} FROM {table} WHERE user_id = ? ORDER BY {order}', (user_id,))
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            break
+        yield from rows
+
+
+def write_text(cursor, user_id, out):
+    out.write("ФИТНЕС ОТЧЕТ\n")
+    out.write("=" * 50 + "\n\n")
+    for key, title, table, columns, order in EXPORT_SECTIONS:
+        if key == 'health':
+            for row in iter_section(cursor, user_id, table, columns, order):
+                record = dict(zip(columns, row))
+                out.write(f"{title}:\n")
+                for column, label, unit in HEALTH_LABELS:
+                    if record[column] is not None:
+                        out.write(f"{label}: {record[column]}{unit}\n")
+                out.write("\n")
+            continue
         
-        conn.close()
-        return export_data
\ No newline at end of file
+        # Число записей для заголовка - по индексу, без чтения самих строк
+        cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (user_id,))
+        count = cursor.fetchone()[0]
+        if not count:
+            continue
+        out.write(f"{title} ({count}):\n")
+        line = TEXT_LINES[key]
+        for row in iter_section(cursor, user_id, table, columns, order):
+            out.write(line.format(**dict(zip(columns, row))) + "\n")
+        out.write("\n")
+
+
+def write_csv(cursor, user_id, out):
+    """Один CSV на все разделы: у каждого своя строка заголовка, первая колонка - раздел"""
+    writer = csv.writer(out)
+    for key, _, table, columns, order in EXPORT_SECTIONS:
+        header_written = False
+        for row in iter_section(cursor, user_id, table, columns, order):
+            if not header_written:
+                writer.writerow(('section',) + columns)
+                header_written = True
+            writer.writerow((key,) + row)
+
+
+def write_jsonl(cursor, user_id, out):
+    """По объекту JSON на строку: {"section": ..., колонки записи}"""
+    for key, _, table, columns, order in EXPORT_SECTIONS:
+        for row in iter_section(cursor, user_id, table, columns, order):
+            record = {'section': key}
+            record.update(zip(columns, row))
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+EXPORT_WRITERS = {'txt': write_text, 'csv': write_csv, 'jsonl': write_jsonl}
@@ -0,0 +1,128 @@
+# async_db.py
+import asyncio
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class LaneStats:
+    """Счётчики очереди и времени выполнения для одного типа запросов"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pending = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_wait_ms = 0.0
+        self.total_run_ms = 0.0
+        self.max_run_ms = 0.0
+
+    def record(self, wait_ms, run_ms, failed=False):
+        self.calls += 1
+        self.total_wait_ms += wait_ms
+        self.total_run_ms += run_ms
+        self.max_run_ms = max(self.max_run_ms, run_ms)
+        if failed:
+            self.errors += 1
+
+    def as_dict(self):
+        calls = self.calls or 1
+        return {
+            'pending': self.pending,
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_wait_ms': round(self.total_wait_ms / calls, 2),
+            'avg_run_ms': round(self.total_run_ms / calls, 2),
+            'max_run_ms': round(self.max_run_ms, 2),
+        }
+
+
+class AsyncDatabase:
+    """Неблокирующий доступ к базе для async-обработчиков бота.
+
+    Чтение выполняется в пуле потоков, запись - в одном отдельном потоке
+    (SQLite допускает только одного писателя). Глубина каждой очереди
+    ограничена: при переполнении обработчик ждёт, а не копит задачи.
+    """
+
+    def __init__(self, pool, read_workers=None, max_pending_reads=64, max_pending_writes=256,
+                 slow_call_ms=200):
+        self.pool = pool
+        # Одно соединение пула оставляем писателю
+        read_workers = read_workers or max(1, pool.size - 1)
+        self._read_executor = ThreadPoolExecutor(read_workers, thread_name_prefix='db-read')
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='db-write')
+        self._max_pending = {'read': max_pending_reads, 'write': max_pending_writes}
+        self._slots = {}
+        self.slow_call_ms = slow_call_ms
+        self.lanes = {'read': LaneStats('read'), 'write': LaneStats('write')}
+
+    def _lane_slots(self, lane):
+        # Семафоры создаются лениво внутри работающего event loop
+        slots = self._slots.get(lane)
+        if slots is None:
+            slots = asyncio.Semaphore(self._max_pending[lane])
+            self._slots[lane] = slots
+        return slots
+
+    async def _submit(self, lane, executor, fn, args, label):
+        stats = self.lanes[lane]
+        slots = self._lane_slots(lane)
+        queued_at = time.perf_counter()
+
+        started = {}
+
+        def call():
+            started['at'] = time.perf_counter()
+            return fn(*args)
+
+        # pending - все вызовы, ожидающие слот или уже выполняющиеся
+        stats.pending += 1
+        failed = False
+        try:
+            async with slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(executor, call)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            finished = time.perf_counter()
+            stats.pending -= 1
+            start = started.get('at', finished)
+            wait_ms = (start - queued_at) * 1000
+            run_ms = (finished - start) * 1000
+            stats.record(wait_ms, run_ms, failed)
+            if run_ms + wait_ms >= self.slow_call_ms:
+                logger.warning('Медленный запрос к БД [%s] %s: ожидание %.1f мс, выполнение %.1f мс',
+                               lane, label or getattr(fn, '__name__', fn), wait_ms, run_ms)
+
+    async def read(self, fn, *args, label=None):
+        """Выполнение читающей функции fn(*args) вне event loop"""
+        return await self._submit('read', self._read_executor, fn, args, label)
+
+    async def write(self, fn, *args, label=None):
+        """Выполнение пишущей функции fn(*args) в потоке записи"""
+        return await self._submit('write', self._write_executor, fn, args, label)
+
+    async def fetchone(self, query, params=()):
+        return await self.read(self.pool.fetchone, query, params, label=query.strip().split('\n')[0])
+
+    async def fetchall(self, query, params=()):
+        return await self.read(self.pool.fetchall, query, params, label=query.strip().split('\n')[0])
+
+    async def execute(self, query, params=()):
+        return await self.write(self.pool.execute, query, params, label=query.strip().split('\n')[0])
+
+    async def executemany(self, query, seq_of_params):
+        return await self.write(self.pool.executemany, query, seq_of_params, label=query.strip().split('\n')[0])
+
+    def stats(self):
+        return {name: lane.as_dict() for name, lane in self.lanes.items()}
+
+    def close(self):
+        """Дожидаемся уже поставленных запросов и останавливаем потоки"""
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
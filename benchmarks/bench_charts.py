@@ -0,0 +1,67 @@
+# benchmarks/bench_charts.py
+"""Замер отрисовки графиков: графиков в секунду на ядро и на пул процессов.
+
+Запуск: python benchmarks/bench_charts.py [--renders 40] [--workers N]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_service import CALENDAR_WEEKS, CHART_DAYS, DRAWERS, _init_worker, render_chart  # noqa: E402
+
+
+def sample_data(chart, rng):
+    today = date.today()
+    days = [(today - timedelta(days=offset)).isoformat() for offset in range(CHART_DAYS - 1, -1, -1)]
+    if chart == 'weight':
+        return {'dates': days[::5], 'weight': [round(rng.uniform(70, 90), 1) for _ in days[::5]]}
+    if chart == 'calories':
+        return {'dates': days, 'burned': [rng.choice([0, 0, 250, 400]) for _ in days],
+                'consumed': [rng.randint(1500, 2800) for _ in days]}
+    if chart == 'macros':
+        return {'dates': days, 'protein': [rng.uniform(60, 160) for _ in days],
+                'carbs': [rng.uniform(150, 350) for _ in days], 'fat': [rng.uniform(40, 100) for _ in days]}
+    start = today - timedelta(days=today.weekday(), weeks=CALENDAR_WEEKS - 1)
+    return {'start': start.isoformat(), 'counts': [rng.choice([0, 0, 1, 2]) for _ in range(CALENDAR_WEEKS * 7)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--renders', type=int, default=40, help='графиков каждого типа')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    jobs = [(chart, sample_data(chart, rng)) for chart in DRAWERS for _ in range(args.renders)]
+
+    # Одно ядро: отрисовка подряд в этом процессе (первый график - прогрев)
+    _init_worker()
+    render_chart(*jobs[0])
+    for chart in DRAWERS:
+        chart_jobs = [job for job in jobs if job[0] == chart]
+        started = time.perf_counter()
+        sizes = [len(render_chart(*job)) for job in chart_jobs]
+        seconds = time.perf_counter() - started
+        print(f'{chart}: {len(chart_jobs) / seconds:.1f} графиков/с на ядро, '
+              f'{seconds / len(chart_jobs) * 1000:.0f} мс на график, PNG ~{sum(sizes) // len(sizes) // 1024} КБ')
+
+    # Пул процессов, как в ChartService
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as executor:
+        list(executor.map(render_chart, *zip(*jobs[:args.workers])))
+        started = time.perf_counter()
+        list(executor.map(render_chart, *zip(*jobs)))
+        seconds = time.perf_counter() - started
+    print(f'пул из {args.workers} процессов: {len(jobs) / seconds:.1f} графиков/с, '
+          f'{len(jobs) / seconds / args.workers:.1f} на процесс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/bench_health_rules.py
+"""Замер пересчёта рекомендаций по здоровью для всей базы анкет.
+
+Запуск: python benchmarks/bench_health_rules.py [--users 100000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool  # noqa: E402
+from bootstrap import bootstrap  # noqa: E402
+from health_rules import HealthRulesEngine  # noqa: E402
+
+LEVELS = ['beginner', 'intermediate', 'advanced']
+INJURIES = [[], [], [], ['колено'], ['спина', 'плечо']]
+
+
+def populate(pool, count):
+    rng = random.Random(42)
+    rows = []
+    for user_id in range(1, count + 1):
+        rows.append((
+            user_id, rng.randint(16, 75), rng.uniform(45, 130), rng.uniform(150, 200),
+            rng.choice(['male', 'female']), rng.choice(LEVELS), json.dumps(['weight_loss']),
+            json.dumps(rng.choice(INJURIES)), json.dumps([]), '', rng.randint(4, 10), rng.randint(1, 10),
+        ))
+    with pool.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO health_questionnaire
+            (user_id, age, weight, height, gender, fitness_level, goals, injuries, limitations,
+             medical_conditions, sleep_hours, stress_level)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'bench.db'))
+        bootstrap(pool)
+        populate(pool, args.users)
+        engine = HealthRulesEngine(pool)
+
+        # Первый прогон пишет все рекомендации, повторный - только сравнивает
+        for title in ('первый пересчёт', 'повторный пересчёт'):
+            stats = engine.recompute()
+            print(f'{title}: {stats["users"]} пользователей за {stats["seconds"]:.2f} с '
+                  f'({stats["users_per_second"]:.0f} польз./с), добавлено {stats["inserted"]}, '
+                  f'изменено {stats["updated"]}, удалено {stats["deleted"]}')
+
+        # Для сравнения: правила по одной анкете за раз
+        sample = pool.fetchall('SELECT * FROM health_questionnaire LIMIT 1000')
+        columns = [column[1] for column in pool.fetchall('PRAGMA table_info(health_questionnaire)')]
+        started = time.perf_counter()
+        for row in sample:
+            engine.recommend(dict(zip(columns, row)))
+        seconds = time.perf_counter() - started
+        print(f'по одной анкете: {len(sample) / seconds:.0f} польз./с')
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/bench_search.py
+"""Замер скорости полнотекстового поиска продуктов на каталоге из 50k записей.
+
+Запуск: python benchmarks/bench_search.py [--foods 50000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool  # noqa: E402
+from bootstrap import bootstrap  # noqa: E402
+from search_index import CatalogSearch  # noqa: E402
+
+BASES = ['Гречка', 'Овсянка', 'Курица', 'Говядина', 'Творог', 'Йогурт', 'Сыр', 'Рис', 'Лосось',
+         'Брокколи', 'Яблоко', 'Банан', 'Хлеб', 'Макароны', 'Фасоль', 'Чечевица', 'Индейка', 'Кефир']
+MODIFIERS = ['отварная', 'запечённая', 'жареная', 'тушёная', 'сырая', 'домашняя', 'обезжиренная',
+             'цельнозерновая', 'копчёная', 'варёная', 'с овощами', 'с сыром', 'по-деревенски']
+# Обычные запросы (префиксы слов) и запросы с опечатками
+PREFIX_QUERIES = ['греч', 'овс', 'курица запеч', 'твор', 'йогурт домаш', 'лосос', 'макароны с сыр']
+TYPO_QUERIES = ['гречкаа', 'курицв', 'брокколли', 'твoрог', 'чечевеца']
+QUERIES = PREFIX_QUERIES + TYPO_QUERIES
+
+
+def populate(pool, count):
+    rng = random.Random(42)
+    rows = []
+    for i in range(count):
+        name = f'{rng.choice(BASES)} {rng.choice(MODIFIERS)} №{i}'
+        rows.append((name, 'bench', rng.uniform(30, 400), rng.uniform(0, 30), rng.uniform(0, 80), rng.uniform(0, 30)))
+    with pool.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO food_database (name, category, calories, protein, carbs, fat)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--foods', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'bench.db'))
+        bootstrap(pool)
+
+        started = time.perf_counter()
+        populate(pool, args.foods)
+        print(f'Загрузка {args.foods} продуктов (с индексацией триггерами): {time.perf_counter() - started:.2f} с')
+
+        search = CatalogSearch(pool)
+        for query in QUERIES:
+            search.search_foods(query, limit=args.limit)  # прогрев
+
+        timings = {}
+        for i in range(args.queries):
+            query = QUERIES[i % len(QUERIES)]
+            started = time.perf_counter()
+            search.search_foods(query, limit=args.limit)
+            timings.setdefault(query, []).append((time.perf_counter() - started) * 1000)
+
+        print(f'{"запрос":<18}{"p50, мс":>10}{"p99, мс":>10}')
+        for query, values in timings.items():
+            values.sort()
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            print(f'{query:<18}{statistics.median(values):>10.3f}{p99:>10.3f}')
+
+        for title, group in (('префиксы', PREFIX_QUERIES), ('опечатки', TYPO_QUERIES)):
+            values = sorted(v for query in group for v in timings.get(query, []))
+            print(f'Итого ({title}): p50 {statistics.median(values):.3f} мс, '
+                  f'p99 {values[int(len(values) * 0.99)]:.3f} мс')
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
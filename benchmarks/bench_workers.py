@@ -0,0 +1,98 @@
+# benchmarks/bench_workers.py
+"""Замер пропускной способности бота в N рабочих процессах (BOT_WORKERS).
+
+Процессы запускаются, как в run_cluster, против заглушки Bot API из
+load_webhook.py; апдейты маршрутизируются по user_id напрямую, без
+HTTP-приёма. Сначала все пользователи регистрируются (/start), затем
+замеряется, за сколько обрабатываются команды /progress, /profile и /help -
+каждая даёт ровно одно сообщение, по ним и считается завершение.
+
+Запуск: python benchmarks/bench_workers.py [--workers 1,2,4] [--updates 2000] [--users 500]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Update  # noqa: E402
+
+from bootstrap import bootstrap  # noqa: E402
+from db_pool import close_all, get_pool  # noqa: E402
+from load_webhook import StubBotApi, free_port  # noqa: E402
+from worker_pool import DB_PATH, WorkerPool  # noqa: E402
+
+TOKEN = '123456:BENCH'
+COMMANDS = ['/progress', '/profile', '/help']
+
+
+def command(update_id, user_id, text):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'from': user,
+        'chat': {'id': user_id, 'type': 'private'}, 'text': text,
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]}}, None)
+
+
+async def wait_messages(api, count, timeout):
+    deadline = time.monotonic() + timeout
+    while api.messages < count:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'обработано {api.messages} из {count}')
+        await asyncio.sleep(0.01)
+
+
+async def measure(workers, args):
+    os.chdir(tempfile.mkdtemp(prefix='bench_workers_'))
+    api = StubBotApi(args.api_delay / 1000)
+    port = free_port()
+    api.listen(port)
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{port}/bot'
+    # Лимит Telegram здесь не нужен: меряется обработка, а не отправка
+    os.environ['BOT_SEND_RATE'] = '1000000'
+    bootstrap(get_pool(DB_PATH))
+    close_all()
+
+    pool = WorkerPool(TOKEN, workers)
+    await pool.start()
+    try:
+        rng = random.Random(42)
+        users = list(range(1, args.users + 1))
+        for user_id in users:
+            await pool.route(command(user_id, user_id, '/start'))
+        await wait_messages(api, len(users), args.timeout)
+
+        expected = api.messages + args.updates
+        started = time.perf_counter()
+        for offset in range(args.updates):
+            await pool.route(command(args.users + offset + 1, rng.choice(users), rng.choice(COMMANDS)))
+        await wait_messages(api, expected, args.timeout)
+        return args.updates / (time.perf_counter() - started)
+    finally:
+        await pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default=f'1,2,{max(2, os.cpu_count() or 1)}')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--api-delay', type=float, default=0, help='время ответа Bot API, мс')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    print(f'ядер: {os.cpu_count()}')
+    baseline = None
+    for workers in sorted({int(value) for value in args.workers.split(',')}):
+        rate = asyncio.run(measure(workers, args))
+        baseline = baseline or rate
+        print(f'{workers} процесс(ов): {rate:.0f} апдейтов/с, x{rate / baseline:.2f} к одному процессу')
+
+
+if __name__ == '__main__':
+    main()
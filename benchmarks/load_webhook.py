@@ -0,0 +1,241 @@
+# benchmarks/load_webhook.py
+"""Нагрузочный тест: задержка обработки апдейтов в режимах webhook и long polling.
+
+Бот запускается локально во временном каталоге против заглушки Bot API
+(TELEGRAM_API_URL), сеть не нужна. Синтетические апдейты (/start, /progress,
+/profile, текст и нажатия кнопок) поступают с заданной частотой: в режиме
+webhook - POST на сервер бота, в режиме polling - в очередь getUpdates
+заглушки. Задержка - от появления апдейта до завершения всех обработчиков.
+
+Запуск: python benchmarks/load_webhook.py [--updates 300] [--rate 10] [--users 100]
+        [--api-delay 30] [--mode both|webhook|polling]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOKEN = '123456:LOADTEST'
+COMMANDS = ['/start', '/progress', '/profile', '/help']
+CALLBACKS = ['leaderboard', 'detailed_stats', 'progress_view']
+TEXTS = ['привет', 'что поесть на ужин', 'хочу похудеть']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_updates(count, users, rng):
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = rng.randint(1, users)
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        chat = {'id': user_id, 'type': 'private'}
+        kind = rng.random()
+        if kind < 0.6:
+            text = rng.choice(COMMANDS)
+            message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user,
+                       'text': text, 'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]}
+            updates.append({'update_id': update_id, 'message': message})
+        elif kind < 0.8:
+            message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user,
+                       'text': rng.choice(TEXTS)}
+            updates.append({'update_id': update_id, 'message': message})
+        else:
+            message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'text': 'меню'}
+            updates.append({'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                'data': rng.choice(CALLBACKS), 'message': message}})
+    return updates
+
+
+class StubBotApi:
+    """Заглушка Bot API: отвечает как Telegram и отдаёт апдейты через getUpdates"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.updates = []
+        self.published = {}
+        self.calls = 0
+        self.messages = 0
+        self._arrived = asyncio.Event()
+        self._message_id = 0
+
+    def publish(self, update):
+        self.published[update['update_id']] = time.perf_counter()
+        self.updates.append(update)
+        self._arrived.set()
+
+    async def get_updates(self, offset, timeout):
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    def message(self, chat_id, text):
+        self._message_id += 1
+        self.messages += 1
+        return {'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': int(chat_id), 'type': 'private'}, 'text': text or ''}
+
+    def listen(self, port):
+        import tornado.web
+
+        stub = self
+
+        class Handler(tornado.web.RequestHandler):
+            async def post(self, method):
+                stub.calls += 1
+                if method == 'getUpdates':
+                    result = await stub.get_updates(int(self.get_body_argument('offset', 0)),
+                                                    float(self.get_body_argument('timeout', 0)))
+                elif method == 'getMe':
+                    result = {'id': 123456, 'is_bot': True, 'first_name': 'Load', 'username': 'load_bot'}
+                elif method.startswith(('send', 'edit')):
+                    result = stub.message(self.get_body_argument('chat_id', 0), self.get_body_argument('text', ''))
+                else:
+                    result = True
+                # Время ответа Telegram, в том числе на getUpdates с новыми апдейтами
+                await asyncio.sleep(stub.delay)
+                self.set_header('Content-Type', 'application/json')
+                self.finish(json.dumps({'ok': True, 'result': result}))
+
+        tornado.web.Application([(r'/bot[^/]+/(\w+)', Handler)]).listen(port, '127.0.0.1')
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def run_mode(mode, args):
+    """Один режим в отдельном процессе: свой каталог, своя база"""
+    os.chdir(tempfile.mkdtemp(prefix='load_webhook_'))
+    api = StubBotApi(args.api_delay / 1000)
+    api_port = free_port()
+    api.listen(api_port)
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{api_port}/bot'
+
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from main import FitnessBot
+    from webhook_server import LAST_GROUP, webhook_config
+
+    bot = FitnessBot(TOKEN)
+    updates = make_updates(args.updates, args.users, random.Random(42))
+    finished = {}
+    all_done = asyncio.Event()
+
+    async def on_done(update, context):
+        finished[update.update_id] = time.perf_counter()
+        if len(finished) == len(updates):
+            all_done.set()
+
+    bot.application.add_handler(TypeHandler(Update, on_done), group=LAST_GROUP + 1)
+
+    sent = {}
+    if mode == 'webhook':
+        import httpx
+
+        port = free_port()
+        config = webhook_config(TOKEN, {'BOT_MODE': 'webhook', 'WEBHOOK_URL': f'http://127.0.0.1:{port}',
+                                        'WEBHOOK_LISTEN': '127.0.0.1', 'PORT': str(port)})
+        stop = asyncio.Event()
+        serving = asyncio.create_task(bot.run_webhook(config, stop))
+        async with httpx.AsyncClient(timeout=30) as client:
+            while True:
+                try:
+                    if (await client.get(f'http://127.0.0.1:{port}/health')).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+
+            async def post(update):
+                sent[update['update_id']] = time.perf_counter()
+                await client.post(config['url'], json=update,
+                                  headers={'X-Telegram-Bot-Api-Secret-Token': config['secret']})
+
+            posts = []
+            started = time.perf_counter()
+            for index, update in enumerate(updates):
+                await asyncio.sleep(max(0.0, started + index / args.rate - time.perf_counter()))
+                posts.append(asyncio.create_task(post(update)))
+            await asyncio.gather(*posts)
+            await asyncio.wait_for(all_done.wait(), args.timeout)
+            health = (await client.get(f'http://127.0.0.1:{port}/health')).json()
+        stop.set()
+        await serving
+    else:
+        application = bot.application
+        await application.initialize()
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+        await application.start()
+        started = time.perf_counter()
+        for index, update in enumerate(updates):
+            await asyncio.sleep(max(0.0, started + index / args.rate - time.perf_counter()))
+            api.publish(update)
+        await asyncio.wait_for(all_done.wait(), args.timeout)
+        sent = api.published
+        health = bot.update_metrics.stats()
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await bot.on_shutdown(application)
+
+    latencies = sorted(finished[update_id] - sent[update_id] for update_id in finished)
+    return {
+        'mode': mode,
+        'updates': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1),
+        'handler_p50_ms': health['handler_p50_ms'],
+        'handler_p99_ms': health['handler_p99_ms'],
+        'api_calls': api.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=10, help='апдейтов в секунду')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--api-delay', type=float, default=30, help='время ответа Bot API, мс')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--mode', choices=['both', 'webhook', 'polling'], default='both')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_mode(args.mode, args))))
+        return
+
+    modes = ['webhook', 'polling'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        command = [sys.executable, os.path.abspath(__file__), '--child', '--mode', mode, '--updates',
+                   str(args.updates), '--rate', str(args.rate), '--users', str(args.users),
+                   '--api-delay', str(args.api_delay), '--timeout', str(args.timeout)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode}: {result['updates']} апдейтов, до конца обработки p50 {result['p50_ms']} мс, "
+              f"p99 {result['p99_ms']} мс, max {result['max_ms']} мс; обработчики p50 "
+              f"{result['handler_p50_ms']} мс, p99 {result['handler_p99_ms']} мс; запросов к API {result['api_calls']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# bootstrap.py
+import threading
+import time
+import logging
+
+from migrations import LATEST_VERSION, current_version, migrate
+from seeds import SEED_VERSION, apply_seeds
+
+logger = logging.getLogger(__name__)
+
+_reports = {}
+_bootstrap_lock = threading.Lock()
+
+
+def get_meta(cursor, key):
+    cursor.execute('SELECT value FROM app_meta WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_meta(cursor, key, value):
+    cursor.execute('''
+        INSERT INTO app_meta (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, str(value)))
+
+
+def _run_phases(pool):
+    report = {}
+
+    # Фаза 1: первое соединение с настройкой PRAGMA
+    started = time.perf_counter()
+    version = current_version(pool)
+    report['connect_ms'] = (time.perf_counter() - started) * 1000
+
+    # Фаза 2: миграции схемы - только если база отстаёт
+    started = time.perf_counter()
+    report['schema_skipped'] = version >= LATEST_VERSION
+    if not report['schema_skipped']:
+        migrate(pool)
+    report['schema_ms'] = (time.perf_counter() - started) * 1000
+
+    # Фаза 3: стартовые данные - только если изменилась их версия
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        seeded_version = int(get_meta(conn.cursor(), 'seed_version') or 0)
+    report['seed_skipped'] = seeded_version >= SEED_VERSION
+    if not report['seed_skipped']:
+        with pool.transaction() as cursor:
+            # Перепроверяем под блокировкой записи
+            if int(get_meta(cursor, 'seed_version') or 0) < SEED_VERSION:
+                apply_seeds(cursor)
+                set_meta(cursor, 'seed_version', SEED_VERSION)
+    report['seed_ms'] = (time.perf_counter() - started) * 1000
+
+    report['total_ms'] = report['connect_ms'] + report['schema_ms'] + report['seed_ms']
+    return report
+
+
+def bootstrap(pool):
+    """Однократная (на процесс) подготовка базы: схема и стартовые данные.
+
+    На уже инициализированной базе сводится к двум чтениям версий.
+    Возвращает время каждой фазы в миллисекундах.
+    """
+    with _bootstrap_lock:
+        report = _reports.get(pool.db_path)
+        if report is None:
+            report = _run_phases(pool)
+            _reports[pool.db_path] = report
+            logger.info(
+                'Инициализация БД %s за %.1f мс: соединение %.1f мс, схема %.1f мс%s, данные %.1f мс%s',
+                pool.db_path, report['total_ms'], report['connect_ms'],
+                report['schema_ms'], ' (пропущено)' if report['schema_skipped'] else '',
+                report['seed_ms'], ' (пропущено)' if report['seed_skipped'] else '',
+            )
+        return report
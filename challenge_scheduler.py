@@ -0,0 +1,103 @@
+# challenge_scheduler.py
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from challenge_system import challenge_window
+from leaderboard import challenge_board_key
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять границы окон, секунд: проверка - одно чтение,
+# так что смена окна запаздывает не больше чем на интервал
+ROLLOVER_INTERVAL = 900
+# Участий в одной транзакции и пауза между порциями, секунд
+ROLLOVER_SLICE = 500
+ROLLOVER_PAUSE = 0.05
+
+
+class ChallengeScheduler:
+    """Смена окон ежедневных, еженедельных и ежемесячных челленджей.
+
+    Работает в JobQueue приложения. Архивация и сброс участий идут
+    небольшими транзакциями с паузами, чтобы очередь записи не простаивала
+    для обработчиков апдейтов; новое окно открывается последним и сразу
+    засчитывает события, записанные с его начала.
+    """
+
+    def __init__(self, challenges, adb, leaderboards=None,
+                 slice_size=ROLLOVER_SLICE, pause=ROLLOVER_PAUSE):
+        self.challenges = challenges
+        self.adb = adb
+        self.leaderboards = leaderboards
+        self.slice_size = slice_size
+        self.pause = pause
+        self._running = False
+        self.last_run = None
+
+    def schedule(self, job_queue, interval=ROLLOVER_INTERVAL):
+        # Первый запуск вскоре после старта: догоняем окна, закончившиеся во время простоя
+        job_queue.run_repeating(self.run, interval=interval, first=10, name='challenge-rollover')
+
+    async def run(self, context=None):
+        """Одна проверка и смена окон; возвращает итоги или None, если менять нечего"""
+        if self._running:
+            return None
+        self._running = True
+        try:
+            return await self._rollover(date.today())
+        finally:
+            self._running = False
+
+    async def _rollover(self, today):
+        started_at = datetime.now()
+        started = time.perf_counter()
+        due = await self.adb.read(self.challenges.challenges_to_roll, today)
+        if not due:
+            return None
+
+        archived = slices = 0
+        for challenge_id, challenge_type, start_date, end_date in due:
+            window_start, window_end = challenge_window(challenge_type, today)
+            if end_date is not None and end_date >= today.isoformat():
+                # Окно уже открыто, но в нём остались участия из прошлого - дочищаем их
+                window_start, window_end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+                old_window = (None, None)
+            else:
+                old_window = (start_date, end_date)
+            if old_window[1] is None:
+                # Границы прошлого окна не сохранились - это предыдущее окно того же типа
+                previous = challenge_window(challenge_type, window_start - timedelta(days=1))
+                old_window = (previous[0].isoformat(), previous[1].isoformat())
+
+            # Сначала архивация и сброс при старом окне: события нового окна
+            # не смешиваются с прогрессом прошлого
+            while True:
+                count = await self.adb.write(self.challenges.archive_slice, challenge_id,
+                                             old_window, window_start, self.slice_size)
+                if not count:
+                    break
+                archived += count
+                slices += 1
+                await asyncio.sleep(self.pause)
+
+            if self.leaderboards is not None:
+                await self.adb.write(self.leaderboards.drop_board, challenge_board_key(challenge_id))
+            # Открытие окна и пересчёт событий, записанных после его начала, - одна транзакция
+            await self.adb.write(self.challenges.open_window, challenge_id, window_start, window_end)
+            if self.leaderboards is not None:
+                await self.adb.read(self.leaderboards.sync_challenge, challenge_id)
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        await self.adb.write(self.challenges.record_rollover, started_at, duration_ms, len(due), archived, slices)
+        self.last_run = {
+            'started_at': started_at,
+            'duration_ms': duration_ms,
+            'challenges': len(due),
+            'archived': archived,
+            'slices': slices,
+        }
+        logger.info('Смена окон челленджей: %d челленджей, в архив %d участий (%d порций) за %.1f мс',
+                    len(due), archived, slices, duration_ms)
+        return self.last_run
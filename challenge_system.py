@@ -1,160 +1,367 @@
 # challenge_system.py
-import sqlite3
-import json
-from datetime import datetime, timedelta
-import random
+from datetime import date, timedelta
+from db_pool import get_pool
+from bootstrap import bootstrap
+from progression import get_progression
+
+# Правила достижений: запрос возвращает user_id всех, кто заслужил достижение.
+# {users} - фильтр по пачке проверяемых пользователей.
+# weight_milestone (рекорд в жиме) выдаётся только вручную через
+# grant_achievement: рабочие веса по упражнениям пока нигде не записываются
+ACHIEVEMENT_RULES = {
+    'first_workout': 'SELECT DISTINCT user_id FROM workouts WHERE {users}',
+    'week_streak': 'SELECT user_id FROM user_levels WHERE streak_days >= 7 AND {users}',
+    'month_streak': 'SELECT user_id FROM user_levels WHERE streak_days >= 30 AND {users}',
+    # 10 тренировок в одном календарном месяце
+    'consistent_training': '''
+        SELECT DISTINCT user_id FROM workouts WHERE {users}
+        GROUP BY user_id, strftime('%Y-%m', date) HAVING COUNT(*) >= 10
+    ''',
+}
+
+# Вклад одной записи в прогресс челленджей каждого goal_type.
+# Тренировка: (user_id, workout_name, duration, calories_burned, date);
+# приём пищи: (user_id, date, meal_type, food_items, calories, ...).
+WORKOUT_GOALS = {
+    'workouts': lambda workout: 1,
+    'calories': lambda workout: workout[3] or 0,
+}
+MEAL_GOALS = {
+    'meals': lambda meal: 1,
+}
+# goal_type, прогресс которых обновляется. Для 'reps' и 'weight' событий нет
+# (повторы и рабочие веса не записываются) - такие челленджи не показываются
+# и в них нельзя вступить
+TRACKED_GOALS = tuple(WORKOUT_GOALS) + tuple(MEAL_GOALS) + ('streak',)
+TRACKED_FILTER = f"goal_type IN ({', '.join('?' * len(TRACKED_GOALS))})"
+WORKOUT_DATE, MEAL_DATE = 4, 1
+
+# Типы челленджей с повторяющимися окнами
+RECURRING_TYPES = ('daily', 'weekly', 'monthly')
+
+
+def challenge_window(challenge_type, today=None):
+    """(первый, последний день) текущего окна челленджа"""
+    today = today or date.today()
+    if challenge_type == 'daily':
+        return today, today
+    if challenge_type == 'weekly':
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=6)
+    if challenge_type == 'monthly':
+        start = today.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    raise ValueError(f'У челленджа типа {challenge_type!r} нет окон')
+
+
+def progress_events(rows, goals, date_index):
+    """Записи -> [(user_id, goal_type, дата, прирост)], сгруппированные по дню"""
+    events = {}
+    for row in rows:
+        day = str(row[date_index])[:10]
+        for goal_type, amount in goals.items():
+            key = (row[0], goal_type, day)
+            events[key] = events.get(key, 0) + amount(row)
+    return [key + (amount,) for key, amount in events.items() if amount]
+
 
 class ChallengeSystem:
     def __init__(self, db_path='fitness_bot.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.progression = get_progression(self.pool)
         self.init_challenge_tables()
     
     def init_challenge_tables(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Челенджи
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS challenges (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                challenge_type TEXT, -- 'daily', 'weekly', 'monthly', 'special'
-                goal_type TEXT, -- 'reps', 'weight', 'workouts', 'streak'
-                goal_value INTEGER,
-                reward_xp INTEGER,
-                difficulty TEXT,
-                start_date DATE,
-                end_date DATE,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        bootstrap(self.pool)
+    
+    def check_achievements(self, user_id):
+        """Проверка и выдача достижений"""
+        return self.evaluate_achievements([user_id])
+    
+    def evaluate_achievements(self, user_ids=None):
+        """Проверка всех правил достижений для пачки пользователей (или для всех).
         
-        # Достижения пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                achievement_type TEXT,
-                achievement_name TEXT,
-                achievement_data TEXT,
-                earned_xp INTEGER,
-                earned_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        Возвращает новые достижения: [(user_id, achievement_type, achievement_name, earned_xp)]
+        """
+        with self.pool.transaction() as cursor:
+            return self.grant_earned_achievements(cursor, user_ids)
+    
+    def on_workouts(self, cursor, workouts):
+        """Слушатель WriteBatcher: прогресс челленджей и достижения
+        авторов только что записанных тренировок"""
+        events = progress_events(workouts, WORKOUT_GOALS, WORKOUT_DATE)
+        self.apply_progress(cursor, events, streak_users={workout[0] for workout in workouts})
+        self.grant_earned_achievements(cursor, {workout[0] for workout in workouts})
+    
+    def on_meals(self, cursor, meals):
+        """Слушатель WriteBatcher: прогресс челленджей по приёмам пищи"""
+        self.apply_progress(cursor, progress_events(meals, MEAL_GOALS, MEAL_DATE))
+    
+    def apply_progress(self, cursor, events, streak_users=(), challenge_id=None):
+        """Инкрементальное обновление прогресса в открытой транзакции.
         
-        # Прогресс по челенджам
+        Прирост получают только незавершённые челленджи пользователя с тем же
+        goal_type, если событие попадает в окно челленджа и случилось не
+        раньше вступления; challenge_id - только этот челлендж. Челленджи на
+        серию берут из user_levels дни текущей серии начиная с вступления.
+        Возвращает завершённые сейчас: [(user_id, challenge_id)]
+        """
+        only = 'AND uc.challenge_id = ?' if challenge_id is not None else ''
+        only_params = (challenge_id,) if challenge_id is not None else ()
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_challenges (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                challenge_id INTEGER,
-                current_progress INTEGER DEFAULT 0,
-                is_completed BOOLEAN DEFAULT FALSE,
-                completed_at DATETIME,
-                joined_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            CREATE TEMP TABLE IF NOT EXISTS challenge_events (
+                user_id INTEGER, goal_type TEXT, date TEXT, amount INTEGER
             )
         ''')
+        cursor.execute('DELETE FROM temp.challenge_events')
+        cursor.executemany('INSERT INTO temp.challenge_events VALUES (?, ?, ?, ?)', events)
         
-        # Уровни и опыт
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_levels (
-                user_id INTEGER PRIMARY KEY,
-                total_xp INTEGER DEFAULT 0,
-                current_level INTEGER DEFAULT 1,
-                workouts_completed INTEGER DEFAULT 0,
-                streak_days INTEGER DEFAULT 0,
-                last_workout_date DATE,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        cursor.execute(f'''
+            UPDATE user_challenges AS uc SET
+                current_progress = COALESCE(uc.current_progress, 0) + e.amount,
+                is_completed = COALESCE(uc.current_progress, 0) + e.amount >= e.goal_value,
+                completed_at = CASE WHEN COALESCE(uc.current_progress, 0) + e.amount >= e.goal_value
+                                    THEN CURRENT_TIMESTAMP END
+            FROM (
+                SELECT j.id, c.goal_value, SUM(ev.amount) AS amount
+                FROM temp.challenge_events ev
+                JOIN user_challenges j ON j.user_id = ev.user_id AND NOT COALESCE(j.is_completed, 0)
+                JOIN challenges c ON c.id = j.challenge_id AND c.goal_type = ev.goal_type
+                WHERE ev.date >= date(j.joined_at)
+                  AND (c.start_date IS NULL OR ev.date >= c.start_date)
+                  AND (c.end_date IS NULL OR ev.date <= c.end_date)
+                GROUP BY j.id
+            ) e
+            WHERE uc.id = e.id {only}
+            RETURNING user_id, challenge_id, current_progress, is_completed
+        ''', only_params)
+        updated = cursor.fetchall()
         
-        # Инициализация базовых челенджей
-        self.initialize_default_challenges(cursor)
+        streak_users = list(streak_users)
+        if streak_users:
+            # Засчитываются только дни серии с вступления (и с начала окна):
+            # серия, набранная раньше, не завершает челлендж сразу после вступления
+            cursor.execute(f'''
+                UPDATE user_challenges AS uc SET
+                    current_progress = s.days,
+                    is_completed = s.days >= s.goal_value,
+                    completed_at = CASE WHEN s.days >= s.goal_value THEN CURRENT_TIMESTAMP END
+                FROM (
+                    SELECT j.id, c.goal_value,
+                           MIN(l.streak_days, CAST(julianday(l.last_workout_date) - julianday(
+                               MAX(date(j.joined_at), COALESCE(c.start_date, ''))) AS INTEGER) + 1) AS days
+                    FROM user_challenges j
+                    JOIN challenges c ON c.id = j.challenge_id AND c.goal_type = 'streak'
+                    JOIN user_levels l ON l.user_id = j.user_id
+                    WHERE NOT COALESCE(j.is_completed, 0)
+                      AND j.user_id IN ({', '.join('?' * len(streak_users))})
+                ) s
+                WHERE uc.id = s.id AND s.days > COALESCE(uc.current_progress, 0) {only}
+                RETURNING user_id, challenge_id, current_progress, is_completed
+            ''', streak_users + list(only_params))
+            updated += cursor.fetchall()
         
-        conn.commit()
-        conn.close()
+        completed = [(user_id, challenge_id) for user_id, challenge_id, _, done in updated if done]
+        if completed:
+            challenge_ids = sorted({challenge_id for _, challenge_id in completed})
+            cursor.execute(f'''
+                SELECT id, reward_xp FROM challenges WHERE id IN ({', '.join('?' * len(challenge_ids))})
+            ''', challenge_ids)
+            rewards = dict(cursor.fetchall())
+            self.progression.award_xp(cursor, [(user_id, rewards.get(challenge_id)) for user_id, challenge_id in completed])
+        return completed
     
-    def initialize_default_challenges(self, cursor):
-        """Инициализация базовых челенджей и достижений"""
-        
-        # Еженедельные челенджи
-        weekly_challenges = [
-            ('Силовая неделя', 'Выполните 5 тренировок за неделю', 'weekly', 'workouts', 5, 250, 'medium'),
-            ('Отжимания мастер', 'Сделайте 200 отжиманий за неделю', 'weekly', 'reps', 200, 150, 'easy'),
-            ('Стальной пресс', '100 скручиваний за неделю', 'weekly', 'reps', 100, 120, 'easy'),
-        ]
+    def join_challenge(self, user_id, challenge_id):
+        """Вступление в челлендж, False - если пользователь уже участвует.
         
-        for challenge in weekly_challenges:
-            cursor.execute('''
-                INSERT OR IGNORE INTO challenges 
-                (name, description, challenge_type, goal_type, goal_value, reward_xp, difficulty)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', challenge)
-        
-        # Достижения
-        achievements = [
-            ('first_workout', 'Первая тренировка', 'Выполнили первую тренировку', 50),
-            ('week_streak', 'Неделя тренировок', '7 дней подряд без пропусков', 100),
-            ('month_streak', 'Месяц тренировок', '30 дней регулярных тренировок', 500),
-            ('weight_milestone', 'Весовой рубеж', 'Побили личный рекорд в жиме', 200),
-            ('consistent_training', 'Стабильность', '10 тренировок в месяц', 300),
-        ]
-        
-        for achievement in achievements:
-            cursor.execute('''
-                INSERT OR IGNORE INTO achievements_template 
-                (achievement_type, achievement_name, description, reward_xp)
-                VALUES (?, ?, ?, ?)
-            ''', achievement)
+        Участие одно на всё время, в том числе после завершения челленджа:
+        повторное вступление снова давало бы reward_xp.
+        """
+        with self.pool.transaction() as cursor:
+            cursor.execute(f'''
+                INSERT INTO user_challenges (user_id, challenge_id)
+                SELECT ?, id FROM challenges
+                WHERE id = ? AND is_active AND {TRACKED_FILTER} AND NOT EXISTS (
+                    SELECT 1 FROM user_challenges
+                    WHERE user_id = ? AND challenge_id = ?
+                )
+            ''', (user_id, challenge_id) + TRACKED_GOALS + (user_id, challenge_id))
+            return cursor.rowcount > 0
     
-    def check_achievements(self, user_id):
-        """Проверка и выдача достижений"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Проверяем различные достижения
-        achievements_to_check = [
-            self.check_streak_achievement(user_id, cursor),
-            self.check_workout_count_achievement(user_id, cursor),
-            self.check_weight_achievement(user_id, cursor),
-        ]
+    def get_available_challenges(self, user_id):
+        """Активные челленджи, в которых пользователь не участвует и не участвовал"""
+        return self.pool.fetchall(f'''
+            SELECT id, name, description, goal_type, goal_value, reward_xp
+            FROM challenges c
+            WHERE is_active AND {TRACKED_FILTER} AND NOT EXISTS (
+                SELECT 1 FROM user_challenges uc
+                WHERE uc.user_id = ? AND uc.challenge_id = c.id
+            )
+            ORDER BY id
+        ''', TRACKED_GOALS + (user_id,))
+    
+    def get_user_challenges(self, user_id):
+        """Челленджи пользователя с прогрессом - одно чтение по индексу (user_id, challenge_id)"""
+        return self.pool.fetchall(f'''
+            SELECT c.id, c.name, c.description, c.goal_type, c.goal_value, c.reward_xp,
+                   COALESCE(uc.current_progress, 0), COALESCE(uc.is_completed, 0)
+            FROM user_challenges uc
+            JOIN challenges c ON c.id = uc.challenge_id AND c.{TRACKED_FILTER}
+            WHERE uc.user_id = ?
+            ORDER BY COALESCE(uc.is_completed, 0), uc.id
+        ''', TRACKED_GOALS + (user_id,))
+    
+    def grant_earned_achievements(self, cursor, user_ids=None):
+        """Выдача заслуженных достижений в открытой транзакции.
         
-        new_achievements = [a for a in achievements_to_check if a]
+        Все правила проверяются одним INSERT ... SELECT, поэтому число
+        запросов не зависит ни от числа пользователей, ни от числа правил.
+        """
+        if user_ids is None:
+            users = '1'
+        else:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS achievement_batch (user_id INTEGER PRIMARY KEY)')
+            cursor.execute('DELETE FROM temp.achievement_batch')
+            cursor.executemany('INSERT OR IGNORE INTO temp.achievement_batch VALUES (?)',
+                               [(user_id,) for user_id in user_ids])
+            users = 'user_id IN (SELECT user_id FROM temp.achievement_batch)'
         
-        conn.close()
-        return new_achievements
-    
-    def check_streak_achievement(self, user_id, cursor):
-        """Проверка достижений по серии тренировок"""
-        cursor.execute('''
-            SELECT streak_days FROM user_levels WHERE user_id = ?
-        ''', (user_id,))
+        earned = ' UNION ALL '.join(
+            f"SELECT user_id, '{achievement_type}' AS achievement_type FROM ({query.format(users=users)})"
+            for achievement_type, query in ACHIEVEMENT_RULES.items()
+        )
+        cursor.execute(f'''
+            INSERT INTO user_achievements (user_id, achievement_type, achievement_name, earned_xp)
+            SELECT e.user_id, t.achievement_type, t.achievement_name, t.reward_xp
+            FROM ({earned}) e
+            JOIN achievements_template t ON t.achievement_type = e.achievement_type
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_achievements ua
+                WHERE ua.user_id = e.user_id AND ua.achievement_type = e.achievement_type
+            )
+            RETURNING user_id, achievement_type, achievement_name, earned_xp
+        ''')
+        granted = cursor.fetchall()
         
-        result = cursor.fetchone()
-        if result:
-            streak_days = result[0]
-            
-            if streak_days >= 7:
-                self.grant_achievement(user_id, 'week_streak', cursor)
-            if streak_days >= 30:
-                self.grant_achievement(user_id, 'month_streak', cursor)
+        self.progression.award_xp(cursor, [(user_id, xp) for user_id, _, _, xp in granted])
+        return granted
     
     def grant_achievement(self, user_id, achievement_type, cursor):
         """Выдача достижения пользователю"""
         cursor.execute('''
-            SELECT * FROM user_achievements 
-            WHERE user_id = ? AND achievement_type = ?
+            INSERT INTO user_achievements (user_id, achievement_type, achievement_name, earned_xp)
+            SELECT ?, achievement_type, achievement_name, reward_xp 
+            FROM achievements_template 
+            WHERE achievement_type = ?
+            ON CONFLICT(user_id, achievement_type) DO NOTHING
+            RETURNING earned_xp
         ''', (user_id, achievement_type))
         
-        if not cursor.fetchone():
+        row = cursor.fetchone()
+        if row:
+            self.progression.award_xp(cursor, [(user_id, row[0])])
+            return True
+        return False
+    
+    def challenges_to_roll(self, today=None):
+        """Повторяющиеся челленджи, которым нужна смена окна: окно закончилось
+        или не открыто, либо остались участия из прошлого окна (прерванный
+        запуск). [(id, challenge_type, start_date, end_date)]"""
+        today = (today or date.today()).isoformat()
+        return self.pool.fetchall(f'''
+            SELECT id, challenge_type, start_date, end_date FROM challenges c
+            WHERE is_active AND challenge_type IN ({', '.join('?' * len(RECURRING_TYPES))}) AND {TRACKED_FILTER}
+              AND (end_date IS NULL OR end_date < ? OR EXISTS (
+                  SELECT 1 FROM user_challenges uc
+                  WHERE uc.challenge_id = c.id AND uc.joined_at < c.start_date
+              ))
+            ORDER BY id
+        ''', RECURRING_TYPES + TRACKED_GOALS + (today,))
+    
+    def archive_slice(self, challenge_id, old_window, window_start, limit=500):
+        """Архивация и сброс следующей порции участий в закончившемся окне.
+        
+        Вызывается до open_window: пока в челлендже старое окно, события после
+        его конца прогресс не меняют, и сброс ничего не теряет. old_window -
+        (start_date, end_date) закончившегося окна. Обработанные строки
+        получают joined_at = начало нового окна, поэтому повторный запуск
+        после сбоя продолжит с того же места. Возвращает число обработанных
+        строк (0 - окно разобрано полностью).
+        """
+        new_start = window_start.isoformat()
+        with self.pool.transaction() as cursor:
             cursor.execute('''
-                INSERT INTO user_achievements (user_id, achievement_type, achievement_name, earned_xp)
-                SELECT ?, achievement_type, achievement_name, reward_xp 
-                FROM achievements_template 
-                WHERE achievement_type = ?
-            ''', (user_id, achievement_type))
+                SELECT id FROM user_challenges
+                WHERE challenge_id = ? AND (joined_at IS NULL OR joined_at < ?)
+                ORDER BY id LIMIT ?
+            ''', (challenge_id, new_start, limit))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return 0
             
-            return True
-        return False
\ No newline at end of file
+            placeholders = ', '.join('?' * len(ids))
+            cursor.execute(f'''
+                INSERT INTO user_challenges_archive
+                (user_challenge_id, user_id, challenge_id, current_progress, is_completed,
+                 completed_at, joined_at, window_start, window_end)
+                SELECT id, user_id, challenge_id, current_progress, is_completed,
+                       completed_at, joined_at, ?, ?
+                FROM user_challenges WHERE id IN ({placeholders})
+            ''', list(old_window) + ids)
+            # Участники остаются в челлендже и начинают новое окно с нуля
+            cursor.execute(f'''
+                UPDATE user_challenges
+                SET current_progress = 0, is_completed = 0, completed_at = NULL, joined_at = ?
+                WHERE id IN ({placeholders})
+            ''', [new_start] + ids)
+            return len(ids)
+    
+    def open_window(self, challenge_id, window_start, window_end):
+        """Новое окно челленджа после архивации всех участий прошлого.
+        
+        В той же транзакции прогресс незавершённых участий пересчитывается
+        по тренировкам и приёмам пищи, уже записанным в новом окне: события
+        между концом окна и сменой иначе не попали бы ни в одно окно.
+        Возвращает завершённые при пересчёте: [(user_id, challenge_id)]
+        """
+        start, end = window_start.isoformat(), (window_end + timedelta(days=1)).isoformat()
+        with self.pool.transaction() as cursor:
+            cursor.execute('''
+                UPDATE challenges SET start_date = ?, end_date = ? WHERE id = ?
+                RETURNING goal_type
+            ''', (start, window_end.isoformat(), challenge_id))
+            goal_type = cursor.fetchone()[0]
+            cursor.execute('''
+                UPDATE user_challenges SET current_progress = 0
+                WHERE challenge_id = ? AND NOT COALESCE(is_completed, 0)
+            ''', (challenge_id,))
+            
+            members = 'user_id IN (SELECT user_id FROM user_challenges WHERE challenge_id = ?)'
+            if goal_type in WORKOUT_GOALS:
+                cursor.execute(f'''
+                    SELECT user_id, workout_name, duration, calories_burned, date FROM workouts
+                    WHERE {members} AND date >= ? AND date < ?
+                ''', (challenge_id, start, end))
+                events = progress_events(cursor.fetchall(), {goal_type: WORKOUT_GOALS[goal_type]}, WORKOUT_DATE)
+            elif goal_type in MEAL_GOALS:
+                cursor.execute(f'''
+                    SELECT user_id, date FROM meals
+                    WHERE {members} AND date >= ? AND date < ?
+                ''', (challenge_id, start, end))
+                events = progress_events(cursor.fetchall(), {goal_type: MEAL_GOALS[goal_type]}, MEAL_DATE)
+            else:
+                events = []
+            
+            streak_users = ()
+            if goal_type == 'streak':
+                cursor.execute('SELECT user_id FROM user_challenges WHERE challenge_id = ?', (challenge_id,))
+                streak_users = [row[0] for row in cursor.fetchall()]
+            return self.apply_progress(cursor, events, streak_users, challenge_id=challenge_id)
+    
+    def record_rollover(self, started_at, duration_ms, challenges, archived, slices):
+        self.pool.execute('''
+            INSERT INTO challenge_rollovers (started_at, duration_ms, challenges, archived, slices)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (started_at, duration_ms, challenges, archived, slices))
@@ -0,0 +1,248 @@
+# chart_service.py
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from metrics_store import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Периоды графиков
+CHART_DAYS = 30
+WEIGHT_DAYS = 180
+CALENDAR_WEEKS = 12
+# Предел памяти под готовые PNG, байт
+PNG_CACHE_BYTES = 32 * 1024 * 1024
+CHART_DPI = 100
+
+CHART_TITLES = {
+    'weight': '⚖️ Вес за полгода',
+    'calories': '🔥 Калории за 30 дней: сожжено и съедено',
+    'macros': '🍎 Белки, жиры и углеводы за 30 дней',
+    'calendar': '📅 Календарь тренировок за 12 недель',
+}
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+
+# --- Отрисовка: выполняется в процессах пула, получает только простые данные ---
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _days(data):
+    return [date.fromisoformat(day) for day in data['dates']]
+
+
+def _date_axis(fig, ax):
+    import matplotlib.dates as mdates
+    ax.xaxis_date()
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=8))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
+    fig.autofmt_xdate()
+
+
+def _draw_weight(fig, data):
+    ax = fig.add_subplot()
+    ax.plot(_days(data), data['weight'], marker='o', color='#3b7dd8')
+    ax.set_ylabel('кг')
+    ax.grid(alpha=0.3)
+    _date_axis(fig, ax)
+
+
+def _draw_calories(fig, data):
+    import matplotlib.dates as mdates
+    ax = fig.add_subplot()
+    x = mdates.date2num(_days(data))
+    ax.bar(x - 0.2, data['burned'], width=0.4, color='#e4572e', label='Сожжено')
+    ax.bar(x + 0.2, data['consumed'], width=0.4, color='#76b041', label='Съедено')
+    ax.set_ylabel('ккал')
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+    _date_axis(fig, ax)
+
+
+def _draw_macros(fig, data):
+    import matplotlib.dates as mdates
+    ax = fig.add_subplot()
+    x = mdates.date2num(_days(data))
+    bottom = [0.0] * len(x)
+    for column, label, color in (('protein', 'Белки', '#3b7dd8'), ('fat', 'Жиры', '#f3a712'),
+                                 ('carbs', 'Углеводы', '#76b041')):
+        ax.bar(x, data[column], width=0.8, bottom=bottom, color=color, label=label)
+        bottom = [total + value for total, value in zip(bottom, data[column])]
+    ax.set_ylabel('г')
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+    _date_axis(fig, ax)
+
+
+def _draw_calendar(fig, data):
+    ax = fig.add_subplot()
+    weeks = len(data['counts']) // 7
+    # Столбец - неделя, строка - день недели
+    grid = [[data['counts'][week * 7 + day] for week in range(weeks)] for day in range(7)]
+    ax.imshow(grid, cmap='Greens', vmin=0, vmax=max(2, max(data['counts'])), aspect='equal')
+    start = date.fromisoformat(data['start'])
+    ax.set_yticks(range(7), WEEKDAYS)
+    ax.set_xticks(range(0, weeks, 2),
+                  [f'{start + timedelta(weeks=week):%d.%m}' for week in range(0, weeks, 2)])
+    ax.tick_params(length=0)
+    for side in ax.spines.values():
+        side.set_visible(False)
+
+
+DRAWERS = {
+    'weight': (_draw_weight, (8, 4)),
+    'calories': (_draw_calories, (8, 4)),
+    'macros': (_draw_macros, (8, 4)),
+    'calendar': (_draw_calendar, (8, 3)),
+}
+
+
+def render_chart(chart, data):
+    """PNG графика chart по данным data (как их готовит ChartService.load)"""
+    from matplotlib.figure import Figure
+
+    draw, size = DRAWERS[chart]
+    # Figure без pyplot: никакого глобального состояния между отрисовками
+    fig = Figure(figsize=size, dpi=CHART_DPI, layout='tight')
+    draw(fig, data)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+# --- Подготовка данных и кэш: процесс бота ---
+
+def _date_range(start, end):
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+class ChartService:
+    """Графики прогресса: вес, калории, БЖУ и календарь тренировок.
+
+    Данные читаются из дневных показателей в потоке чтения AsyncDatabase,
+    а matplotlib (бэкенд Agg) рисует в отдельных процессах, не занимая
+    event loop и GIL процесса бота. Готовые PNG кэшируются по
+    (пользователь, график) вместе с версией данных - хэшем того, что
+    рисуется, - поэтому повторный запрос без новых данных не рисует заново.
+    Кэш используется только из event loop и блокировок не требует.
+    """
+
+    def __init__(self, pool, adb, workers=None, cache_bytes=PNG_CACHE_BYTES):
+        self.metrics = get_metrics(pool)
+        self.adb = adb
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_bytes = cache_bytes
+        self._executor = None
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._rendering = {}
+        self.renders = 0
+        self.hits = 0
+        self._render_ms = 0.0
+
+    def _pool(self):
+        # Процессы запускаются при первом графике; spawn - потому что в
+        # процессе бота уже работают потоки пула базы и пакетной записи
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+        return self._executor
+
+    def load(self, user_id, chart, today=None):
+        """(версия данных, данные) для графика или None, если рисовать нечего"""
+        today = today or date.today()
+        if chart == 'weight':
+            rows = self.metrics.weights(user_id, today - timedelta(days=WEIGHT_DAYS), today)
+            if not rows:
+                return None
+            data = {'dates': [row[0] for row in rows], 'weight': [row[1] for row in rows]}
+        elif chart == 'calendar':
+            # Полные недели с понедельника, последняя - текущая
+            start = today - timedelta(days=today.weekday(), weeks=CALENDAR_WEEKS - 1)
+            end = start + timedelta(weeks=CALENDAR_WEEKS, days=-1)
+            workouts = {row[0]: row[1] for row in self.metrics.daily(user_id, start, end)}
+            if not any(workouts.values()):
+                return None
+            data = {'start': start.isoformat(),
+                    'counts': [workouts.get(day.isoformat(), 0) for day in _date_range(start, end)]}
+        else:
+            start = today - timedelta(days=CHART_DAYS - 1)
+            rows = {row[0]: row for row in self.metrics.daily(user_id, start, today)}
+            if not rows:
+                return None
+            days = [day.isoformat() for day in _date_range(start, today)]
+            empty = (None, 0, 0, 0, 0, 0.0, 0.0, 0.0, 0.0)
+            columns = {'burned': 3, 'consumed': 5} if chart == 'calories' else {'protein': 6, 'carbs': 7, 'fat': 8}
+            data = {'dates': days}
+            for name, index in columns.items():
+                data[name] = [rows.get(day, empty)[index] for day in days]
+            if not any(any(values) for name, values in data.items() if name != 'dates'):
+                return None
+        version = hashlib.sha1(repr(sorted(data.items())).encode()).hexdigest()
+        return version, data
+
+    async def render(self, user_id, chart, today=None):
+        """PNG графика пользователя или None, если данных для него нет"""
+        loaded = await self.adb.read(self.load, user_id, chart, today)
+        if loaded is None:
+            return None
+        version, data = loaded
+
+        key = (user_id, chart)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        # Одинаковые запросы, пришедшие во время отрисовки, ждут её результата
+        pending = self._rendering.get((key, version))
+        if pending is not None:
+            return await pending
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self._pool(), render_chart, chart, data)
+        self._rendering[(key, version)] = future
+        try:
+            png = await future
+        finally:
+            self._rendering.pop((key, version), None)
+        self.renders += 1
+        self._render_ms += (time.perf_counter() - started) * 1000
+        self._store(key, version, png)
+        return png
+
+    def _store(self, key, version, png):
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cached_bytes -= len(old[1])
+        self._cache[key] = (version, png)
+        self._cached_bytes += len(png)
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    def stats(self):
+        return {
+            'renders': self.renders,
+            'hits': self.hits,
+            'avg_render_ms': round(self._render_ms / (self.renders or 1), 2),
+            'cached': len(self._cache),
+            'cached_bytes': self._cached_bytes,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,162 @@
+# db_pool.py
+import sqlite3
+import threading
+import queue
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL делает fsync только на checkpoint
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite для одного файла базы"""
+
+    def __init__(self, db_path='fitness_bot.db', size=4, timeout=30.0, cached_statements=256):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        """Открытие и настройка нового соединения"""
+        # isolation_level=None: транзакциями управляем сами через BEGIN/COMMIT,
+        # cached_statements: кэш подготовленных выражений на соединение
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise RuntimeError(f'Пул соединений {self.db_path} закрыт')
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Все соединения заняты - ждём освобождения
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f'Нет свободных соединений к {self.db_path}') from None
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула на время блока with"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Транзакция: COMMIT при успехе, ROLLBACK при исключении.
+
+        immediate=True сразу берёт блокировку записи, чтобы не получить
+        'database is locked' при повышении блокировки посреди транзакции.
+        """
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def execute(self, query, params=()):
+        """Выполнение одного изменяющего запроса, возвращает lastrowid"""
+        with self.transaction() as cursor:
+            cursor.execute(query, params)
+            return cursor.lastrowid
+
+    def executemany(self, query, seq_of_params):
+        """Пакетное выполнение запроса в одной транзакции"""
+        with self.transaction() as cursor:
+            cursor.executemany(query, seq_of_params)
+            return cursor.rowcount
+
+    def fetchone(self, query, params=()):
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchone()
+
+    def fetchall(self, query, params=()):
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def close(self):
+        """Закрытие всех свободных соединений"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path='fitness_bot.db'):
+    """Общий пул для файла базы (один на процесс)"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_path)
+            _pools[db_path] = pool
+        return pool
+
+
+def close_all():
+    """Закрытие всех пулов при остановке бота"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,148 @@
+# exercise_catalog.py
+import threading
+from typing import Dict, List, Optional
+
+from bootstrap import get_meta
+
+# Поля, по которым строятся инвертированные индексы
+FACETS = ('muscle_group', 'equipment', 'difficulty', 'category')
+# Ключ app_meta, который триггеры на exercises увеличивают при каждой записи
+CATALOG_VERSION_KEY = 'exercise_catalog_version'
+
+
+class ExerciseRecord:
+    """Упражнение в памяти процесса"""
+
+    __slots__ = (
+        'id', 'name', 'description', 'category', 'muscle_group', 'equipment',
+        'difficulty', 'instructions', 'video_url', 'image_url', 'calories_burned',
+        'is_custom', 'created_by', 'rating', 'rating_count',
+    )
+
+    def __init__(self, row):
+        for field, value in zip(self.__slots__, row):
+            setattr(self, field, value)
+
+    def as_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def equipment_tokens(equipment) -> List[str]:
+    """'barbell, bench' -> ['barbell', 'bench']"""
+    if not equipment:
+        return []
+    return [token.strip().lower() for token in equipment.split(',') if token.strip()]
+
+
+class _Snapshot:
+    """Неизменяемый набор индексов: при перестроении подменяется целиком"""
+
+    def __init__(self, records, version):
+        self.version = version
+        self.by_id = {record.id: record for record in records}
+        self.index = {facet: {} for facet in FACETS}
+
+        for record in records:
+            self.index['muscle_group'].setdefault(record.muscle_group, set()).add(record.id)
+            self.index['difficulty'].setdefault(record.difficulty, set()).add(record.id)
+            self.index['category'].setdefault(record.category, set()).add(record.id)
+            for token in equipment_tokens(record.equipment):
+                self.index['equipment'].setdefault(token, set()).add(record.id)
+
+        # Порядок выдачи: рейтинг по убыванию, затем имя
+        ordered = sorted(records, key=lambda r: (-(r.rating or 0), r.name or ''))
+        self.rating_order = [record.id for record in ordered]
+        self.rank = {exercise_id: position for position, exercise_id in enumerate(self.rating_order)}
+
+    def postings(self, facet, value):
+        if facet == 'equipment':
+            tokens = equipment_tokens(value)
+            if not tokens:
+                return set()
+            sets = [self.index['equipment'].get(token, set()) for token in tokens]
+            return set.intersection(*sets)
+        return self.index[facet].get(value, set())
+
+    def matching_ids(self, filters) -> List[int]:
+        active = [(facet, filters[facet]) for facet in FACETS if filters and facet in filters]
+        if not active:
+            return self.rating_order
+
+        # Пересекаем начиная с самого короткого списка
+        candidate_sets = sorted((self.postings(facet, value) for facet, value in active), key=len)
+        matched = set(candidate_sets[0])
+        for postings in candidate_sets[1:]:
+            if not matched:
+                break
+            matched &= postings
+        return sorted(matched, key=self.rank.__getitem__)
+
+
+class ExerciseCatalog:
+    """Каталог упражнений в памяти с фасетными индексами.
+
+    Загружается из базы один раз и перестраивается лениво после
+    invalidate() или когда версия каталога в app_meta отличается от
+    версии снимка - например, упражнение добавил другой процесс.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._snapshot = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _version(self):
+        with self.pool.connection() as conn:
+            return get_meta(conn.cursor(), CATALOG_VERSION_KEY)
+
+    def _load(self, version):
+        # Версия читается до строк: запись между чтениями лишь вызовет
+        # ещё одну перестройку, но не оставит устаревший снимок
+        columns = ', '.join(ExerciseRecord.__slots__)
+        rows = self.pool.fetchall(f'SELECT {columns} FROM exercises')
+        return _Snapshot([ExerciseRecord(row) for row in rows], version)
+
+    def snapshot(self):
+        version = self._version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.version != version:
+                    generation = self._generation
+                    snapshot = self._load(version)
+                    # Если во время загрузки пришла инвалидация, не кэшируем
+                    if generation == self._generation:
+                        self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        self._generation += 1
+        self._snapshot = None
+
+    def get(self, exercise_id) -> Optional[ExerciseRecord]:
+        return self.snapshot().by_id.get(exercise_id)
+
+    def search(self, filters: Dict = None, offset=0, limit=None) -> List[ExerciseRecord]:
+        snapshot = self.snapshot()
+        ids = snapshot.matching_ids(filters)
+        end = None if limit is None else offset + limit
+        return [snapshot.by_id[exercise_id] for exercise_id in ids[offset:end]]
+
+    def count(self, filters: Dict = None) -> int:
+        return len(self.snapshot().matching_ids(filters))
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(pool):
+    """Общий каталог для файла базы (один на процесс)"""
+    with _catalogs_lock:
+        catalog = _catalogs.get(pool.db_path)
+        if catalog is None:
+            catalog = ExerciseCatalog(pool)
+            _catalogs[pool.db_path] = catalog
+        return catalog
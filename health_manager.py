@@ -1,132 +1,79 @@
 # health_manager.py
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
+from db_pool import get_pool
+from bootstrap import bootstrap
+from nutrition_targets import get_targets_cache
+from health_rules import get_rules_engine, sync_recommendations
 
 class HealthManager:
     def __init__(self, db_path='fitness_bot.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.targets = get_targets_cache(self.pool)
+        self.rules = get_rules_engine(self.pool)
         self.init_health_tables()
     
     def init_health_tables(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Анкета здоровья
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS health_questionnaire (
-                user_id INTEGER PRIMARY KEY,
-                age INTEGER,
-                weight REAL,
-                height REAL,
-                gender TEXT,
-                fitness_level TEXT,
-                goals TEXT,
-                injuries TEXT,
-                limitations TEXT,
-                medical_conditions TEXT,
-                sleep_hours INTEGER,
-                stress_level INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Рекомендации по здоровью
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS health_recommendations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                type TEXT,
-                title TEXT,
-                description TEXT,
-                priority INTEGER,
-                is_completed BOOLEAN DEFAULT FALSE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Напоминания
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS health_reminders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                reminder_type TEXT,
-                message TEXT,
-                scheduled_time TIME,
-                is_active BOOLEAN DEFAULT TRUE,
-                days_of_week TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        bootstrap(self.pool)
+        # Если правила рекомендаций изменились, пересчитываем их для всех
+        self.rules.ensure_current()
     
     def save_health_questionnaire(self, user_id, data):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO health_questionnaire 
-            (user_id, age, weight, height, gender, fitness_level, goals, injuries, limitations, medical_conditions, sleep_hours, stress_level, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, data['age'], data['weight'], data['height'], data['gender'], 
-              data['fitness_level'], json.dumps(data['goals']), json.dumps(data['injuries']),
-              json.dumps(data['limitations']), data['medical_conditions'], data['sleep_hours'],
-              data['stress_level'], datetime.now()))
-        
-        # Генерируем персональные рекомендации
-        self.generate_health_recommendations(user_id, data)
+        # Анкета и рекомендации сохраняются одной транзакцией на одном соединении
+        with self.pool.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO health_questionnaire 
+                (user_id, age, weight, height, gender, fitness_level, goals, injuries, limitations, medical_conditions, sleep_hours, stress_level, updated_at, version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    age = excluded.age,
+                    weight = excluded.weight,
+                    height = excluded.height,
+                    gender = excluded.gender,
+                    fitness_level = excluded.fitness_level,
+                    goals = excluded.goals,
+                    injuries = excluded.injuries,
+                    limitations = excluded.limitations,
+                    medical_conditions = excluded.medical_conditions,
+                    sleep_hours = excluded.sleep_hours,
+                    stress_level = excluded.stress_level,
+                    updated_at = excluded.updated_at,
+                    version = COALESCE(version, 0) + 1
+            ''', (user_id, data['age'], data['weight'], data['height'], data['gender'], 
+                  data['fitness_level'], json.dumps(data['goals']), json.dumps(data['injuries']),
+                  json.dumps(data['limitations']), data['medical_conditions'], data['sleep_hours'],
+                  data['stress_level'], datetime.now().isoformat(' ')))
+            
+            # Генерируем персональные рекомендации
+            self.generate_health_recommendations(user_id, data, cursor)
         
-        conn.commit()
-        conn.close()
+        # Цели по питанию зависят от анкеты - пересчитаются при следующем запросе
+        self.targets.invalidate(user_id)
     
-    def generate_health_recommendations(self, user_id, health_data):
-        recommendations = []
-        
-        # Анализ данных и создание рекомендаций
-        if health_data['sleep_hours'] < 7:
-            recommendations.append({
-                'type': 'sleep',
-                'title': 'Улучшение качества сна',
-                'description': 'Рекомендуется увеличить продолжительность сна до 7-9 часов для лучшего восстановления',
-                'priority': 2
-            })
+    def generate_health_recommendations(self, user_id, health_data, cursor=None):
+        """Пересчёт рекомендаций пользователя.
         
-        if health_data['stress_level'] > 7:
-            recommendations.append({
-                'type': 'stress',
-                'title': 'Управление стрессом',
-                'description': 'Высокий уровень стресса. Рекомендуются медитация, прогулки и дыхательные упражнения',
-                'priority': 1
-            })
+        Передайте cursor, чтобы выполнить запись в уже открытой транзакции.
+        """
+        recommendations = self.build_health_recommendations(health_data)
         
-        # Рекомендации по разминке/заминке
-        recommendations.extend([
-            {
-                'type': 'warmup',
-                'title': 'Обязательная разминка',
-                'description': 'Перед каждой тренировкой выполняйте 5-10 минут динамической разминки',
-                'priority': 1
-            },
-            {
-                'type': 'cooldown',
-                'title': 'Заминка после тренировки',
-                'description': 'После тренировки уделите 5-10 минут растяжке основных мышечных групп',
-                'priority': 2
-            }
-        ])
-        
-        # Сохраняем рекомендации
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        for rec in recommendations:
-            cursor.execute('''
-                INSERT INTO health_recommendations (user_id, type, title, description, priority)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, rec['type'], rec['title'], rec['description'], rec['priority']))
-        
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        if cursor is None:
+            with self.pool.transaction() as cursor:
+                self.replace_recommendations(cursor, user_id, recommendations)
+        else:
+            self.replace_recommendations(cursor, user_id, recommendations)
+    
+    def build_health_recommendations(self, health_data):
+        """Рекомендации по анкете согласно правилам из health_rules.json"""
+        return self.rules.recommend(health_data)
+    
+    def replace_recommendations(self, cursor, user_id, recommendations):
+        """Синхронизация сохранённых рекомендаций пользователя с новым набором"""
+        rows = [(user_id, rec['type'], rec['title'], rec['description'], rec['priority'])
+                for rec in recommendations]
+        sync_recommendations(cursor, [user_id], rows)
+    
+    def recompute_all_recommendations(self):
+        """Пересчёт рекомендаций всех пользователей (например, после правки правил)"""
+        return self.rules.recompute()
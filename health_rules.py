@@ -0,0 +1,265 @@
+# health_rules.py
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from bootstrap import get_meta, set_meta
+
+logger = logging.getLogger(__name__)
+
+# Правила рекомендаций хранятся в версионируемом файле: после изменения
+# правил увеличьте "version", и рекомендации пересчитаются у всех пользователей
+HEALTH_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_rules.json')
+
+QUESTIONNAIRE_COLUMNS = (
+    'user_id', 'age', 'weight', 'height', 'gender', 'fitness_level', 'goals',
+    'injuries', 'limitations', 'medical_conditions', 'sleep_hours', 'stress_level',
+)
+NUMERIC_COLUMNS = ('age', 'weight', 'height', 'sleep_hours', 'stress_level')
+# Поля, которые вычисляются из анкеты перед проверкой правил
+DERIVED_COLUMNS = ('bmi', 'injuries_count', 'limitations_count')
+
+# Сравнение с пропущенным значением (NaN/None) всегда ложно
+OPERATORS = {
+    '<': lambda column, value: column.lt(value),
+    '<=': lambda column, value: column.le(value),
+    '>': lambda column, value: column.gt(value),
+    '>=': lambda column, value: column.ge(value),
+    '==': lambda column, value: column.eq(value),
+    '!=': lambda column, value: column.ne(value) & column.notna(),
+    'in': lambda column, value: column.isin(value),
+}
+
+# Сколько user_id подставлять в один запрос IN (...)
+IN_CHUNK = 500
+
+
+def load_rules(path=HEALTH_RULES_PATH):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    fields = set(QUESTIONNAIRE_COLUMNS) | set(DERIVED_COLUMNS)
+    for rule in data['rules']:
+        for condition in rule['when']:
+            if condition['op'] not in OPERATORS:
+                raise ValueError(f"Правило {rule['type']}: неизвестный оператор {condition['op']!r}")
+            if condition['field'] not in fields:
+                raise ValueError(f"Правило {rule['type']}: неизвестное поле {condition['field']!r}")
+    return data
+
+
+def _list_length(value):
+    """Число элементов в списке из анкеты (список или JSON-строка)"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return 1 if value.strip() else 0
+    return len(value) if isinstance(value, (list, tuple)) else 0
+
+
+def list_lengths(column):
+    """Длины JSON-списков столбца: каждое уникальное значение разбирается один раз"""
+    codes, uniques = pd.factorize(column)
+    # Код -1 (пропуск) попадает на последний элемент - 0
+    lengths = np.array([_list_length(value) for value in uniques] + [0])
+    return lengths[codes]
+
+
+def prepare_frame(frame):
+    """Приводит типы и добавляет вычисляемые поля: ИМТ и число травм/ограничений"""
+    for column in NUMERIC_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+
+    height_m = frame['height'] / 100
+    frame['bmi'] = (frame['weight'] / (height_m ** 2)).replace([np.inf, -np.inf], np.nan)
+    frame['injuries_count'] = list_lengths(frame['injuries'])
+    frame['limitations_count'] = list_lengths(frame['limitations'])
+    return frame
+
+
+def evaluate(frame, rules):
+    """Матрица срабатываний (пользователи x правила) за один проход по столбцам"""
+    matrix = np.ones((len(frame), len(rules)), dtype=bool)
+    for j, rule in enumerate(rules):
+        # Правило без условий срабатывает для всех
+        for condition in rule['when']:
+            matched = OPERATORS[condition['op']](frame[condition['field']], condition['value'])
+            matrix[:, j] &= matched.to_numpy(dtype=bool)
+    return matrix
+
+
+def _chunks(items, size=IN_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_recommendations(cursor, user_ids, rows):
+    """Синхронизация сохранённых рекомендаций пользователей с новым набором.
+
+    rows - (user_id, type, title, description, priority). Рекомендации
+    сравниваются по (user_id, type): неактуальные удаляются, изменённые
+    обновляются, новые добавляются, а совпадающие остаются как есть
+    (с отметкой о выполнении и датой создания). user_ids=None - все
+    пользователи с анкетой.
+    """
+    # Тексты рекомендации одного типа одинаковы у всех (они из правил),
+    # поэтому сравниваем их в SQL и читаем из базы только ключи
+    texts = {row[1]: tuple(row[2:]) for row in rows}
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS recommendation_texts (
+            type TEXT PRIMARY KEY, title TEXT, description TEXT, priority INTEGER
+        )
+    ''')
+    cursor.execute('DELETE FROM temp.recommendation_texts')
+    cursor.executemany('INSERT INTO temp.recommendation_texts VALUES (?, ?, ?, ?)',
+                       [(rec_type,) + values for rec_type, values in texts.items()])
+
+    query = '''
+        SELECT r.user_id, r.type,
+               t.type IS NULL OR r.title IS NOT t.title
+               OR r.description IS NOT t.description OR r.priority IS NOT t.priority
+        FROM health_recommendations r
+        LEFT JOIN temp.recommendation_texts t ON t.type = r.type
+    '''
+    if user_ids is None:
+        # Пользователи без анкеты в пересчёт не входят
+        results = [cursor.execute(f'{query} WHERE r.user_id IN (SELECT user_id FROM health_questionnaire)').fetchall()]
+    else:
+        results = [
+            cursor.execute(f"{query} WHERE r.user_id IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            for chunk in _chunks(user_ids)
+        ]
+    # (user_id, type) -> тексты устарели
+    existing = {(user_id, rec_type): outdated for result in results for user_id, rec_type, outdated in result}
+
+    wanted = [(row[0], row[1]) for row in rows]
+    wanted_keys = set(wanted)
+    stale = [key for key in existing if key not in wanted_keys]
+    changed = [texts[key[1]] + key for key in wanted if existing.get(key)]
+    added = [key + texts[key[1]] for key in wanted if key not in existing]
+
+    cursor.executemany('DELETE FROM health_recommendations WHERE user_id = ? AND type = ?', stale)
+    cursor.executemany('''
+        UPDATE health_recommendations SET title = ?, description = ?, priority = ?
+        WHERE user_id = ? AND type = ?
+    ''', changed)
+    cursor.executemany('''
+        INSERT INTO health_recommendations (user_id, type, title, description, priority)
+        VALUES (?, ?, ?, ?, ?)
+    ''', added)
+    return {'inserted': len(added), 'updated': len(changed), 'deleted': len(stale)}
+
+
+class HealthRulesEngine:
+    """Рекомендации по здоровью из декларативных правил (health_rules.json).
+
+    Правила проверяются векторно сразу для всех анкет, поэтому после
+    изменения правил рекомендации всей базы пересчитываются за один проход.
+    """
+
+    def __init__(self, pool, rules=None):
+        self.pool = pool
+        data = rules or load_rules()
+        self.version = data['version']
+        self.rules = data['rules']
+        # Значения рекомендации в порядке столбцов health_recommendations
+        self._values = [(rule['type'], rule['title'], rule['description'], rule['priority'])
+                        for rule in self.rules]
+        self._checked = False
+        self._lock = threading.Lock()
+
+    def _rows(self, frame):
+        """(user_id, type, title, description, priority) для сработавших правил"""
+        matrix = evaluate(prepare_frame(frame), self.rules)
+        user_ids = frame['user_id'].to_numpy()
+        users, rules = np.nonzero(matrix)
+        return [(int(user_ids[u]),) + self._values[r] for u, r in zip(users, rules)]
+
+    def recommend(self, health_data):
+        """Рекомендации для одной анкеты -> [{'type', 'title', 'description', 'priority'}]"""
+        record = {column: health_data.get(column) for column in QUESTIONNAIRE_COLUMNS}
+        record['user_id'] = 0
+        # Списки приводим к виду, в котором они хранятся в базе
+        for column in ('goals', 'injuries', 'limitations'):
+            if isinstance(record[column], (list, tuple)):
+                record[column] = json.dumps(record[column])
+        frame = pd.DataFrame([record], columns=list(QUESTIONNAIRE_COLUMNS))
+        return [
+            {'type': rec_type, 'title': title, 'description': description, 'priority': priority}
+            for _, rec_type, title, description, priority in self._rows(frame)
+        ]
+
+    def recompute(self, user_ids=None):
+        """Пересчёт рекомендаций всех (или указанных) пользователей с анкетой.
+
+        Возвращает число пользователей, изменения и пропускную способность.
+        """
+        started = time.perf_counter()
+        columns = ', '.join(QUESTIONNAIRE_COLUMNS)
+        query = f'SELECT {columns} FROM health_questionnaire'
+
+        # Анкеты читаются в той же транзакции, что и запись, чтобы не
+        # затереть рекомендации анкеты, сохранённой во время пересчёта
+        with self.pool.transaction() as cursor:
+            if user_ids is None:
+                frame = pd.read_sql_query(query, cursor.connection)
+            else:
+                frames = [
+                    pd.read_sql_query(f"{query} WHERE user_id IN ({', '.join('?' * len(chunk))})",
+                                      cursor.connection, params=chunk)
+                    for chunk in _chunks(user_ids)
+                ] or [pd.DataFrame(columns=list(QUESTIONNAIRE_COLUMNS))]
+                frame = pd.concat(frames, ignore_index=True)
+
+            rows = self._rows(frame)
+            evaluated = None if user_ids is None else frame['user_id'].tolist()
+            stats = sync_recommendations(cursor, evaluated, rows)
+            if user_ids is None:
+                set_meta(cursor, 'health_rules_version', self.version)
+
+        seconds = time.perf_counter() - started
+        stats.update(
+            users=len(frame),
+            recommendations=len(rows),
+            seconds=seconds,
+            users_per_second=len(frame) / seconds if seconds else 0.0,
+        )
+        logger.info(
+            'Рекомендации пересчитаны: %d пользователей за %.2f с (%.0f польз./с), '
+            'добавлено %d, изменено %d, удалено %d',
+            stats['users'], seconds, stats['users_per_second'],
+            stats['inserted'], stats['updated'], stats['deleted'],
+        )
+        return stats
+
+    def ensure_current(self):
+        """Пересчитывает всю базу, если правила изменились с прошлого запуска"""
+        with self._lock:
+            if self._checked:
+                return None
+            with self.pool.connection() as conn:
+                applied = int(get_meta(conn.cursor(), 'health_rules_version') or 0)
+            stats = self.recompute() if applied != self.version else None
+            self._checked = True
+            return stats
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_rules_engine(pool):
+    """Общий движок правил для файла базы (один на процесс)"""
+    with _engines_lock:
+        engine = _engines.get(pool.db_path)
+        if engine is None:
+            engine = HealthRulesEngine(pool)
+            _engines[pool.db_path] = engine
+        return engine
@@ -0,0 +1,314 @@
+# leaderboard.py
+import bisect
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+from progression import IN_CHUNK, xp_for_workout
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('week', 'month', 'all')
+PAGE_SIZE = 10
+
+
+def period_start(period, today=None):
+    today = today or date.today()
+    if period == 'week':
+        return today - timedelta(days=today.weekday())
+    if period == 'month':
+        return today.replace(day=1)
+    return None
+
+
+def xp_board_key(period, today=None):
+    """'xp:week:2026-W42', 'xp:month:2026-10', 'xp:all'"""
+    today = today or date.today()
+    if period == 'week':
+        year, week, _ = today.isocalendar()
+        return f'xp:week:{year}-W{week:02d}'
+    if period == 'month':
+        return f'xp:month:{today:%Y-%m}'
+    return 'xp:all'
+
+
+def challenge_board_key(challenge_id):
+    return f'challenge:{challenge_id}'
+
+
+class RankedBoard:
+    """Рейтинг в духе sorted set: очки пользователей и отсортированный
+    список (-очки, user_id). Место и страница топа - двоичным поиском."""
+
+    def __init__(self):
+        self.scores = {}
+        # Опыт на начало периода: очки периода = текущий опыт - baseline
+        self.baselines = {}
+        self._order = []
+
+    @classmethod
+    def from_scores(cls, scores, baselines=None):
+        """Рейтинг по готовым очкам одной сортировкой"""
+        board = cls()
+        board.scores = dict(scores)
+        board.baselines = dict(baselines or {})
+        board._order = sorted((-score, user_id) for user_id, score in board.scores.items())
+        return board
+
+    def __len__(self):
+        return len(self._order)
+
+    def set(self, user_id, score):
+        old = self.scores.get(user_id)
+        if old == score:
+            return False
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, (-old, user_id))]
+        bisect.insort(self._order, (-score, user_id))
+        self.scores[user_id] = score
+        return True
+
+    def rank(self, user_id):
+        """Место пользователя (с 1) или None, если его нет в рейтинге"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._order, (-score, user_id)) + 1
+
+    def top(self, limit=PAGE_SIZE, offset=0):
+        """[(место, user_id, очки)]"""
+        return [(offset + i + 1, user_id, -score)
+                for i, (score, user_id) in enumerate(self._order[offset:offset + limit])]
+
+
+class LeaderboardService:
+    """Рейтинги по опыту за неделю, месяц и всё время и рейтинги челленджей.
+
+    Рейтинги живут в памяти процесса и обновляются после фиксации записей,
+    меняющих опыт и прогресс челленджей. Изменения периодически сохраняются в
+    leaderboard_entries, и при запуске рейтинги читаются оттуда; полная
+    пересборка нужна только на пустой базе снимков.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._boards = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _board(self, key):
+        board = self._boards.get(key)
+        if board is None:
+            board = self._boards[key] = RankedBoard()
+        return board
+
+    def _load(self):
+        started = time.perf_counter()
+        rows = self.pool.fetchall('SELECT board, user_id, score, baseline FROM leaderboard_entries')
+        if not rows:
+            self.rebuild()
+            return
+
+        current = {xp_board_key(period) for period in PERIODS}
+        with self._lock:
+            for key, user_id, score, baseline in rows:
+                # Рейтинги прошедших недель и месяцев не восстанавливаем
+                if key.startswith('xp:') and key not in current:
+                    continue
+                board = self._board(key)
+                board.baselines[user_id] = baseline
+                board.set(user_id, score)
+        logger.info('Рейтинги загружены из снимка: %d записей за %.1f мс',
+                    len(rows), (time.perf_counter() - started) * 1000)
+
+    def rebuild(self):
+        """Полная сборка рейтингов по базе (нужна только без снимка)"""
+        started = time.perf_counter()
+        totals = dict(self.pool.fetchall('SELECT user_id, total_xp FROM user_levels'))
+        boards = {}
+
+        all_time = boards[xp_board_key('all')] = RankedBoard()
+        for user_id, total_xp in totals.items():
+            all_time.set(user_id, total_xp or 0)
+
+        for period in ('week', 'month'):
+            start = period_start(period).isoformat()
+            earned = {}
+            for user_id, duration in self.pool.fetchall(
+                    'SELECT user_id, duration FROM workouts WHERE date >= ?', (start,)):
+                earned[user_id] = earned.get(user_id, 0) + xp_for_workout(duration)
+            for user_id, xp in self.pool.fetchall('''
+                SELECT user_id, earned_xp FROM user_achievements WHERE date(earned_at) >= ?
+                UNION ALL
+                SELECT uc.user_id, c.reward_xp FROM user_challenges uc
+                JOIN challenges c ON c.id = uc.challenge_id
+                WHERE uc.is_completed AND date(uc.completed_at) >= ?
+                UNION ALL
+                SELECT a.user_id, c.reward_xp FROM user_challenges_archive a
+                JOIN challenges c ON c.id = a.challenge_id
+                WHERE a.is_completed AND date(a.completed_at) >= ?
+            ''', (start, start, start)):
+                earned[user_id] = earned.get(user_id, 0) + (xp or 0)
+
+            board = boards[xp_board_key(period)] = RankedBoard()
+            for user_id, xp in earned.items():
+                board.baselines[user_id] = (totals.get(user_id) or 0) - xp
+                board.set(user_id, xp)
+
+        for challenge_id, user_id, progress in self.pool.fetchall('''
+            SELECT challenge_id, user_id, current_progress FROM user_challenges
+            WHERE current_progress > 0
+        '''):
+            boards.setdefault(challenge_board_key(challenge_id), RankedBoard()).set(user_id, progress)
+
+        with self._lock:
+            self._boards = boards
+            self._dirty = {(key, user_id) for key, board in boards.items() for user_id in board.scores}
+        logger.info('Рейтинги собраны по базе за %.1f мс', (time.perf_counter() - started) * 1000)
+
+    def refresh(self):
+        """Пересборка рейтингов по снимку, когда бот работает в нескольких процессах.
+
+        Очки пользователя меняет только его процесс, поэтому после save()
+        снимок верен для всех остальных; записи, изменённые уже после
+        сохранения, берутся из памяти. Возвращает число записей снимка.
+        """
+        rows = self.pool.fetchall('SELECT board, user_id, score, baseline FROM leaderboard_entries')
+        current = {xp_board_key(period) for period in PERIODS}
+        scores, baselines = {}, {}
+        for key, user_id, score, baseline in rows:
+            if key.startswith('xp:') and key not in current:
+                continue
+            scores.setdefault(key, {})[user_id] = score
+            baselines.setdefault(key, {})[user_id] = baseline
+
+        with self._lock:
+            for key, user_id in self._dirty:
+                board = self._boards.get(key)
+                if board is not None and user_id in board.scores:
+                    scores.setdefault(key, {})[user_id] = board.scores[user_id]
+                    baselines.setdefault(key, {})[user_id] = board.baselines.get(user_id, 0)
+            self._boards = {key: RankedBoard.from_scores(board_scores, baselines[key])
+                            for key, board_scores in scores.items()}
+        return len(rows)
+
+    def on_commit(self, batch):
+        """Слушатель WriteBatcher после фиксации пакета: рейтинги авторов
+        записанных тренировок и приёмов пищи"""
+        self.sync_users({row[0] for kind in ('workout', 'meal') for row in batch.get(kind, ())})
+
+    def sync_challenge(self, challenge_id):
+        """Рейтинги участников челленджа (например, после смены его окна)"""
+        rows = self.pool.fetchall('SELECT user_id FROM user_challenges WHERE challenge_id = ?', (challenge_id,))
+        self.sync_users(user_id for user_id, in rows)
+
+    def sync_users(self, user_ids):
+        """Очки пользователей по зафиксированным данным: опыт и прогресс челленджей.
+
+        Вызывается после фиксации транзакции, поэтому в рейтинги не попадают
+        изменения, откатившиеся вместе с пакетом или savepoint слушателя.
+        Очки абсолютные: повторная синхронизация ничего не портит. Опыт на
+        начало недели и месяца - очки пользователя в рейтинге за всё время
+        до первого изменения в периоде.
+        """
+        user_ids = sorted(set(user_ids))
+        levels, progress = {}, []
+        for start in range(0, len(user_ids), IN_CHUNK):
+            chunk = user_ids[start:start + IN_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            levels.update(self.pool.fetchall(f'''
+                SELECT user_id, total_xp FROM user_levels WHERE user_id IN ({placeholders})
+            ''', chunk))
+            progress += self.pool.fetchall(f'''
+                SELECT user_id, challenge_id, current_progress FROM user_challenges
+                WHERE user_id IN ({placeholders}) AND current_progress > 0
+            ''', chunk)
+
+        keys = [xp_board_key(period) for period in PERIODS]
+        with self._lock:
+            all_time = self._board(xp_board_key('all'))
+            for user_id, total_xp in levels.items():
+                old_xp, new_xp = all_time.scores.get(user_id, 0), total_xp or 0
+                if old_xp == new_xp:
+                    continue
+                for key in keys:
+                    board = self._board(key)
+                    if key != 'xp:all':
+                        # Первое изменение в периоде фиксирует опыт на его начало
+                        score = new_xp - board.baselines.setdefault(user_id, old_xp)
+                    else:
+                        score = new_xp
+                    if board.set(user_id, score):
+                        self._dirty.add((key, user_id))
+            for user_id, challenge_id, value in progress:
+                key = challenge_board_key(challenge_id)
+                if self._board(key).set(user_id, value):
+                    self._dirty.add((key, user_id))
+
+    def drop_board(self, key):
+        """Сброс рейтинга (например, с началом нового окна челленджа)"""
+        with self._lock:
+            self._boards.pop(key, None)
+            self._dirty = {(board, user_id) for board, user_id in self._dirty if board != key}
+        self.pool.execute('DELETE FROM leaderboard_entries WHERE board = ?', (key,))
+
+    def page(self, key, user_id=None, limit=PAGE_SIZE, offset=0):
+        """Страница рейтинга и место пользователя: ([(место, user_id, очки)], (место, очки) или None)"""
+        with self._lock:
+            board = self._boards.get(key)
+            if board is None:
+                return [], None
+            position = None
+            if user_id is not None and user_id in board.scores:
+                position = (board.rank(user_id), board.scores[user_id])
+            return board.top(limit, offset), position
+
+    def save(self):
+        """Сохранение изменённых с прошлого снимка записей, возвращает их число"""
+        current = {xp_board_key(period) for period in PERIODS}
+        with self._lock:
+            # Прошедшие недели и месяцы больше не нужны
+            for key in [key for key in self._boards if key.startswith('xp:') and key not in current]:
+                del self._boards[key]
+            rows = []
+            for key, user_id in self._dirty:
+                board = self._boards.get(key)
+                if board is not None and user_id in board.scores:
+                    rows.append((key, user_id, board.scores[user_id], board.baselines.get(user_id, 0)))
+            dirty, self._dirty = self._dirty, set()
+
+        try:
+            with self.pool.transaction() as cursor:
+                cursor.execute('''
+                    DELETE FROM leaderboard_entries
+                    WHERE (board LIKE 'xp:week:%' OR board LIKE 'xp:month:%') AND board NOT IN (?, ?)
+                ''', (xp_board_key('week'), xp_board_key('month')))
+                cursor.executemany('''
+                    INSERT INTO leaderboard_entries (board, user_id, score, baseline)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(board, user_id) DO UPDATE SET
+                        score = excluded.score,
+                        baseline = excluded.baseline
+                ''', rows)
+        except Exception:
+            # Не потеряем изменения: сохраним их в следующий раз
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        return len(rows)
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_leaderboards(pool):
+    """Общие рейтинги для файла базы (один набор на процесс)"""
+    with _services_lock:
+        service = _services.get(pool.db_path)
+        if service is None:
+            service = LeaderboardService(pool)
+            _services[pool.db_path] = service
+        return service
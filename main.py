@@ -1,10 +1,27 @@
 import os
+import html
+import asyncio
 import logging
-import sqlite3
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from datetime import datetime
 import json
+from db_pool import get_pool, close_all
+from bootstrap import bootstrap
+from async_db import AsyncDatabase
+from write_batcher import WriteBatcher
+from nutrition_tracker import NutritionTracker
+from progression import get_progression, level_bounds
+from challenge_system import ChallengeSystem
+from leaderboard import get_leaderboards, xp_board_key, challenge_board_key
+from challenge_scheduler import ChallengeScheduler
+from analytics_dashboard import AnalyticsDashboard
+from chart_service import ChartService, CHART_TITLES
+from reminder_dispatcher import ReminderDispatcher
+from send_queue import SendQueue, GLOBAL_RATE, GLOBAL_BURST
+from webhook_server import UpdateMetrics, serve, webhook_config
+from update_processor import UserOrderedProcessor
+from worker_pool import run_cluster
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,113 +30,117 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Цели по питанию, пока пользователь не заполнил анкету здоровья
+DEFAULT_NUTRITION_TARGETS = {'calories': 2000, 'protein': 150, 'carbs': 250, 'fat': 65}
+
+# Как часто сохранять снимок рейтингов, секунд
+LEADERBOARD_SNAPSHOT_INTERVAL = 300
+# В нескольких процессах рейтинги сохраняются и перечитываются чаще - чтобы видеть чужие очки
+LEADERBOARD_SYNC_INTERVAL = 30
+LEADERBOARD_TITLES = {'week': 'за неделю', 'month': 'за месяц', 'all': 'за всё время'}
+MEDALS = {1: '🥇', 2: '🥈', 3: '🥉'}
+EXPORT_TITLES = {'txt': '📄 Текст', 'csv': '📊 CSV', 'jsonl': '🧾 JSON Lines'}
+MAX_WORKOUT_MINUTES = 24 * 60
+MAX_MEAL_GRAMS = 5000
+WORKOUT_USAGE = ("💪 <b>Запись тренировки</b>\n\n/workout минуты [ккал] [название]\n\n"
+                 "Например: /workout 45 350 Бег")
+MEAL_USAGE = ("🍽 <b>Запись приёма пищи</b>\n\n/meal [граммы] продукт\n\n"
+              "Например: /meal 150 куриная грудка (без граммов - 100 г)")
+
+def meal_type_for(hour):
+    """Тип приёма пищи по часу"""
+    if 5 <= hour < 11:
+        return 'breakfast'
+    if 11 <= hour < 16:
+        return 'lunch'
+    if 16 <= hour < 22:
+        return 'dinner'
+    return 'snack'
+
+def progress_bar(current, goal, width=5):
+    """'▰▰▰▱▱ 60%' для прогресса челленджа"""
+    ratio = min(current / goal, 1.0) if goal else 0.0
+    filled = round(ratio * width)
+    return f"{'▰' * filled}{'▱' * (width - filled)} {round(ratio * 100)}%"
+
 class DatabaseManager:
     def __init__(self, db_path='fitness_bot.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.init_database()
     
     def init_database(self):
         """Инициализация всех таблиц базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица анкеты здоровья
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS health_questionnaire (
-                user_id INTEGER PRIMARY KEY,
-                age INTEGER,
-                weight REAL,
-                height REAL,
-                gender TEXT,
-                fitness_level TEXT,
-                goals TEXT,
-                injuries TEXT,
-                limitations TEXT,
-                sleep_hours INTEGER,
-                stress_level INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица тренировок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS workouts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                workout_name TEXT,
-                duration INTEGER,
-                calories_burned INTEGER,
-                date DATE DEFAULT CURRENT_DATE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица питания
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS nutrition (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                food_name TEXT,
-                calories INTEGER,
-                protein REAL,
-                carbs REAL,
-                fat REAL,
-                meal_type TEXT,
-                date DATE DEFAULT CURRENT_DATE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица челленджей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS challenges (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                goal_type TEXT,
-                goal_value INTEGER,
-                reward_points INTEGER,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        ''')
-        
-        # Инициализация базовых данных
-        self.initialize_sample_data(cursor)
-        
-        conn.commit()
-        conn.close()
+        bootstrap(self.pool)
     
-    def initialize_sample_data(self, cursor):
-        """Инициализация примеров данных"""
-        # Базовые челленджи
-        challenges = [
-            ('Неделя активности', 'Выполните 5 тренировок за неделю', 'workouts', 5, 100),
-            ('Силовой вызов', 'Увеличьте рабочий вес в основных упражнениях', 'weight', 1, 150),
-            ('Кардио марафон', 'Сожгите 2000 калорий за неделю', 'calories', 2000, 200)
-        ]
-        
-        for challenge in challenges:
-            cursor.execute('''
-                INSERT OR IGNORE INTO challenges (name, description, goal_type, goal_value, reward_points)
-                VALUES (?, ?, ?, ?, ?)
-            ''', challenge)
+    def get_user_names(self, user_ids):
+        """{user_id: имя для показа} одним запросом"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = self.pool.fetchall(f'''
+            SELECT user_id, COALESCE(first_name, username) FROM users
+            WHERE user_id IN ({', '.join('?' * len(user_ids))})
+        ''', user_ids)
+        return dict(rows)
 
 class FitnessBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, shard=None, update_queue=None):
         self.token = token
-        self.application = Application.builder().token(token).build()
+        # Доля пользователей, если бот работает в нескольких процессах (см. worker_pool)
+        self.shard = shard
+        workers = shard.count if shard else 1
+        # Все отправки и правки сообщений идут через общую очередь с лимитами Telegram;
+        # общий лимит бота делится между процессами, лимит чата - нет: чат всегда в одном процессе
+        send_rate = float(os.environ.get('BOT_SEND_RATE', GLOBAL_RATE))
+        self.send_queue = SendQueue(global_rate=send_rate / workers, global_burst=max(1, GLOBAL_BURST // workers))
+        # Апдейты разных пользователей обрабатываются параллельно, одного - по порядку
+        self.update_processor = UserOrderedProcessor()
+        builder = (Application.builder().token(token).rate_limiter(self.send_queue)
+                   .concurrent_updates(self.update_processor).post_shutdown(self.on_shutdown))
+        if os.environ.get('TELEGRAM_API_URL'):
+            # Локальный Bot API сервер, например http://localhost:8081/bot
+            builder = builder.base_url(os.environ['TELEGRAM_API_URL'])
+        if update_queue is not None:
+            # Рабочий процесс получает апдейты от супервизора через свою очередь
+            builder = builder.update_queue(update_queue)
+        self.application = builder.build()
+        # Время обработки апдейтов и апдейты в работе - для /health и остановки webhook
+        self.update_metrics = UpdateMetrics()
+        self.update_metrics.install(self.application)
         self.db = DatabaseManager()
+        self.nutrition = NutritionTracker(self.db.db_path)
+        # Запросы из async-обработчиков выполняются вне event loop
+        self.adb = AsyncDatabase(self.db.pool)
+        # Частые мелкие записи копятся и сбрасываются пакетами
+        self.writer = WriteBatcher(self.db.pool)
+        # Опыт, уровень и серия обновляются в той же транзакции, что и запись тренировки
+        self.progression = get_progression(self.db.pool)
+        self.writer.add_listener('workout', self.progression.apply_workouts)
+        # Прогресс челленджей и достижения обновляются после серии - по событиям записи
+        self.challenges = ChallengeSystem(self.db.db_path)
+        self.writer.add_listener('workout', self.challenges.on_workouts)
+        self.writer.add_listener('meal', self.challenges.on_meals)
+        # Рейтинги в памяти обновляются после фиксации пакета - по данным из базы,
+        # так что откат пакета или слушателя не оставит в них лишних очков
+        self.leaderboards = get_leaderboards(self.db.pool)
+        self.writer.add_commit_listener(self.leaderboards.on_commit)
+        if shard is None:
+            self.application.job_queue.run_repeating(self.save_leaderboards, interval=LEADERBOARD_SNAPSHOT_INTERVAL)
+        else:
+            self.application.job_queue.run_repeating(self.sync_leaderboards, interval=LEADERBOARD_SYNC_INTERVAL)
+        # Смена окон ежедневных/еженедельных/ежемесячных челленджей (одна на весь бот)
+        self.challenge_scheduler = ChallengeScheduler(self.challenges, self.adb, self.leaderboards)
+        if shard is None or shard.primary:
+            self.challenge_scheduler.schedule(self.application.job_queue)
+        # Отчёты о прогрессе кэшируются до следующей записанной активности пользователя
+        self.analytics = AnalyticsDashboard(self.db.db_path)
+        self.writer.add_commit_listener(self.analytics.metrics.reports.on_commit)
+        # Графики рисуются в отдельных процессах, event loop не блокируется
+        self.charts = ChartService(self.db.pool, self.adb, workers=max(1, (os.cpu_count() or 1) // workers))
+        # Напоминания: куча по времени срабатывания и одна задача в JobQueue
+        self.reminders = ReminderDispatcher(self.adb, owns=shard.owns if shard else None)
+        self.reminders.schedule(self.application.job_queue)
         
         # Регистрация обработчиков
         self.register_handlers()
@@ -131,9 +152,11 @@ class FitnessBot:
         self.application.add_handler(CommandHandler("health", self.health_questionnaire))
         self.application.add_handler(CommandHandler("nutrition", self.nutrition_dashboard))
         self.application.add_handler(CommandHandler("workout", self.workout_tracking))
+        self.application.add_handler(CommandHandler("meal", self.log_meal))
         self.application.add_handler(CommandHandler("challenges", self.show_challenges))
         self.application.add_handler(CommandHandler("progress", self.show_progress))
         self.application.add_handler(CommandHandler("profile", self.show_profile))
+        self.application.add_handler(CommandHandler("remind", self.remind))
         
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
@@ -142,15 +165,9 @@ class FitnessBot:
         """Обработчик команды /start"""
         user = update.effective_user
         
-        # Сохраняем пользователя в базу
-        conn = sqlite3.connect('fitness_bot.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-        ''', (user.id, user.username, user.first_name, user.last_name))
-        conn.commit()
-        conn.close()
+        # Сохраняем пользователя в базу (запишется со следующим пакетом); при
+        # переполненной очереди постановка ждёт - в потоке записи, а не в event loop
+        await self.adb.write(self.writer.upsert_user, user.id, user.username, user.first_name, user.last_name)
         
         welcome_text = f"""
 🏋️‍♂️ Добро пожаловать в FitnessBot, {user.first_name}!
@@ -209,16 +226,20 @@ class FitnessBot:
     
     async def nutrition_dashboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Панель питания"""
-        nutrition_text = """
+        user = update.effective_user
+        totals = await self.adb.read(self.nutrition.get_daily_totals, user.id)
+        targets = await self.adb.read(self.nutrition.get_nutrition_targets, user.id) or DEFAULT_NUTRITION_TARGETS
+        
+        nutrition_text = f"""
 🍎 <b>Умный трекер питания</b>
 
 Полный контроль над вашим рационом:
 
 <b>Сегодняшняя статистика:</b>
-• 🔥 Калории: 0/2000 ккал
-• 💪 Белки: 0/150г 
-• 🍚 Углеводы: 0/250г
-• 🥑 Жиры: 0/65г
+• 🔥 Калории: {round(totals['calories'])}/{targets['calories']} ккал
+• 💪 Белки: {round(totals['protein'])}/{targets['protein']}г 
+• 🍚 Углеводы: {round(totals['carbs'])}/{targets['carbs']}г
+• 🥑 Жиры: {round(totals['fat'])}/{targets['fat']}г
 
 <b>Функции:</b>
 • 📝 Добавление продуктов и блюд
@@ -235,10 +256,14 @@ class FitnessBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(nutrition_text, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(nutrition_text, reply_markup=reply_markup, parse_mode='HTML')
     
     async def workout_tracking(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Трекер тренировок"""
+        """Трекер тренировок; /workout с аргументами записывает тренировку"""
+        if context.args:
+            await self.log_workout(update, context)
+            return
+        
         workout_text = """
 💪 <b>Трекер тренировок</b>
 
@@ -254,6 +279,8 @@ class FitnessBot:
 • 📈 Отслеживание прогресса
 • 🎯 Персональные программы
 • 🤖 Рекомендации ИИ
+
+Записать тренировку: /workout 45 350 Бег
 """
         
         keyboard = [
@@ -266,32 +293,75 @@ class FitnessBot:
         
         await update.message.reply_text(workout_text, reply_markup=reply_markup, parse_mode='HTML')
     
+    async def log_workout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/workout минуты [ккал] [название] - запись тренировки через пакетную запись:
+        опыт, серия и челленджи обновятся вместе с ней"""
+        args = list(context.args or [])
+        numbers = []
+        while args and args[0].isdigit() and len(numbers) < 2:
+            numbers.append(int(args.pop(0)))
+        if not numbers or not 0 < numbers[0] <= MAX_WORKOUT_MINUTES:
+            await update.message.reply_text(WORKOUT_USAGE, parse_mode='HTML')
+            return
+        
+        duration = numbers[0]
+        calories = numbers[1] if len(numbers) > 1 else 0
+        name = ' '.join(args)[:100] or 'Тренировка'
+        await self.adb.write(self.writer.log_workout, update.effective_user.id, name, duration, calories)
+        await update.message.reply_text(f"✅ Тренировка записана: {html.escape(name)}, {duration} мин, {calories} ккал\n\n"
+                                        f"Опыт и челленджи обновятся в течение пары секунд", parse_mode='HTML')
+    
+    async def log_meal(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/meal [граммы] продукт - запись приёма пищи по базе продуктов (КБЖУ на 100 г)"""
+        args = list(context.args or [])
+        grams = int(args.pop(0)) if args and args[0].isdigit() else 100
+        text = ' '.join(args)
+        if not text or not 0 < grams <= MAX_MEAL_GRAMS:
+            await update.message.reply_text(MEAL_USAGE, parse_mode='HTML')
+            return
+        
+        foods = await self.adb.read(self.nutrition.search_foods, text, 1)
+        if not foods:
+            await update.message.reply_text(f"🔍 Продукт «{html.escape(text)}» не найден", parse_mode='HTML')
+            return
+        
+        food_id, name, _, calories, protein, carbs, fat, _ = foods[0]
+        share = grams / 100
+        totals = [round((value or 0) * share, 1) for value in (calories, protein, carbs, fat)]
+        items = [{'food_id': food_id, 'name': name, 'grams': grams}]
+        await self.adb.write(self.writer.log_meal, update.effective_user.id, meal_type_for(datetime.now().hour),
+                             items, *totals)
+        await update.message.reply_text(
+            f"✅ Записано: {html.escape(name)}, {grams} г - {totals[0]} ккал "
+            f"(Б {totals[1]} / Ж {totals[3]} / У {totals[2]})\n\nИтоги дня: /nutrition", parse_mode='HTML')
+    
     async def show_challenges(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать челленджи"""
+        user = update.effective_user
+        challenges = await self.adb.read(self.challenges.get_user_challenges, user.id)
+        progress = await self.adb.read(self.progression.get, user.id)
+        
         challenges_text = """
 🏆 <b>Система челленджей и достижений</b>
 
 Участвуйте в челленджах и получайте награды!
 
-<b>Активные челленджи:</b>
-
-1. 💪 <b>Неделя активности</b>
-   Цель: 5 тренировок за неделю
-   Прогресс: ▰▰▰▱▱ 60%
-   Награда: 100 очков
-
-2. 🔥 <b>Силовой вызов</b>
-   Цель: Увеличить рабочие веса
-   Прогресс: ▰▰▱▱▱ 40%
-   Награда: 150 очков
-
-3. 🏃‍♂️ <b>Кардио марафон</b>
-   Цель: 2000 калорий за неделю
-   Прогресс: ▰▱▱▱▱ 20%
-   Награда: 200 очков
-
-<b>Ваш уровень: 3</b> (450/600 XP)
+<b>Ваши челленджи:</b>
 """
+        if challenges:
+            for number, (_, name, description, _, goal_value, reward_xp, current, completed) in enumerate(challenges, 1):
+                icon = '✅' if completed else '🎯'
+                challenges_text += f"""
+{number}. {icon} <b>{name}</b>
+   Цель: {description}
+   Прогресс: {progress_bar(current, goal_value)} ({current}/{goal_value})
+   Награда: {reward_xp} XP
+"""
+        else:
+            challenges_text += "\nВы пока не участвуете в челленджах - присоединяйтесь!\n"
+        
+        level_start, next_level = level_bounds(progress.current_level)
+        challenges_text += f"\n<b>Ваш уровень: {progress.current_level}</b> ({progress.total_xp}/{next_level or level_start} XP)\n"
         
         keyboard = [
             [InlineKeyboardButton("🎯 Присоединиться к челленджу", callback_data="join_challenge")],
@@ -301,29 +371,26 @@ class FitnessBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(challenges_text, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(challenges_text, reply_markup=reply_markup, parse_mode='HTML')
+    
+    async def choose_challenge(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список челленджей, к которым можно присоединиться"""
+        query = update.callback_query
+        available = await self.adb.read(self.challenges.get_available_challenges, query.from_user.id)
+        if not available:
+            await query.edit_message_text("🏆 Вы уже участвуете во всех активных челленджах!")
+            return
+        
+        keyboard = [
+            [InlineKeyboardButton(f"{name} (+{reward_xp} XP)", callback_data=f"join_challenge:{challenge_id}")]
+            for challenge_id, name, _, _, _, reward_xp in available
+        ]
+        await query.edit_message_text("🎯 <b>Выберите челлендж:</b>", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
     
     async def show_progress(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать прогресс"""
-        progress_text = """
-📊 <b>Ваш фитнес-прогресс</b>
-
-<b>Статистика за месяц:</b>
-• ✅ Выполнено тренировок: 12
-• 📈 Увеличение силы: +15%
-• 🏃‍♂️ Сожжено калорий: 8,500
-• ⏱️ Средняя продолжительность: 45 мин
-
-<b>Достижения этого месяца:</b>
-• 🥇 Побит личный рекорд в жиме лежа
-• 🔥 Самая интенсивная тренировка
-• 📅 7 дней подряд без пропусков
-
-<b>Рекомендации:</b>
-• 💡 Попробуйте увеличить веса на 5%
-• 🍎 Обратите внимание на потребление белка
-• 🧘 Добавьте растяжку после тренировок
-"""
+        user_id = update.effective_user.id
+        progress_text = await self.adb.read(self.analytics.generate_progress_text, user_id)
         
         keyboard = [
             [InlineKeyboardButton("📈 Подробная статистика", callback_data="detailed_stats")],
@@ -333,11 +400,12 @@ class FitnessBot:
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(progress_text, reply_markup=reply_markup, parse_mode='HTML')
+        await update.effective_message.reply_text(progress_text, reply_markup=reply_markup, parse_mode='HTML')
     
     async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать профиль пользователя"""
         user = update.effective_user
+        stats_text = await self.adb.read(self.analytics.generate_profile_stats, user.id)
         
         profile_text = f"""
 👤 <b>Ваш профиль</b>
@@ -347,12 +415,7 @@ class FitnessBot:
 • Username: @{user.username or 'Не указан'}
 • ID: {user.id}
 
-<b>Фитнес-статистика:</b>
-• Уровень: 3
-• Опыт: 450/600 XP
-• Тренировок выполнено: 12
-• Текущая серия: 3 дня
-
+{stats_text}
 <b>Настройки:</b>
 • Уведомления: ✅ Включены
 • Единицы измерения: Метрические
@@ -369,6 +432,119 @@ class FitnessBot:
         
         await update.message.reply_text(profile_text, reply_markup=reply_markup, parse_mode='HTML')
     
+    async def remind(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/remind - список напоминаний, /remind ЧЧ:ММ текст - новое, /remind stop N - отключить"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        
+        if len(args) == 2 and args[0] == 'stop' and args[1].isdigit():
+            reminder_id = int(args[1])
+            owned = any(r.kind == 'health' and r.id == reminder_id for _, r in self.reminders.user_reminders(user_id))
+            if owned:
+                await self.reminders.update('health', reminder_id, is_active=False)
+            await update.message.reply_text("🔕 Напоминание отключено" if owned else "ℹ️ Такого напоминания нет")
+            return
+        
+        if args:
+            try:
+                await self.reminders.add('health', user_id, args[0], reminder_type='custom',
+                                         message=' '.join(args[1:]) or None)
+            except ValueError:
+                await update.message.reply_text("⚠️ Укажите время в формате ЧЧ:ММ, например: /remind 08:30 Выпить воды")
+                return
+            await update.message.reply_text(f"⏰ Напоминание на {args[0]} каждый день создано!")
+            return
+        
+        reminders = self.reminders.user_reminders(user_id)
+        if not reminders:
+            await update.message.reply_text("🔔 У вас нет напоминаний.\n\nСоздайте: /remind 08:30 Выпить воды")
+            return
+        text = "🔔 <b>Ваши напоминания:</b>\n\n"
+        for fire_at, reminder in reminders:
+            when = f"{fire_at:%d.%m %H:%M}" if fire_at else "-"
+            text += f"• #{reminder.id} {reminder.scheduled_time:%H:%M} - {html.escape(reminder.text)} (следующее: {when})\n"
+        text += "\nОтключить: /remind stop N"
+        await update.message.reply_text(text, parse_mode='HTML')
+    
+    async def show_leaderboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE, board='week'):
+        """Рейтинг за период или по челленджу: топ и место пользователя"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        
+        if board.startswith('challenge:'):
+            challenge_id = int(board.split(':', 1)[1])
+            key = challenge_board_key(challenge_id)
+            row = await self.adb.fetchone('SELECT name FROM challenges WHERE id = ?', (challenge_id,))
+            title, unit = f"челленджа «{row[0] if row else challenge_id}»", ''
+        else:
+            key = xp_board_key(board)
+            title, unit = LEADERBOARD_TITLES[board], ' XP'
+        
+        # Топ и место берутся из памяти, из базы - только имена
+        top, position = self.leaderboards.page(key, user_id)
+        names = await self.adb.read(self.db.get_user_names, [member for _, member, _ in top])
+        
+        text = f"📊 <b>Рейтинг {title}</b>\n\n"
+        if top:
+            for rank, member, score in top:
+                text += f"{MEDALS.get(rank, f'{rank}.')} {names.get(member) or 'Атлет'} - {score}{unit}\n"
+        else:
+            text += "Пока никто не набрал очков - станьте первым!\n"
+        text += f"\n<b>Ваше место:</b> {position[0]} ({position[1]}{unit})" if position else "\nВы пока не в рейтинге"
+        
+        challenges = await self.adb.read(self.challenges.get_user_challenges, user_id)
+        keyboard = [[InlineKeyboardButton("Неделя", callback_data="leaderboard:week"),
+                     InlineKeyboardButton("Месяц", callback_data="leaderboard:month"),
+                     InlineKeyboardButton("Всё время", callback_data="leaderboard:all")]]
+        keyboard += [[InlineKeyboardButton(f"🏆 {name}", callback_data=f"leaderboard:challenge:{challenge_id}")]
+                     for challenge_id, name, *_ in challenges[:3]]
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    
+    async def choose_export_format(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выбор формата выгрузки данных"""
+        keyboard = [[InlineKeyboardButton(title, callback_data=f"export_data:{fmt}")]
+                    for fmt, title in EXPORT_TITLES.items()]
+        await update.callback_query.edit_message_text(
+            "📤 <b>Экспорт данных</b>\n\nВыберите формат файла:",
+            reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    
+    async def send_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE, fmt):
+        """Выгрузка всех данных пользователя файлом"""
+        query = update.callback_query
+        await query.edit_message_text("⏳ Готовлю файл с вашими данными...")
+        # Файл собирается в потоке чтения, event loop не блокируется
+        export = await self.adb.read(self.analytics.export_user_data, query.from_user.id, fmt)
+        try:
+            await update.effective_message.reply_document(
+                document=export, filename=f"fitness_export_{datetime.now():%Y-%m-%d}.{fmt}",
+                caption="📤 Ваши данные: здоровье, тренировки, питание и достижения")
+        finally:
+            export.close()
+    
+    async def send_charts(self, update: Update, context: ContextTypes.DEFAULT_TYPE, charts):
+        """Отправка графиков фотографиями; графики без данных пропускаются"""
+        query = update.callback_query
+        await query.edit_message_text("⏳ Рисую графики...")
+        sent_any = False
+        for chart in charts:
+            png = await self.charts.render(query.from_user.id, chart)
+            if png is not None:
+                await update.effective_message.reply_photo(photo=png, caption=CHART_TITLES[chart])
+                sent_any = True
+        await query.edit_message_text("📈 Ваши графики готовы" if sent_any else
+                                      "😔 Пока нет данных для графиков.\n\nЗаписывайте тренировки и питание - и они появятся!")
+    
+    async def save_leaderboards(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодическое сохранение снимка рейтингов"""
+        saved = await self.adb.write(self.leaderboards.save)
+        if saved:
+            logger.info("Снимок рейтингов сохранён: %d записей", saved)
+    
+    async def sync_leaderboards(self, context: ContextTypes.DEFAULT_TYPE):
+        """Сохранение своих рейтингов и чтение чужих (несколько процессов)"""
+        await self.adb.write(self.leaderboards.save)
+        await self.adb.read(self.leaderboards.refresh)
+
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик callback запросов"""
         query = update.callback_query
@@ -381,10 +557,33 @@ class FitnessBot:
             await query.edit_message_text("🏥 <b>Анкета здоровья</b>\n\nПожалуйста, ответьте на вопросы...", parse_mode='HTML')
         elif callback_data == "nutrition_start":
             await self.nutrition_dashboard(update, context)
+        elif callback_data == "add_meal":
+            await query.edit_message_text(MEAL_USAGE, parse_mode='HTML')
+        elif callback_data in ("workout_start", "start_workout"):
+            await query.edit_message_text(WORKOUT_USAGE, parse_mode='HTML')
         elif callback_data == "challenges_view":
             await self.show_challenges(update, context)
         elif callback_data == "progress_view":
             await self.show_progress(update, context)
+        elif callback_data == "leaderboard":
+            await self.show_leaderboard(update, context)
+        elif callback_data.startswith("leaderboard:"):
+            await self.show_leaderboard(update, context, callback_data.split(":", 1)[1])
+        elif callback_data == "detailed_stats":
+            await self.send_charts(update, context, ['calories', 'macros', 'weight'])
+        elif callback_data == "workout_calendar":
+            await self.send_charts(update, context, ['calendar'])
+        elif callback_data == "export_data":
+            await self.choose_export_format(update, context)
+        elif callback_data.startswith("export_data:") and callback_data.split(":", 1)[1] in EXPORT_TITLES:
+            await self.send_export(update, context, callback_data.split(":", 1)[1])
+        elif callback_data == "join_challenge":
+            await self.choose_challenge(update, context)
+        elif callback_data.startswith("join_challenge:"):
+            challenge_id = int(callback_data.split(":", 1)[1])
+            joined = await self.adb.write(self.challenges.join_challenge, query.from_user.id, challenge_id)
+            await query.edit_message_text("✅ Вы присоединились к челленджу! Прогресс смотрите в /challenges" if joined
+                                          else "ℹ️ Вы уже участвуете в этом челлендже")
         else:
             await query.edit_message_text(f"🔧 <b>Функция в разработке</b>\n\nРаздел '{callback_data}' скоро будет доступен!", parse_mode='HTML')
     
@@ -415,11 +614,13 @@ class FitnessBot:
 /start - Главное меню и приветствие
 /help - Эта справка
 /profile - Ваш профиль
+/remind - Напоминания
 
 <b>Фитнес-функции:</b>
 /health - Анкета здоровья и рекомендации
 /nutrition - Трекер питания и калорий
-/workout - Трекер тренировок
+/workout - Трекер тренировок (/workout 45 350 Бег - записать)
+/meal - Записать приём пищи (/meal 150 гречка)
 /challenges - Челленджи и достижения
 /progress - Статистика и аналитика
 
@@ -430,13 +631,47 @@ class FitnessBot:
 """
         await update.message.reply_text(help_text, parse_mode='HTML')
 
+    async def on_shutdown(self, application: Application):
+        """Закрытие соединений с базой при остановке"""
+        self.writer.close()
+        logger.info("Статистика пакетной записи: %s", self.writer.stats())
+        self.leaderboards.save()
+        logger.info("Статистика запросов к БД: %s", self.adb.stats())
+        logger.info("Статистика графиков: %s", self.charts.stats())
+        logger.info("Статистика напоминаний: %s", self.reminders.stats())
+        logger.info("Статистика обработки апдейтов: %s", self.update_processor.stats())
+        self.charts.close()
+        self.adb.close()
+        close_all()
+
+    def health_stats(self):
+        """Дополнительные показатели для /health"""
+        return {
+            'updates': self.update_processor.stats(),
+            'send_queue': self.send_queue.backlog(),
+            'write_queue': self.writer.queue_depth(),
+        }
+
+    async def run_webhook(self, config, stop=None):
+        """Работа через webhook до SIGTERM/SIGINT (или до stop.set())"""
+        try:
+            await serve(self.application, config, self.update_metrics, self.health_stats, stop)
+        finally:
+            # post_shutdown вызывается только из run_polling/run_webhook
+            await self.on_shutdown(self.application)
+
     def run(self):
-        """Запуск бота"""
+        """Запуск бота: webhook, если он настроен в окружении, иначе long polling"""
+        config = webhook_config(self.token)
         logger.info("FitnessBot запущен и готов к работе!")
         print("✅ Бот успешно запущен!")
         print("📊 База данных инициализирована")
         print("🤖 Все функции активированы")
-        self.application.run_polling()
+        if config is None:
+            self.application.run_polling()
+        else:
+            print(f"🌐 Webhook: {config['url']}")
+            asyncio.run(self.run_webhook(config))
 
 # Запуск бота
 if __name__ == '__main__':
@@ -448,5 +683,10 @@ if __name__ == '__main__':
         print("ℹ️ Установите переменную окружения BOT_TOKEN или укажите токен в коде")
         exit(1)
     
-    bot = FitnessBot(BOT_TOKEN)
-    bot.run()
\ No newline at end of file
+    # BOT_WORKERS > 1: апдейты принимает этот процесс, обрабатывают рабочие процессы
+    workers = int(os.environ.get('BOT_WORKERS', 1))
+    if workers > 1:
+        run_cluster(BOT_TOKEN, workers)
+    else:
+        bot = FitnessBot(BOT_TOKEN)
+        bot.run()
\ No newline at end of file
@@ -0,0 +1,170 @@
+# metrics_store.py
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+
+# Суммы дневных показателей за период
+Totals = namedtuple('Totals', 'workouts active_days duration calories_burned '
+                              'meals meal_days calories_consumed protein carbs fat')
+EMPTY_TOTALS = Totals(0, 0, 0, 0, 0, 0, 0.0, 0.0, 0.0, 0.0)
+
+# Готовых отчётов в кэше и время их жизни, секунд
+REPORT_CACHE_SIZE = 2048
+REPORT_TTL = 300
+
+
+class MetricsStore:
+    """Чтение дневных показателей пользователей: тренировки из
+    user_daily_metrics, питание из daily_nutrition.
+
+    Обе таблицы поддерживаются триггерами на workouts и meals, поэтому отчёт
+    за период читает по строке на день, а не всю историю записей.
+    """
+
+    def __init__(self, pool, reports=None):
+        self.pool = pool
+        # Кэш отчётов, построенных по этим показателям
+        self.reports = reports or ReportCache()
+
+    def totals(self, user_id, start=None, end=None):
+        """Суммы за период [start, end] (даты включительно; None - без границы)"""
+        period = (user_id, _bound(start, '0000-01-01'), _bound(end, '9999-12-31'))
+        row = self.pool.fetchone('''
+            SELECT * FROM (
+                SELECT COALESCE(SUM(workouts), 0), COALESCE(SUM(workouts > 0), 0),
+                       COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0)
+                FROM user_daily_metrics
+                WHERE user_id = ? AND date >= ? AND date <= ?
+            ), (
+                SELECT COALESCE(SUM(meals), 0), COALESCE(SUM(meals > 0), 0),
+                       COALESCE(SUM(total_calories), 0), COALESCE(SUM(total_protein), 0),
+                       COALESCE(SUM(total_carbs), 0), COALESCE(SUM(total_fat), 0)
+                FROM daily_nutrition
+                WHERE user_id = ? AND date >= ? AND date <= ?
+            )
+        ''', period + period)
+        return Totals(*row) if row else EMPTY_TOTALS
+
+    def last_days(self, user_id, days, today=None):
+        """Суммы за последние days дней, включая сегодня"""
+        today = today or date.today()
+        return self.totals(user_id, today - timedelta(days=days - 1), today)
+
+    def daily(self, user_id, start, end):
+        """Строки по дням с активностью: (date, workouts, duration, calories_burned,
+        meals, calories_consumed, protein, carbs, fat)"""
+        period = (user_id, _bound(start, '0000-01-01'), _bound(end, '9999-12-31'))
+        return self.pool.fetchall('''
+            SELECT date, SUM(workouts), SUM(duration), SUM(calories_burned),
+                   SUM(meals), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+            FROM (
+                SELECT date, workouts, duration, calories_burned,
+                       0 AS meals, 0.0 AS calories, 0.0 AS protein, 0.0 AS carbs, 0.0 AS fat
+                FROM user_daily_metrics
+                WHERE user_id = ? AND date >= ? AND date <= ? AND workouts > 0
+                UNION ALL
+                SELECT date, 0, 0, 0, meals, total_calories, total_protein, total_carbs, total_fat
+                FROM daily_nutrition
+                WHERE user_id = ? AND date >= ? AND date <= ? AND meals > 0
+            )
+            GROUP BY date
+            ORDER BY date
+        ''', period + period)
+
+    def weights(self, user_id, start=None, end=None):
+        """[(date, weight)] из истории веса"""
+        return self.pool.fetchall('''
+            SELECT date, weight FROM weight_log
+            WHERE user_id = ? AND date >= ? AND date <= ?
+            ORDER BY date
+        ''', (user_id, _bound(start, '0000-01-01'), _bound(end, '9999-12-31')))
+
+
+def _bound(value, default):
+    if value is None:
+        return default
+    return value.isoformat() if isinstance(value, date) else value
+
+
+class ReportCache:
+    """LRU-кэш готовых отчётов с временем жизни записей.
+
+    Ключ записи начинается с user_id. Новая активность пользователя
+    удаляет все его отчёты по индексу user_id -> ключи, который живёт
+    столько же, сколько сами записи. Отчёт, который строился во время
+    сброса, в кэш не попадает: общее поколение кэша уже сменилось.
+    """
+
+    def __init__(self, maxsize=REPORT_CACHE_SIZE, ttl=REPORT_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def get_or_render(self, key, render):
+        """Отчёт из кэша или render() с сохранением результата"""
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+            self.misses += 1
+
+        value = render()
+
+        with self._lock:
+            if self._generation == generation:
+                self._entries[key] = (value, self.clock() + self.ttl)
+                self._entries.move_to_end(key)
+                self._keys.setdefault(key[0], set()).add(key)
+                while len(self._entries) > self.maxsize:
+                    self._discard(next(iter(self._entries)))
+        return value
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                for key in self._keys.pop(user_id, ()):
+                    del self._entries[key]
+
+    def on_commit(self, batch):
+        """Слушатель WriteBatcher: сброс отчётов пользователей из записанного пакета"""
+        self.invalidate({row[0] for rows in batch.values() for row in rows})
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_metrics(pool):
+    """Общее хранилище показателей и кэш отчётов для файла базы (одни на процесс)"""
+    with _stores_lock:
+        store = _stores.get(pool.db_path)
+        if store is None:
+            store = MetricsStore(pool)
+            _stores[pool.db_path] = store
+        return store
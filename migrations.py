@@ -0,0 +1,814 @@
+# migrations.py
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Каноническая схема (версия 1). Раньше одни и те же таблицы создавались
+# в нескольких модулях с разным набором колонок - теперь схема одна.
+TABLES = {
+    'users': [
+        ('user_id', 'INTEGER PRIMARY KEY'),
+        ('username', 'TEXT'),
+        ('first_name', 'TEXT'),
+        ('last_name', 'TEXT'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'health_questionnaire': [
+        ('user_id', 'INTEGER PRIMARY KEY'),
+        ('age', 'INTEGER'),
+        ('weight', 'REAL'),
+        ('height', 'REAL'),
+        ('gender', 'TEXT'),
+        ('fitness_level', 'TEXT'),
+        ('goals', 'TEXT'),
+        ('injuries', 'TEXT'),
+        ('limitations', 'TEXT'),
+        ('medical_conditions', 'TEXT'),
+        ('sleep_hours', 'INTEGER'),
+        ('stress_level', 'INTEGER'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+        ('updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'health_recommendations': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('type', 'TEXT'),
+        ('title', 'TEXT'),
+        ('description', 'TEXT'),
+        ('priority', 'INTEGER'),
+        ('is_completed', 'BOOLEAN DEFAULT FALSE'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'health_reminders': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('reminder_type', 'TEXT'),
+        ('message', 'TEXT'),
+        ('scheduled_time', 'TIME'),
+        ('is_active', 'BOOLEAN DEFAULT TRUE'),
+        ('days_of_week', 'TEXT'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'workouts': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('workout_name', 'TEXT'),
+        ('duration', 'INTEGER'),
+        ('calories_burned', 'INTEGER'),
+        ('date', 'DATE DEFAULT CURRENT_DATE'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'nutrition': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('food_name', 'TEXT'),
+        ('calories', 'INTEGER'),
+        ('protein', 'REAL'),
+        ('carbs', 'REAL'),
+        ('fat', 'REAL'),
+        ('meal_type', 'TEXT'),
+        ('date', 'DATE DEFAULT CURRENT_DATE'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'challenges': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('name', 'TEXT NOT NULL'),
+        ('description', 'TEXT'),
+        ('challenge_type', 'TEXT'),  # 'daily', 'weekly', 'monthly', 'special'
+        ('goal_type', 'TEXT'),  # 'reps', 'weight', 'workouts', 'streak', 'calories', 'meals'
+        ('goal_value', 'INTEGER'),
+        ('reward_xp', 'INTEGER'),
+        ('difficulty', 'TEXT'),
+        ('start_date', 'DATE'),
+        ('end_date', 'DATE'),
+        ('is_active', 'BOOLEAN DEFAULT TRUE'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'achievements_template': [
+        ('achievement_type', 'TEXT PRIMARY KEY'),
+        ('achievement_name', 'TEXT'),
+        ('description', 'TEXT'),
+        ('reward_xp', 'INTEGER'),
+    ],
+    'user_achievements': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('achievement_type', 'TEXT'),
+        ('achievement_name', 'TEXT'),
+        ('achievement_data', 'TEXT'),
+        ('earned_xp', 'INTEGER'),
+        ('earned_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'user_challenges': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('challenge_id', 'INTEGER'),
+        ('current_progress', 'INTEGER DEFAULT 0'),
+        ('is_completed', 'BOOLEAN DEFAULT FALSE'),
+        ('completed_at', 'DATETIME'),
+        ('joined_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'user_levels': [
+        ('user_id', 'INTEGER PRIMARY KEY'),
+        ('total_xp', 'INTEGER DEFAULT 0'),
+        ('current_level', 'INTEGER DEFAULT 1'),
+        ('workouts_completed', 'INTEGER DEFAULT 0'),
+        ('streak_days', 'INTEGER DEFAULT 0'),
+        ('last_workout_date', 'DATE'),
+        ('updated_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'exercises': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('name', 'TEXT NOT NULL'),
+        ('description', 'TEXT'),
+        ('category', 'TEXT'),
+        ('muscle_group', 'TEXT'),
+        ('equipment', 'TEXT'),
+        ('difficulty', 'TEXT'),
+        ('instructions', 'TEXT'),
+        ('video_url', 'TEXT'),
+        ('image_url', 'TEXT'),
+        ('calories_burned', 'INTEGER'),
+        ('is_custom', 'BOOLEAN DEFAULT FALSE'),
+        ('created_by', 'INTEGER'),
+        ('rating', 'REAL DEFAULT 4.5'),
+        ('rating_count', 'INTEGER DEFAULT 0'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'favorite_exercises': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('exercise_id', 'INTEGER'),
+        ('added_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+        ('UNIQUE(user_id, exercise_id)', None),
+    ],
+    'exercise_reviews': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('exercise_id', 'INTEGER'),
+        ('rating', 'INTEGER'),
+        ('comment', 'TEXT'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'food_database': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('name', 'TEXT NOT NULL'),
+        ('category', 'TEXT'),
+        ('calories', 'REAL'),
+        ('protein', 'REAL'),
+        ('carbs', 'REAL'),
+        ('fat', 'REAL'),
+        ('fiber', 'REAL'),
+        ('sugar', 'REAL'),
+        ('serving_size', 'TEXT'),
+        ('is_custom', 'BOOLEAN DEFAULT FALSE'),
+        ('created_by', 'INTEGER'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'daily_nutrition': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('date', 'DATE DEFAULT CURRENT_DATE'),
+        ('total_calories', 'REAL DEFAULT 0'),
+        ('total_protein', 'REAL DEFAULT 0'),
+        ('total_carbs', 'REAL DEFAULT 0'),
+        ('total_fat', 'REAL DEFAULT 0'),
+        ('goal_calories', 'REAL'),
+        ('goal_protein', 'REAL'),
+        ('goal_carbs', 'REAL'),
+        ('goal_fat', 'REAL'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'meals': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('date', 'DATE DEFAULT CURRENT_DATE'),
+        ('meal_type', 'TEXT'),  # breakfast, lunch, dinner, snack
+        ('food_items', 'TEXT'),  # JSON список продуктов
+        ('total_calories', 'REAL'),
+        ('total_protein', 'REAL'),
+        ('total_carbs', 'REAL'),
+        ('total_fat', 'REAL'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'meal_reminders': [
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('user_id', 'INTEGER'),
+        ('meal_type', 'TEXT'),
+        ('scheduled_time', 'TIME'),
+        ('is_active', 'BOOLEAN DEFAULT TRUE'),
+        ('message', 'TEXT'),
+        ('created_at', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+    ],
+}
+
+
+def table_columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _column_for_alter(decl):
+    """Определение колонки, допустимое в ALTER TABLE ADD COLUMN.
+
+    SQLite не позволяет добавлять колонки с PRIMARY KEY/UNIQUE и
+    с неконстантным значением по умолчанию (CURRENT_TIMESTAMP и т.п.).
+    """
+    if 'CURRENT_' in decl:
+        decl = decl.split(' DEFAULT ')[0]
+    return decl
+
+
+def _create_canonical_schema(cursor):
+    for table, columns in TABLES.items():
+        definitions = [name if decl is None else f'{name} {decl}' for name, decl in columns]
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} (\n    ' + ',\n    '.join(definitions) + '\n)')
+
+        # Таблица могла быть создана старым кодом с другим набором колонок
+        existing = table_columns(cursor, table)
+        for name, decl in columns:
+            if decl is not None and name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {_column_for_alter(decl)}')
+
+    # Старый DatabaseManager хранил награду челленджа в reward_points
+    if 'reward_points' in table_columns(cursor, 'challenges'):
+        cursor.execute('UPDATE challenges SET reward_xp = reward_points WHERE reward_xp IS NULL')
+
+
+LOOKUP_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_workouts_user_date ON workouts(user_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_meals_user_date ON meals(user_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_nutrition_user_date ON nutrition(user_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_user_challenges_user_challenge ON user_challenges(user_id, challenge_id)',
+    'CREATE INDEX IF NOT EXISTS idx_user_achievements_user_type ON user_achievements(user_id, achievement_type)',
+    'CREATE INDEX IF NOT EXISTS idx_health_recommendations_user ON health_recommendations(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_health_reminders_user ON health_reminders(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_meal_reminders_user ON meal_reminders(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_daily_nutrition_user_date ON daily_nutrition(user_id, date)',
+)
+
+
+def _create_lookup_indexes(cursor):
+    for statement in LOOKUP_INDEXES:
+        cursor.execute(statement)
+
+
+def _create_app_meta(cursor):
+    # Служебные значения приложения (например, версия стартовых данных)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _deduplicate_catalogs(cursor):
+    """Удаление дублей стартовых данных и уникальные ключи по имени.
+
+    Раньше INSERT OR IGNORE ничего не игнорировал, и каждый перезапуск
+    добавлял копии упражнений, продуктов и челленджей. Ссылки на дубли
+    переводятся на самую раннюю запись, после чего дубли удаляются.
+    """
+    cursor.execute('UPDATE exercises SET is_custom = 0 WHERE is_custom IS NULL')
+    cursor.execute('UPDATE food_database SET is_custom = 0 WHERE is_custom IS NULL')
+
+    # Соответствие "дубль -> оставляемая запись"
+    cursor.execute('''
+        CREATE TEMP TABLE exercise_dupes AS
+        SELECT e.id AS dupe_id, keep.keep_id
+        FROM exercises e
+        JOIN (SELECT name, MIN(id) AS keep_id FROM exercises WHERE is_custom = 0 GROUP BY name) keep
+          ON keep.name = e.name
+        WHERE e.is_custom = 0 AND e.id <> keep.keep_id
+    ''')
+    cursor.execute('''
+        UPDATE OR IGNORE favorite_exercises
+        SET exercise_id = (SELECT keep_id FROM exercise_dupes WHERE dupe_id = exercise_id)
+        WHERE exercise_id IN (SELECT dupe_id FROM exercise_dupes)
+    ''')
+    # Избранное, которое уже было у пользователя для оставляемой записи
+    cursor.execute('DELETE FROM favorite_exercises WHERE exercise_id IN (SELECT dupe_id FROM exercise_dupes)')
+    cursor.execute('''
+        UPDATE exercise_reviews
+        SET exercise_id = (SELECT keep_id FROM exercise_dupes WHERE dupe_id = exercise_id)
+        WHERE exercise_id IN (SELECT dupe_id FROM exercise_dupes)
+    ''')
+    cursor.execute('DELETE FROM exercises WHERE id IN (SELECT dupe_id FROM exercise_dupes)')
+    cursor.execute('DROP TABLE exercise_dupes')
+
+    cursor.execute('''
+        CREATE TEMP TABLE challenge_dupes AS
+        SELECT c.id AS dupe_id, keep.keep_id
+        FROM challenges c
+        JOIN (SELECT name, MIN(id) AS keep_id FROM challenges GROUP BY name) keep
+          ON keep.name = c.name
+        WHERE c.id <> keep.keep_id
+    ''')
+    cursor.execute('''
+        UPDATE user_challenges
+        SET challenge_id = (SELECT keep_id FROM challenge_dupes WHERE dupe_id = challenge_id)
+        WHERE challenge_id IN (SELECT dupe_id FROM challenge_dupes)
+    ''')
+    cursor.execute('DELETE FROM challenges WHERE id IN (SELECT dupe_id FROM challenge_dupes)')
+    cursor.execute('DROP TABLE challenge_dupes')
+
+    cursor.execute('''
+        DELETE FROM food_database
+        WHERE is_custom = 0
+          AND id NOT IN (SELECT MIN(id) FROM food_database WHERE is_custom = 0 GROUP BY name)
+    ''')
+
+    # Пользовательские записи могут повторять имена, стартовые - нет
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_exercises_name ON exercises(name) WHERE is_custom = 0')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_food_database_name ON food_database(name) WHERE is_custom = 0')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_challenges_name ON challenges(name)')
+
+
+# Поисковые индексы FTS5 поверх таблиц-справочников (external content):
+# (таблица FTS, исходная таблица, индексируемые колонки, токенизатор)
+FTS_INDEXES = (
+    ('exercises_fts', 'exercises', ('name', 'description', 'instructions'),
+     "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"),
+    ('exercises_trigram', 'exercises', ('name',), "tokenize = 'trigram'"),
+    ('food_fts', 'food_database', ('name',),
+     "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"),
+    ('food_trigram', 'food_database', ('name',), "tokenize = 'trigram'"),
+)
+
+
+def _create_search_indexes(cursor):
+    # Инструкции раньше сохранялись через json.dumps с \uXXXX-экранированием,
+    # и кириллица в них была недоступна для поиска
+    cursor.execute("SELECT id, instructions FROM exercises WHERE instructions LIKE '%\\u%'")
+    for exercise_id, instructions in cursor.fetchall():
+        try:
+            readable = json.dumps(json.loads(instructions), ensure_ascii=False)
+        except ValueError:
+            continue
+        cursor.execute('UPDATE exercises SET instructions = ? WHERE id = ?', (readable, exercise_id))
+
+    for fts, source, columns, options in FTS_INDEXES:
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                       f"{column_list}, content = '{source}', content_rowid = 'id', {options})")
+
+        # Триггеры держат индекс в синхронизации с исходной таблицей
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column_list} ON {source} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def _create_daily_nutrition_rollup(cursor):
+    """Дневные итоги питания, поддерживаемые триггерами на meals.
+
+    Каждая вставка, правка или удаление приёма пищи в той же транзакции
+    изменяет строку daily_nutrition за этот день, поэтому итоги дня
+    читаются одним поиском по ключу (user_id, date).
+    """
+    # Раньше таблицу никто не заполнял; на случай дублей оставляем первую строку
+    cursor.execute('''
+        DELETE FROM daily_nutrition
+        WHERE id NOT IN (SELECT MIN(id) FROM daily_nutrition GROUP BY user_id, date)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_daily_nutrition_user_date')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_daily_nutrition_user_date ON daily_nutrition(user_id, date)')
+
+    # Пересчёт итогов по уже сохранённым приёмам пищи
+    cursor.execute('''
+        INSERT INTO daily_nutrition (user_id, date, total_calories, total_protein, total_carbs, total_fat)
+        SELECT user_id, date,
+               COALESCE(SUM(total_calories), 0), COALESCE(SUM(total_protein), 0),
+               COALESCE(SUM(total_carbs), 0), COALESCE(SUM(total_fat), 0)
+        FROM meals
+        WHERE true
+        GROUP BY user_id, date
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            total_calories = excluded.total_calories,
+            total_protein = excluded.total_protein,
+            total_carbs = excluded.total_carbs,
+            total_fat = excluded.total_fat
+    ''')
+
+    add_meal = '''
+        INSERT INTO daily_nutrition (user_id, date, total_calories, total_protein, total_carbs, total_fat)
+        VALUES (new.user_id, new.date, COALESCE(new.total_calories, 0), COALESCE(new.total_protein, 0),
+                COALESCE(new.total_carbs, 0), COALESCE(new.total_fat, 0))
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            total_calories = total_calories + excluded.total_calories,
+            total_protein = total_protein + excluded.total_protein,
+            total_carbs = total_carbs + excluded.total_carbs,
+            total_fat = total_fat + excluded.total_fat;
+    '''
+    remove_meal = '''
+        UPDATE daily_nutrition SET
+            total_calories = total_calories - COALESCE(old.total_calories, 0),
+            total_protein = total_protein - COALESCE(old.total_protein, 0),
+            total_carbs = total_carbs - COALESCE(old.total_carbs, 0),
+            total_fat = total_fat - COALESCE(old.total_fat, 0)
+        WHERE user_id = old.user_id AND date = old.date;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS meals_rollup_ai AFTER INSERT ON meals BEGIN {add_meal} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS meals_rollup_ad AFTER DELETE ON meals BEGIN {remove_meal} END')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_rollup_au
+        AFTER UPDATE OF user_id, date, total_calories, total_protein, total_carbs, total_fat ON meals
+        BEGIN ''' + remove_meal + add_meal + ''' END
+    ''')
+
+
+def _add_questionnaire_version(cursor):
+    # Номер версии анкеты: по нему кэшируются рассчитанные цели по питанию
+    cursor.execute('ALTER TABLE health_questionnaire ADD COLUMN version INTEGER DEFAULT 1')
+
+
+def _unique_health_recommendations(cursor):
+    # Каждое сохранение анкеты добавляло полный набор рекомендаций заново;
+    # оставляем по одной (самой свежей) рекомендации каждого типа
+    cursor.execute('''
+        DELETE FROM health_recommendations
+        WHERE id NOT IN (SELECT MAX(id) FROM health_recommendations GROUP BY user_id, type)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_health_recommendations_user')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_health_recommendations_user_type
+        ON health_recommendations(user_id, type)
+    ''')
+
+
+
+def _unique_user_achievements(cursor):
+    # Оставляем самое раннее получение каждого достижения
+    cursor.execute('''
+        DELETE FROM user_achievements
+        WHERE id NOT IN (SELECT MIN(id) FROM user_achievements GROUP BY user_id, achievement_type)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_user_achievements_user_type')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_achievements_user_type
+        ON user_achievements(user_id, achievement_type)
+    ''')
+
+
+
+def _create_leaderboard_snapshots(cursor):
+    # Снимок рейтингов из памяти процесса, чтобы не пересобирать их при запуске.
+    # baseline - опыт пользователя на начало периода (для недельных и месячных)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_entries (
+            board TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            baseline INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (board, user_id)
+        )
+    ''')
+
+
+def _create_challenge_rollover_tables(cursor):
+    # Итоги участия в закончившихся окнах челленджей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_challenges_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_challenge_id INTEGER,
+            user_id INTEGER,
+            challenge_id INTEGER,
+            current_progress INTEGER,
+            is_completed BOOLEAN,
+            completed_at DATETIME,
+            joined_at DATETIME,
+            window_start DATE,
+            window_end DATE,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_challenges_archive_user
+        ON user_challenges_archive(user_id, challenge_id)
+    ''')
+    # Поиск участий из прошлого окна челленджа
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_challenges_challenge_joined
+        ON user_challenges(challenge_id, joined_at)
+    ''')
+    # Журнал запусков смены окон
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS challenge_rollovers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at DATETIME,
+            duration_ms REAL,
+            challenges INTEGER,
+            archived INTEGER,
+            slices INTEGER
+        )
+    ''')
+
+
+def _create_daily_metrics_rollup(cursor):
+    """Дневные показатели пользователя для отчётов о прогрессе.
+
+    Как и daily_nutrition, строка (user_id, date) поддерживается триггерами
+    на workouts и meals в той же транзакции, что и запись, поэтому отчёт
+    за любой период - это сумма по нескольким десяткам строк.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_daily_metrics (
+            user_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            calories_burned INTEGER NOT NULL DEFAULT 0,
+            meals INTEGER NOT NULL DEFAULT 0,
+            calories_consumed REAL NOT NULL DEFAULT 0,
+            protein REAL NOT NULL DEFAULT 0,
+            carbs REAL NOT NULL DEFAULT 0,
+            fat REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+    ''')
+
+    # Показатели по уже сохранённой истории
+    cursor.execute('''
+        INSERT INTO user_daily_metrics (user_id, date, workouts, duration, calories_burned)
+        SELECT user_id, date, COUNT(*), COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0)
+        FROM workouts
+        WHERE true
+        GROUP BY user_id, date
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            workouts = excluded.workouts,
+            duration = excluded.duration,
+            calories_burned = excluded.calories_burned
+    ''')
+    cursor.execute('''
+        INSERT INTO user_daily_metrics (user_id, date, meals, calories_consumed, protein, carbs, fat)
+        SELECT user_id, date, COUNT(*),
+               COALESCE(SUM(total_calories), 0), COALESCE(SUM(total_protein), 0),
+               COALESCE(SUM(total_carbs), 0), COALESCE(SUM(total_fat), 0)
+        FROM meals
+        WHERE true
+        GROUP BY user_id, date
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            meals = excluded.meals,
+            calories_consumed = excluded.calories_consumed,
+            protein = excluded.protein,
+            carbs = excluded.carbs,
+            fat = excluded.fat
+    ''')
+
+    add_workout = '''
+        INSERT INTO user_daily_metrics (user_id, date, workouts, duration, calories_burned)
+        VALUES (new.user_id, new.date, 1, COALESCE(new.duration, 0), COALESCE(new.calories_burned, 0))
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            workouts = workouts + 1,
+            duration = duration + excluded.duration,
+            calories_burned = calories_burned + excluded.calories_burned;
+    '''
+    remove_workout = '''
+        UPDATE user_daily_metrics SET
+            workouts = workouts - 1,
+            duration = duration - COALESCE(old.duration, 0),
+            calories_burned = calories_burned - COALESCE(old.calories_burned, 0)
+        WHERE user_id = old.user_id AND date = old.date;
+    '''
+    add_meal = '''
+        INSERT INTO user_daily_metrics (user_id, date, meals, calories_consumed, protein, carbs, fat)
+        VALUES (new.user_id, new.date, 1, COALESCE(new.total_calories, 0), COALESCE(new.total_protein, 0),
+                COALESCE(new.total_carbs, 0), COALESCE(new.total_fat, 0))
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            meals = meals + 1,
+            calories_consumed = calories_consumed + excluded.calories_consumed,
+            protein = protein + excluded.protein,
+            carbs = carbs + excluded.carbs,
+            fat = fat + excluded.fat;
+    '''
+    remove_meal = '''
+        UPDATE user_daily_metrics SET
+            meals = meals - 1,
+            calories_consumed = calories_consumed - COALESCE(old.total_calories, 0),
+            protein = protein - COALESCE(old.total_protein, 0),
+            carbs = carbs - COALESCE(old.total_carbs, 0),
+            fat = fat - COALESCE(old.total_fat, 0)
+        WHERE user_id = old.user_id AND date = old.date;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS workouts_metrics_ai AFTER INSERT ON workouts BEGIN {add_workout} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS workouts_metrics_ad AFTER DELETE ON workouts BEGIN {remove_workout} END')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS workouts_metrics_au
+        AFTER UPDATE OF user_id, date, duration, calories_burned ON workouts
+        BEGIN ''' + remove_workout + add_workout + ''' END
+    ''')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS meals_metrics_ai AFTER INSERT ON meals BEGIN {add_meal} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS meals_metrics_ad AFTER DELETE ON meals BEGIN {remove_meal} END')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_metrics_au
+        AFTER UPDATE OF user_id, date, total_calories, total_protein, total_carbs, total_fat ON meals
+        BEGIN ''' + remove_meal + add_meal + ''' END
+    ''')
+
+
+def _create_weight_log(cursor):
+    """История веса для графиков: последнее значение за день.
+
+    Вес хранится только в анкете здоровья, поэтому каждое сохранение
+    анкеты с новым весом записывается триггером в weight_log.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weight_log (
+            user_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO weight_log (user_id, date, weight)
+        SELECT user_id, COALESCE(date(updated_at), date('now')), weight
+        FROM health_questionnaire
+        WHERE weight IS NOT NULL
+    ''')
+
+    log_weight = '''
+        INSERT INTO weight_log (user_id, date, weight)
+        SELECT new.user_id, COALESCE(date(new.updated_at), date('now')), new.weight
+        WHERE new.weight IS NOT NULL
+        ON CONFLICT(user_id, date) DO UPDATE SET weight = excluded.weight;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS health_questionnaire_weight_ai '
+                   f'AFTER INSERT ON health_questionnaire BEGIN {log_weight} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS health_questionnaire_weight_au '
+                   f'AFTER UPDATE OF weight, updated_at ON health_questionnaire BEGIN {log_weight} END')
+
+
+def _create_write_dead_letters(cursor):
+    """Строки пакетной записи, которые не удалось записать или обработать слушателем"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS write_dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            rows TEXT NOT NULL,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _unique_user_challenges(cursor):
+    # Завершённый челлендж можно было пройти заново и снова получить награду.
+    # Оставляем одно участие: завершённое, если есть, иначе самое раннее;
+    # остальные переносим в архив окон
+    keep = '''
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id, challenge_id ORDER BY COALESCE(is_completed, 0) DESC, id
+            ) AS position
+            FROM user_challenges
+        ) WHERE position = 1
+    '''
+    cursor.execute(f'''
+        INSERT INTO user_challenges_archive
+        (user_challenge_id, user_id, challenge_id, current_progress, is_completed, completed_at, joined_at)
+        SELECT id, user_id, challenge_id, current_progress, is_completed, completed_at, joined_at
+        FROM user_challenges WHERE id NOT IN ({keep})
+    ''')
+    cursor.execute(f'DELETE FROM user_challenges WHERE id NOT IN ({keep})')
+    cursor.execute('DROP INDEX IF EXISTS idx_user_challenges_user_challenge')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_challenges_user_challenge
+        ON user_challenges(user_id, challenge_id)
+    ''')
+
+
+def _meals_into_daily_nutrition(cursor):
+    """Приёмы пищи за день считаются только в daily_nutrition.
+
+    user_daily_metrics дублировала итоги питания, которые daily_nutrition
+    уже ведёт с миграции 6, и каждый приём пищи обновлял обе таблицы.
+    В daily_nutrition добавляется число приёмов пищи, а из
+    user_daily_metrics убираются колонки и триггеры питания.
+    """
+    cursor.execute('ALTER TABLE daily_nutrition ADD COLUMN meals INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE daily_nutrition SET meals = (
+            SELECT COUNT(*) FROM meals m
+            WHERE m.user_id = daily_nutrition.user_id AND m.date = daily_nutrition.date
+        )
+    ''')
+
+    add_meal = '''
+        INSERT INTO daily_nutrition (user_id, date, meals, total_calories, total_protein, total_carbs, total_fat)
+        VALUES (new.user_id, new.date, 1, COALESCE(new.total_calories, 0), COALESCE(new.total_protein, 0),
+                COALESCE(new.total_carbs, 0), COALESCE(new.total_fat, 0))
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            meals = meals + 1,
+            total_calories = total_calories + excluded.total_calories,
+            total_protein = total_protein + excluded.total_protein,
+            total_carbs = total_carbs + excluded.total_carbs,
+            total_fat = total_fat + excluded.total_fat;
+    '''
+    remove_meal = '''
+        UPDATE daily_nutrition SET
+            meals = meals - 1,
+            total_calories = total_calories - COALESCE(old.total_calories, 0),
+            total_protein = total_protein - COALESCE(old.total_protein, 0),
+            total_carbs = total_carbs - COALESCE(old.total_carbs, 0),
+            total_fat = total_fat - COALESCE(old.total_fat, 0)
+        WHERE user_id = old.user_id AND date = old.date;
+    '''
+    for trigger in ('meals_rollup_ai', 'meals_rollup_ad', 'meals_rollup_au',
+                    'meals_metrics_ai', 'meals_metrics_ad', 'meals_metrics_au'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cursor.execute(f'CREATE TRIGGER meals_rollup_ai AFTER INSERT ON meals BEGIN {add_meal} END')
+    cursor.execute(f'CREATE TRIGGER meals_rollup_ad AFTER DELETE ON meals BEGIN {remove_meal} END')
+    cursor.execute('''
+        CREATE TRIGGER meals_rollup_au
+        AFTER UPDATE OF user_id, date, total_calories, total_protein, total_carbs, total_fat ON meals
+        BEGIN ''' + remove_meal + add_meal + ''' END
+    ''')
+
+    for column in ('meals', 'calories_consumed', 'protein', 'carbs', 'fat'):
+        cursor.execute(f'ALTER TABLE user_daily_metrics DROP COLUMN {column}')
+
+
+def _track_exercise_catalog_version(cursor):
+    """Версия каталога упражнений в app_meta.
+
+    Каталог с индексами кэшируется в памяти каждого процесса; любая
+    запись в exercises увеличивает версию, и процессы, сверяющие её при
+    чтении, перестраивают каталог, даже если запись сделал другой процесс.
+    """
+    bump = '''
+        INSERT INTO app_meta (key, value) VALUES ('exercise_catalog_version', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1;
+    '''
+    cursor.execute(bump)
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS exercises_version_ai AFTER INSERT ON exercises BEGIN {bump} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS exercises_version_ad AFTER DELETE ON exercises BEGIN {bump} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS exercises_version_au AFTER UPDATE ON exercises BEGIN {bump} END')
+
+
+# Упорядоченный список миграций: (версия, описание, функция(cursor)).
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'каноническая схема', _create_canonical_schema),
+    (2, 'индексы для выборок по пользователю', _create_lookup_indexes),
+    (3, 'служебная таблица app_meta', _create_app_meta),
+    (4, 'уникальные имена в справочниках', _deduplicate_catalogs),
+    (5, 'полнотекстовый поиск по упражнениям и продуктам', _create_search_indexes),
+    (6, 'дневные итоги питания', _create_daily_nutrition_rollup),
+    (7, 'версия анкеты здоровья', _add_questionnaire_version),
+    (8, 'уникальные рекомендации по здоровью', _unique_health_recommendations),
+    (9, 'уникальные достижения пользователей', _unique_user_achievements),
+    (10, 'снимки рейтингов', _create_leaderboard_snapshots),
+    (11, 'архив окон челленджей', _create_challenge_rollover_tables),
+    (12, 'дневные показатели пользователей', _create_daily_metrics_rollup),
+    (13, 'история веса', _create_weight_log),
+    (14, 'необработанные строки пакетной записи', _create_write_dead_letters),
+    (15, 'одно участие в челлендже', _unique_user_challenges),
+    (16, 'приёмы пищи только в daily_nutrition', _meals_into_daily_nutrition),
+    (17, 'версия каталога упражнений', _track_exercise_catalog_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(pool):
+    return pool.fetchone('PRAGMA user_version')[0]
+
+
+def migrate(pool):
+    """Применение недостающих миграций, возвращает итоговую версию схемы"""
+    version = current_version(pool)
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        with pool.transaction() as cursor:
+            # Версию перечитываем под блокировкой: другой процесс мог успеть раньше
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= target:
+                continue
+            apply(cursor)
+            cursor.execute(f'PRAGMA user_version = {target}')
+        logger.info('Миграция схемы %s применена: %s', target, description)
+        version = target
+    return version
+
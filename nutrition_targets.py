@@ -0,0 +1,186 @@
+# nutrition_targets.py
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Учет уровня активности
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'active': 1.725,
+    'very_active': 1.9
+}
+DEFAULT_ACTIVITY = 'moderate'
+
+
+def goal_adjustment(goals):
+    """Поправка калорийности по целям: дефицит для похудения, профицит для набора"""
+    if 'weight_loss' in goals:
+        return -500
+    if 'weight_gain' in goals:
+        return 500
+    return 0
+
+
+def calculate_targets(health_data):
+    """Расчет дневной нормы калорий и БЖУ по анкете"""
+    # Формула Миффлина-Сан Жеора
+    if health_data['gender'] == 'male':
+        bmr = 10 * health_data['weight'] + 6.25 * health_data['height'] - 5 * health_data['age'] + 5
+    else:
+        bmr = 10 * health_data['weight'] + 6.25 * health_data['height'] - 5 * health_data['age'] - 161
+
+    activity_level = health_data.get('activity_level', DEFAULT_ACTIVITY)
+    tdee = bmr * ACTIVITY_MULTIPLIERS.get(activity_level, 1.55)
+
+    # Корректировка по целям
+    tdee += goal_adjustment(health_data.get('goals', []))
+
+    return {
+        'calories': round(tdee),
+        'protein': round(tdee * 0.3 / 4),  # 30% от калорий
+        'carbs': round(tdee * 0.4 / 4),    # 40% от калорий
+        'fat': round(tdee * 0.3 / 9)       # 30% от калорий
+    }
+
+
+def calculate_targets_batch(age, weight, height, is_male, adjustment, activity=None):
+    """Векторный расчёт целей для многих пользователей сразу.
+
+    Все аргументы - массивы одной длины; activity - множители активности
+    (по умолчанию умеренная). Результат совпадает с calculate_targets.
+    """
+    age = np.asarray(age, dtype=float)
+    weight = np.asarray(weight, dtype=float)
+    height = np.asarray(height, dtype=float)
+    if activity is None:
+        activity = np.full(age.shape, ACTIVITY_MULTIPLIERS[DEFAULT_ACTIVITY])
+
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(is_male, 5, -161)
+    tdee = bmr * np.asarray(activity, dtype=float) + np.asarray(adjustment, dtype=float)
+
+    # np.round, как и round(), округляет половины к чётному
+    return {
+        'calories': np.round(tdee).astype(int),
+        'protein': np.round(tdee * 0.3 / 4).astype(int),
+        'carbs': np.round(tdee * 0.4 / 4).astype(int),
+        'fat': np.round(tdee * 0.3 / 9).astype(int),
+    }
+
+
+def _health_data(row):
+    age, weight, height, gender, goals = row
+    return {
+        'age': age,
+        'weight': weight,
+        'height': height,
+        'gender': gender,
+        'goals': json.loads(goals) if goals else [],
+    }
+
+
+class NutritionTargetsCache:
+    """Кэш рассчитанных целей по питанию: user_id -> цели.
+
+    Цели зависят только от анкеты здоровья, поэтому считаются один раз и
+    сбрасываются, когда HealthManager сохраняет новую версию анкеты.
+    """
+
+    def __init__(self, pool, maxsize=10000):
+        self.pool = pool
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Цели пользователя или None, если анкета не заполнена"""
+        with self._lock:
+            targets = self._entries.get(user_id)
+            if targets is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return targets
+            self.misses += 1
+            generation = self._generation
+
+        row = self.pool.fetchone('''
+            SELECT age, weight, height, gender, goals
+            FROM health_questionnaire WHERE user_id = ?
+        ''', (user_id,))
+        if not row or None in row[:4]:
+            return None
+
+        targets = calculate_targets(_health_data(row))
+        self._store(user_id, targets, generation)
+        return targets
+
+    def _store(self, user_id, targets, generation):
+        with self._lock:
+            # Анкета могла измениться, пока мы считали
+            if generation != self._generation:
+                return
+            self._entries[user_id] = targets
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def compute_all(self, user_ids=None, warm_cache=False):
+        """Пакетный расчёт целей для всех (или указанных) пользователей
+        одним векторным проходом, например для ночных отчётов"""
+        query = '''
+            SELECT user_id, age, weight, height, gender, goals
+            FROM health_questionnaire
+            WHERE age IS NOT NULL AND weight IS NOT NULL AND height IS NOT NULL AND gender IS NOT NULL
+        '''
+        params = []
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            if not user_ids:
+                return {}
+            query += f" AND user_id IN ({', '.join('?' * len(user_ids))})"
+            params = user_ids
+
+        with self._lock:
+            generation = self._generation
+        rows = self.pool.fetchall(query, params)
+        if not rows:
+            return {}
+
+        ids, ages, weights, heights, genders, goals = zip(*rows)
+        targets = calculate_targets_batch(
+            ages, weights, heights,
+            np.array([gender == 'male' for gender in genders]),
+            [goal_adjustment(json.loads(g) if g else []) for g in goals],
+        )
+
+        result = {}
+        for i, user_id in enumerate(ids):
+            result[user_id] = {key: int(values[i]) for key, values in targets.items()}
+            if warm_cache:
+                self._store(user_id, result[user_id], generation)
+        return result
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_targets_cache(pool):
+    """Общий кэш целей для файла базы (один на процесс)"""
+    with _caches_lock:
+        cache = _caches.get(pool.db_path)
+        if cache is None:
+            cache = NutritionTargetsCache(pool)
+            _caches[pool.db_path] = cache
+        return cache
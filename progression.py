@@ -0,0 +1,234 @@
+# progression.py
+import argparse
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+MAX_LEVEL = 100
+# Опыт, с которого начинается уровень: 0, 100, 300, 600, 1000, ...
+LEVEL_THRESHOLDS = [50 * level * (level - 1) for level in range(1, MAX_LEVEL + 1)]
+
+# Опыт за тренировку: база плюс 1 XP за каждые 4 минуты (до 2 часов)
+WORKOUT_BASE_XP = 20
+MAX_COUNTED_MINUTES = 120
+
+# Сколько user_id подставлять в один запрос IN (...)
+IN_CHUNK = 500
+
+# Состояние прогресса пользователя (строка user_levels)
+Progress = namedtuple('Progress', 'total_xp current_level workouts_completed streak_days last_workout_date')
+EMPTY_PROGRESS = Progress(0, 1, 0, 0, None)
+
+UPSERT_LEVEL = '''
+    INSERT INTO user_levels (user_id, total_xp, current_level, workouts_completed, streak_days, last_workout_date, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        total_xp = excluded.total_xp,
+        current_level = excluded.current_level,
+        workouts_completed = excluded.workouts_completed,
+        streak_days = excluded.streak_days,
+        last_workout_date = excluded.last_workout_date,
+        updated_at = excluded.updated_at
+'''
+
+
+def level_for_xp(total_xp):
+    """Уровень по опыту - двоичный поиск по таблице порогов"""
+    return bisect.bisect_right(LEVEL_THRESHOLDS, total_xp or 0)
+
+
+def level_bounds(level):
+    """(опыт начала уровня, опыт следующего уровня или None на максимальном)"""
+    upper = LEVEL_THRESHOLDS[level] if level < MAX_LEVEL else None
+    return LEVEL_THRESHOLDS[level - 1], upper
+
+
+def xp_for_workout(duration):
+    return WORKOUT_BASE_XP + min(max(duration or 0, 0), MAX_COUNTED_MINUTES) // 4
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def advance(progress, workout_date, duration):
+    """Новое состояние после одной тренировки - O(1), без чтения истории"""
+    workout_date = _as_date(workout_date) or date.today()
+    last = progress.last_workout_date
+    streak = progress.streak_days
+
+    if last is None or workout_date > last:
+        gap = None if last is None else (workout_date - last).days
+        # Следующий день продолжает серию, пропуск начинает новую
+        streak = streak + 1 if gap == 1 else 1
+        last = workout_date
+    # Тренировка в тот же день или задним числом серию не меняет
+
+    total_xp = progress.total_xp + xp_for_workout(duration)
+    return Progress(total_xp, level_for_xp(total_xp), progress.workouts_completed + 1, streak, last)
+
+
+def add_xp(progress, xp):
+    total_xp = progress.total_xp + xp
+    return progress._replace(total_xp=total_xp, current_level=level_for_xp(total_xp))
+
+
+def current_streak(progress, today=None):
+    """Серия на сегодня: если вчера и сегодня тренировок не было, она прервана"""
+    today = today or date.today()
+    last = progress.last_workout_date
+    if last is None or (today - last).days > 1:
+        return 0
+    return progress.streak_days
+
+
+def _row(user_id, progress):
+    last = progress.last_workout_date
+    return (user_id, progress.total_xp, progress.current_level, progress.workouts_completed,
+            progress.streak_days, last.isoformat() if last else None)
+
+
+class ProgressionEngine:
+    """Опыт, уровни и серии тренировок в user_levels.
+
+    Каждая тренировка обновляет строку пользователя за O(1): серия
+    сравнением дат, уровень по таблице порогов. rebuild() заново
+    проигрывает всю историю тренировок за один проход.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def load(self, cursor, user_ids):
+        """Текущее состояние пользователей {user_id: Progress}"""
+        user_ids = list(user_ids)
+        states = {}
+        for start in range(0, len(user_ids), IN_CHUNK):
+            chunk = user_ids[start:start + IN_CHUNK]
+            cursor.execute(f'''
+                SELECT user_id, total_xp, current_level, workouts_completed, streak_days, last_workout_date
+                FROM user_levels WHERE user_id IN ({', '.join('?' * len(chunk))})
+            ''', chunk)
+            for row in cursor.fetchall():
+                states[row[0]] = Progress(row[1] or 0, row[2] or 1, row[3] or 0, row[4] or 0, _as_date(row[5]))
+        return states
+
+    def get(self, user_id):
+        with self.pool.connection() as conn:
+            return self.load(conn.cursor(), [user_id]).get(user_id, EMPTY_PROGRESS)
+
+    def apply_workouts(self, cursor, workouts):
+        """Учёт пакета тренировок в открытой транзакции.
+
+        workouts - строки (user_id, workout_name, duration, calories_burned, date),
+        как их пишет WriteBatcher.
+        """
+        by_user = {}
+        for user_id, _, duration, _, workout_date in workouts:
+            by_user.setdefault(user_id, []).append((_as_date(workout_date) or date.today(), duration))
+
+        states = self.load(cursor, by_user)
+        rows = []
+        for user_id, items in by_user.items():
+            progress = states.get(user_id, EMPTY_PROGRESS)
+            for workout_date, duration in sorted(items, key=lambda item: item[0]):
+                progress = advance(progress, workout_date, duration)
+            rows.append(_row(user_id, progress))
+        cursor.executemany(UPSERT_LEVEL, rows)
+
+    def award_xp(self, cursor, awards):
+        """Начисление опыта (за достижения, челленджи): [(user_id, xp)]"""
+        totals = {}
+        for user_id, xp in awards:
+            totals[user_id] = totals.get(user_id, 0) + (xp or 0)
+
+        states = self.load(cursor, totals)
+        rows = [_row(user_id, add_xp(states.get(user_id, EMPTY_PROGRESS), xp)) for user_id, xp in totals.items()]
+        cursor.executemany(UPSERT_LEVEL, rows)
+
+    def rebuild(self, batch_size=5000):
+        """Пересчёт user_levels по всей истории тренировок за один проход"""
+        started = time.perf_counter()
+        with self.pool.transaction() as cursor:
+            # Опыт за достижения и челленджи не зависит от тренировок - добавляем его сверху
+            cursor.execute('''
+                SELECT user_id, SUM(xp) FROM (
+                    SELECT user_id, earned_xp AS xp FROM user_achievements
+                    UNION ALL
+                    SELECT uc.user_id, c.reward_xp FROM user_challenges uc
+                    JOIN challenges c ON c.id = uc.challenge_id
+                    WHERE uc.is_completed
+                    UNION ALL
+                    SELECT a.user_id, c.reward_xp FROM user_challenges_archive a
+                    JOIN challenges c ON c.id = a.challenge_id
+                    WHERE a.is_completed
+                )
+                GROUP BY user_id
+            ''')
+            bonus = dict(cursor.fetchall())
+
+            rows = []
+            user_id, progress, workouts = None, EMPTY_PROGRESS, 0
+            # Порядок (user_id, date) совпадает с индексом idx_workouts_user_date
+            cursor.execute('SELECT user_id, date, duration FROM workouts ORDER BY user_id, date, id')
+            while True:
+                chunk = cursor.fetchmany(batch_size)
+                if not chunk:
+                    break
+                for row_user, workout_date, duration in chunk:
+                    if row_user != user_id:
+                        if user_id is not None:
+                            rows.append(_row(user_id, add_xp(progress, bonus.pop(user_id, 0) or 0)))
+                        user_id, progress = row_user, EMPTY_PROGRESS
+                    progress = advance(progress, workout_date, duration)
+                    workouts += 1
+            if user_id is not None:
+                rows.append(_row(user_id, add_xp(progress, bonus.pop(user_id, 0) or 0)))
+            # Пользователи с достижениями, но без тренировок
+            rows.extend(_row(other, add_xp(EMPTY_PROGRESS, xp or 0)) for other, xp in bonus.items())
+
+            cursor.execute('DELETE FROM user_levels')
+            cursor.executemany(UPSERT_LEVEL, rows)
+            # Снимок рейтингов построен по старому опыту - пересоберётся при запуске
+            cursor.execute('DELETE FROM leaderboard_entries')
+
+        seconds = time.perf_counter() - started
+        logger.info('Прогресс пересчитан: %d пользователей, %d тренировок за %.2f с',
+                    len(rows), workouts, seconds)
+        return {'users': len(rows), 'workouts': workouts, 'seconds': seconds}
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_progression(pool):
+    """Общий движок прогресса для файла базы (один на процесс)"""
+    with _engines_lock:
+        engine = _engines.get(pool.db_path)
+        if engine is None:
+            engine = ProgressionEngine(pool)
+            _engines[pool.db_path] = engine
+        return engine
+
+
+if __name__ == '__main__':
+    from db_pool import get_pool
+    from bootstrap import bootstrap
+
+    parser = argparse.ArgumentParser(description='Пересчёт опыта, уровней и серий по истории тренировок')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--db', default='fitness_bot.db')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = get_pool(args.db)
+    bootstrap(pool)
+    print(get_progression(pool).rebuild())
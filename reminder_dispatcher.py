@@ -0,0 +1,325 @@
+# reminder_dispatcher.py
+import asyncio
+import functools
+import heapq
+import json
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, time as dtime
+
+from telegram.error import Forbidden
+
+logger = logging.getLogger(__name__)
+
+# Таблицы напоминаний: (таблица, колонки, которые можно задавать)
+REMINDER_TABLES = {
+    'health': ('health_reminders', ('user_id', 'reminder_type', 'message', 'scheduled_time', 'is_active', 'days_of_week')),
+    'meal': ('meal_reminders', ('user_id', 'meal_type', 'scheduled_time', 'is_active', 'message')),
+}
+MEAL_NAMES = {'breakfast': 'завтрака', 'lunch': 'обеда', 'dinner': 'ужина', 'snack': 'перекуса'}
+
+# Напоминания, сработавшие с опозданием меньше этого, ещё отправляются, секунд
+FIRE_TOLERANCE = 0.5
+
+# Активное напоминание в памяти; version отличает актуальную запись кучи от устаревших
+Reminder = namedtuple('Reminder', 'kind id user_id scheduled_time days text version')
+
+
+def parse_time(value):
+    """'ЧЧ:ММ' или 'ЧЧ:ММ:СС' -> datetime.time"""
+    parts = [int(part) for part in str(value).strip().split(':')]
+    if len(parts) not in (2, 3):
+        raise ValueError(f'Неверное время напоминания: {value!r}')
+    return dtime(*parts)
+
+
+def parse_days(value):
+    """Дни недели (1 - понедельник ... 7 - воскресенье) из JSON-списка или
+    строки '1,3,5'; пусто - каждый день"""
+    if value is None or value == '':
+        return frozenset()
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = [part for part in value.replace(' ', '').split(',') if part]
+    if isinstance(value, int):
+        value = [value]
+    days = frozenset(int(day) for day in value)
+    if not days <= set(range(1, 8)):
+        raise ValueError(f'Неверные дни недели напоминания: {value!r}')
+    return days
+
+
+def next_fire(scheduled_time, days, after):
+    """Ближайший момент срабатывания строго после after (локальное время)"""
+    for offset in range(8):
+        day = after.date() + timedelta(days=offset)
+        if days and day.isoweekday() not in days:
+            continue
+        candidate = datetime.combine(day, scheduled_time)
+        if candidate > after:
+            return candidate
+    return None
+
+
+def reminder_text(kind, row):
+    if kind == 'meal':
+        return row['message'] or f"🍽 Время {MEAL_NAMES.get(row['meal_type'], 'приёма пищи')}!"
+    return f"⏰ {row['message'] or 'Напоминание о здоровье'}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _days_from_text(value):
+    # Наборы дней повторяются у множества напоминаний - разбираем каждый один раз
+    return parse_days(value)
+
+
+def build_reminder(kind, row, version):
+    """Reminder из строки таблицы или None, если оно выключено или расписание неверно"""
+    if not row.get('is_active', True):
+        return None
+    days = row.get('days_of_week')
+    try:
+        scheduled_time = parse_time(row['scheduled_time'])
+        days = _days_from_text(days) if days is None or isinstance(days, str) else parse_days(days)
+    except (TypeError, ValueError):
+        logger.warning('Напоминание %s #%s пропущено: неверное расписание', kind, row['id'])
+        return None
+    return Reminder(kind, row['id'], row['user_id'], scheduled_time, days, reminder_text(kind, row), version)
+
+
+class ReminderDispatcher:
+    """Отправка напоминаний из health_reminders и meal_reminders.
+
+    Активные напоминания один раз читаются при запуске и лежат в куче по
+    времени следующего срабатывания. В JobQueue всегда стоит одна задача -
+    на ближайшее срабатывание; отправив напоминания, она переставляет их
+    на следующий раз и заводит себя заново. Добавление и изменение
+    напоминаний через диспетчер меняют одну запись в памяти, поэтому
+    таблицы никогда не опрашиваются целиком по расписанию.
+
+    owns(user_id) - отбор пользователей процесса, когда бот работает в
+    нескольких процессах: каждый отправляет напоминания только своим.
+    """
+
+    def __init__(self, adb, owns=None):
+        self.adb = adb
+        self.owns = owns
+        self.job_queue = None
+        self._heap = []
+        self._reminders = {}
+        # user_id -> ключи его напоминаний, чтобы не перебирать все
+        self._by_user = {}
+        self._version = 0
+        # Ключи, изменённые до окончания загрузки (None - загрузка завершена)
+        self._changed = set()
+        self._job = None
+        self._job_at = None
+        self.fired = 0
+        self.errors = 0
+        self.last_load_ms = 0.0
+
+    def schedule(self, job_queue):
+        """Загрузка напоминаний вскоре после запуска бота"""
+        self.job_queue = job_queue
+        job_queue.run_once(self.start, when=0, name='reminders-load')
+
+    async def start(self, context=None):
+        started = time.perf_counter()
+        # Разбор расписаний и сборка кучи - в потоке чтения, не в event loop
+        loaded, heap = await self.adb.read(self._load_active)
+        for key, reminder in loaded.items():
+            # Напоминания, изменённые во время загрузки, уже актуальны в памяти
+            if key not in self._changed:
+                self._reminders[key] = reminder
+                self._by_user.setdefault(reminder.user_id, set()).add(key)
+        self._heap.extend(heap)
+        heapq.heapify(self._heap)
+        self._changed = None
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+        logger.info('Напоминания загружены: %d за %.1f мс', len(self._reminders), self.last_load_ms)
+        self._arm()
+
+    def _load_active(self):
+        now = datetime.now()
+        reminders, heap = {}, []
+        with self.adb.pool.connection() as conn:
+            for kind, (table, columns) in REMINDER_TABLES.items():
+                names = ('id',) + columns
+                for row in conn.execute(f'SELECT {", ".join(names)} FROM {table} WHERE is_active'):
+                    reminder = build_reminder(kind, dict(zip(names, row)), version=0)
+                    if reminder is None or (self.owns is not None and not self.owns(reminder.user_id)):
+                        continue
+                    reminders[(kind, reminder.id)] = reminder
+                    fire_at = next_fire(reminder.scheduled_time, reminder.days, now)
+                    if fire_at is not None:
+                        heap.append((fire_at.timestamp(), 0, kind, reminder.id))
+        heapq.heapify(heap)
+        return reminders, heap
+
+    def _load_one(self, kind, reminder_id):
+        table, columns = REMINDER_TABLES[kind]
+        row = self.adb.pool.fetchone(f'SELECT id, {", ".join(columns)} FROM {table} WHERE id = ?', (reminder_id,))
+        return dict(zip(('id',) + columns, row)) if row else None
+
+    # --- Куча ---
+
+    def _drop(self, key):
+        if self._changed is not None:
+            self._changed.add(key)
+        reminder = self._reminders.pop(key, None)
+        if reminder is not None:
+            keys = self._by_user.get(reminder.user_id)
+            keys.discard(key)
+            if not keys:
+                del self._by_user[reminder.user_id]
+
+    def _put(self, kind, row):
+        """Добавление или замена напоминания; неактивное просто снимается"""
+        key = (kind, row['id'])
+        self._drop(key)
+        self._version += 1
+        reminder = build_reminder(kind, row, self._version)
+        if reminder is None:
+            return
+        self._reminders[key] = reminder
+        self._by_user.setdefault(reminder.user_id, set()).add(key)
+        self._push(reminder, datetime.now())
+
+    def _push(self, reminder, after):
+        fire_at = next_fire(reminder.scheduled_time, reminder.days, after)
+        if fire_at is not None:
+            # Устаревшие записи кучи не удаляются сразу, а пропускаются при извлечении
+            heapq.heappush(self._heap, (fire_at.timestamp(), reminder.version, reminder.kind, reminder.id))
+
+    def _arm(self):
+        """Задача JobQueue на ближайшее срабатывание (одна на все напоминания)"""
+        if len(self._heap) > 2 * len(self._reminders) + 1000:
+            # Устаревших записей накопилось больше актуальных - пересобираем кучу
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap or self.job_queue is None:
+            return
+        fire_at = self._heap[0][0]
+        if self._job is not None:
+            if self._job_at <= fire_at:
+                return
+            self._job.schedule_removal()
+        # Задержка в секундах: не зависит от часового пояса планировщика
+        self._job = self.job_queue.run_once(self._fire, when=max(0.0, fire_at - time.time()), name='reminders')
+        self._job_at = fire_at
+
+    def _is_current(self, entry):
+        reminder = self._reminders.get((entry[2], entry[3]))
+        return reminder is not None and reminder.version == entry[1]
+
+    async def _fire(self, context):
+        self._job = self._job_at = None
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now + FIRE_TOLERANCE:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                reminder = self._reminders[(entry[2], entry[3])]
+                due.append(reminder)
+                # Следующее срабатывание - строго после этого, даже если отправка задержится
+                self._push(reminder, datetime.fromtimestamp(max(entry[0], now)))
+        self._arm()
+
+        # Отправки идут параллельно: темп задаёт очередь отправки бота
+        await asyncio.gather(*(self._send(context.bot, reminder) for reminder in due))
+
+    async def _send(self, bot, reminder):
+        try:
+            # Рассылка напоминаний уступает очередь ответам пользователям
+            await bot.send_message(chat_id=reminder.user_id, text=reminder.text,
+                                   rate_limit_args={'priority': 'bulk'})
+            self.fired += 1
+        except Forbidden:
+            # Пользователь заблокировал бота - напоминание больше не нужно
+            await self.update(reminder.kind, reminder.id, is_active=False)
+        except Exception:
+            self.errors += 1
+            logger.exception('Не удалось отправить напоминание %s #%s', reminder.kind, reminder.id)
+
+    # --- Изменение напоминаний ---
+
+    def _write(self, kind, reminder_id, fields):
+        table, columns = REMINDER_TABLES[kind]
+        unknown = set(fields) - set(columns)
+        if unknown:
+            raise ValueError(f'Неизвестные поля напоминания: {", ".join(sorted(unknown))}')
+        names = list(fields)
+        values = [fields[name] for name in names]
+        with self.adb.pool.transaction() as cursor:
+            if reminder_id is None:
+                cursor.execute(f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                               values)
+                reminder_id = cursor.lastrowid
+            elif names:
+                cursor.execute(f'UPDATE {table} SET {", ".join(f"{name} = ?" for name in names)} WHERE id = ?',
+                               values + [reminder_id])
+        return self._load_one(kind, reminder_id)
+
+    def _check(self, fields):
+        # Расписание проверяется до записи, чтобы в базу не попало неверное
+        if 'scheduled_time' in fields:
+            parse_time(fields['scheduled_time'])
+        if 'days_of_week' in fields:
+            days = fields['days_of_week']
+            parse_days(days)
+            if isinstance(days, (list, tuple, set, frozenset)):
+                fields['days_of_week'] = json.dumps(sorted(days))
+        return fields
+
+    async def add(self, kind, user_id, scheduled_time, **fields):
+        """Новое напоминание ('health' или 'meal'), возвращает его id"""
+        fields = self._check(dict(fields, user_id=user_id, scheduled_time=scheduled_time))
+        row = await self.adb.write(self._write, kind, None, fields)
+        self._put(kind, row)
+        self._arm()
+        return row['id']
+
+    async def update(self, kind, reminder_id, **fields):
+        """Изменение полей напоминания (в том числе is_active) с перестановкой в куче"""
+        row = await self.adb.write(self._write, kind, reminder_id, self._check(fields))
+        if row is None:
+            self._drop((kind, reminder_id))
+        else:
+            self._put(kind, row)
+        self._arm()
+        return row is not None
+
+    async def remove(self, kind, reminder_id):
+        table, _ = REMINDER_TABLES[kind]
+        await self.adb.execute(f'DELETE FROM {table} WHERE id = ?', (reminder_id,))
+        self._drop((kind, reminder_id))
+
+    async def reload(self, kind, reminder_id):
+        """Перечитать одно напоминание, изменённое в базе в обход диспетчера"""
+        row = await self.adb.read(self._load_one, kind, reminder_id)
+        if row is None:
+            self._drop((kind, reminder_id))
+        else:
+            self._put(kind, row)
+        self._arm()
+
+    def user_reminders(self, user_id):
+        """Активные напоминания пользователя с ближайшим временем срабатывания"""
+        now = datetime.now()
+        reminders = [self._reminders[key] for key in self._by_user.get(user_id, ())]
+        return sorted(((next_fire(r.scheduled_time, r.days, now), r) for r in reminders),
+                      key=lambda item: item[0] or datetime.max)
+
+    def stats(self):
+        return {
+            'active': len(self._reminders),
+            'heap': len(self._heap),
+            'fired': self.fired,
+            'errors': self.errors,
+            'last_load_ms': round(self.last_load_ms, 2),
+        }
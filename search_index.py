@@ -0,0 +1,206 @@
+# search_index.py
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Минимальная похожесть для нечёткого совпадения (0..1)
+FUZZY_THRESHOLD = 0.55
+
+# Сколько совпадений ранжировать через bm25. Короткий префикс вроде "гр"
+# может совпасть с тысячами строк, и bm25 по всем стоит миллисекунды -
+# такие запросы ранжируем по названию в пределах окна
+RANK_WINDOW = 64
+
+# Словарь слов каталога для исправления опечаток перечитывается не чаще
+# раза в VOCABULARY_TTL секунд; до этого новые слова находит поиск по триграммам
+VOCABULARY_TTL = 300
+# Сколько слов словаря с наибольшим числом общих триграмм сравнивать
+# с опечаткой через SequenceMatcher
+FUZZY_CANDIDATES = 16
+
+
+def query_words(text):
+    """Слова запроса без однобуквенных предлогов ("с", "в", "и"):
+    префикс из одной буквы совпадает почти со всем каталогом"""
+    words = WORD_RE.findall(text.lower())
+    return [word for word in words if len(word) > 1] or words
+
+
+def build_prefix_query(words):
+    """['жим', 'лёжа'] -> '"жим"* "лёжа"*' (все слова, каждое как префикс)"""
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def build_trigram_query(text):
+    """Запрос по триграммам для поиска с опечатками: совпадает любая триграмма"""
+    grams = []
+    for word in WORD_RE.findall(text.lower()):
+        grams.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return ' OR '.join(f'"{gram}"' for gram in dict.fromkeys(grams))
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class Vocabulary:
+    """Слова названий каталога с индексом по триграммам.
+
+    Опечатка сравнивается не с тысячами названий, а с несколькими
+    словами словаря, у которых больше всего общих с ней триграмм.
+    """
+
+    def __init__(self, names):
+        self.words = sorted({word for name in names for word in WORD_RE.findall((name or '').lower())
+                             if len(word) >= 3 and not word.isdigit()})
+        self._known = set(self.words)
+        self._by_gram = {}
+        for index, word in enumerate(self.words):
+            for gram in trigrams(word):
+                self._by_gram.setdefault(gram, []).append(index)
+
+    def correct(self, word):
+        """Ближайшее слово словаря или None, если похожих нет"""
+        if word in self._known or len(word) < 3:
+            return word
+        shared = {}
+        for gram in trigrams(word):
+            for index in self._by_gram.get(gram, ()):
+                shared[index] = shared.get(index, 0) + 1
+        candidates = sorted(shared, key=shared.get, reverse=True)[:FUZZY_CANDIDATES]
+
+        best, best_ratio = None, FUZZY_THRESHOLD
+        for index in candidates:
+            ratio = SequenceMatcher(None, word, self.words[index]).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = self.words[index], ratio
+        return best
+
+
+class CatalogSearch:
+    """Полнотекстовый поиск по упражнениям и продуктам (FTS5).
+
+    Сначала ищем по словам с префиксным совпадением и ранжированием bm25.
+    Если ничего не нашлось, исправляем слова запроса по словарю каталога
+    и повторяем поиск; только если и это не помогло - ищем по триграммам
+    названий, отсеивая кандидатов по похожести строк.
+    """
+
+    def __init__(self, pool, clock=time.monotonic):
+        self.pool = pool
+        self.clock = clock
+        self._vocabularies = {}
+        self._vocabulary_lock = threading.Lock()
+
+    def _search(self, fts_table, trigram_table, text, limit, weights):
+        words = query_words(text)
+        if not words:
+            return []
+
+        rows = self._prefix_search(fts_table, build_prefix_query(words), text, limit, weights)
+        if rows:
+            return rows
+
+        # Опечатка чаще всего в окончании слова: пробуем укороченный префикс
+        # последнего слова, прежде чем идти в дорогой поиск по триграммам
+        last = words[-1]
+        for cut in (1, 2):
+            if len(last) - cut < 3:
+                break
+            rows = self._prefix_search(fts_table, build_prefix_query(words[:-1] + [last[:-cut]]),
+                                       text, limit, weights)
+            if rows:
+                return rows
+
+        vocabulary = self._vocabulary(trigram_table)
+        corrected = [vocabulary.correct(word) for word in words]
+        if None not in corrected and corrected != words:
+            rows = self._prefix_search(fts_table, build_prefix_query(corrected), text, limit, weights)
+            if rows:
+                return rows
+
+        return self._fuzzy(trigram_table, text, limit)
+
+    def _vocabulary(self, trigram_table):
+        with self._vocabulary_lock:
+            cached = self._vocabularies.get(trigram_table)
+            if cached is None or cached[1] <= self.clock():
+                # Названия читаются из исходной таблицы внешнего содержимого FTS
+                names = [name for name, in self.pool.fetchall(f'SELECT name FROM {trigram_table}')]
+                cached = (Vocabulary(names), self.clock() + VOCABULARY_TTL)
+                self._vocabularies[trigram_table] = cached
+            return cached[0]
+
+    def _prefix_search(self, fts_table, match, text, limit, weights):
+        with self.pool.connection() as conn:
+            # Дешёвая проба только по индексу (без чтения названий):
+            # сколько вообще совпадений
+            matched = len(conn.execute(f'''
+                SELECT rowid FROM {fts_table}
+                WHERE {fts_table} MATCH ?
+                LIMIT ?
+            ''', (match, RANK_WINDOW + 1)).fetchall())
+
+            if matched <= RANK_WINDOW:
+                rows = conn.execute(f'''
+                    SELECT rowid, name FROM {fts_table}
+                    WHERE {fts_table} MATCH ?
+                    ORDER BY bm25({fts_table}, {weights})
+                    LIMIT ?
+                ''', (match, limit)).fetchall()
+            else:
+                window = conn.execute(f'''
+                    SELECT rowid, name FROM {fts_table}
+                    WHERE {fts_table} MATCH ?
+                    LIMIT ?
+                ''', (match, RANK_WINDOW)).fetchall()
+                rows = sorted(window, key=lambda row: self._name_rank(row[1], text))[:limit]
+
+        return rows
+
+    @staticmethod
+    def _name_rank(name, text):
+        """Ключ сортировки для широких запросов: сначала названия,
+        начинающиеся с запроса, затем более короткие"""
+        lowered = (name or '').lower()
+        return (not lowered.startswith(text.lower().strip()), len(lowered), lowered)
+
+    def _fuzzy(self, trigram_table, text, limit):
+        match = build_trigram_query(text)
+        if not match:
+            return []
+
+        # Берём с запасом кандидатов с наибольшим числом общих триграмм
+        candidates = self.pool.fetchall(f'''
+            SELECT rowid, name FROM {trigram_table}
+            WHERE {trigram_table} MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (match, limit * 5))
+
+        needle = text.lower()
+        scored = []
+        for rowid, name in candidates:
+            lowered = name.lower()
+            # Сравниваем и с полным названием, и с его словами
+            similarity = max(
+                [SequenceMatcher(None, needle, lowered).ratio()] +
+                [SequenceMatcher(None, needle, word).ratio() for word in WORD_RE.findall(lowered)]
+            )
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, rowid, name))
+
+        scored.sort(key=lambda item: -item[0])
+        return [(rowid, name) for _, rowid, name in scored[:limit]]
+
+    def search_exercises(self, text, limit=20):
+        """Поиск упражнений по названию, описанию и технике -> [(id, name)]"""
+        # Совпадение в названии весит больше, чем в описании и технике
+        return self._search('exercises_fts', 'exercises_trigram', text, limit, '10.0, 2.0, 1.0')
+
+    def search_foods(self, text, limit=20):
+        """Поиск продуктов по названию -> [(id, name)]"""
+        return self._search('food_fts', 'food_trigram', text, limit, '1.0')
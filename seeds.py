@@ -0,0 +1,84 @@
+# seeds.py
+import json
+import os
+
+# Стартовые данные хранятся в версионируемом файле: чтобы bootstrap заново
+# применил их к существующим базам, измените данные и увеличьте "version"
+SEED_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'seed_data.json')
+
+
+def load_seed_data(path=SEED_DATA_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+SEED_DATA = load_seed_data()
+SEED_VERSION = SEED_DATA['version']
+
+
+def seed_challenges(cursor, challenges):
+    """Базовые челленджи (уникальны по имени)"""
+    cursor.executemany('''
+        INSERT INTO challenges (name, description, challenge_type, goal_type, goal_value, reward_xp, difficulty)
+        VALUES (:name, :description, :challenge_type, :goal_type, :goal_value, :reward_xp, :difficulty)
+        ON CONFLICT(name) DO UPDATE SET
+            description = excluded.description,
+            challenge_type = excluded.challenge_type,
+            goal_type = excluded.goal_type,
+            goal_value = excluded.goal_value,
+            reward_xp = excluded.reward_xp,
+            difficulty = excluded.difficulty
+    ''', challenges)
+
+
+def seed_achievements(cursor, achievements):
+    """Шаблоны достижений"""
+    cursor.executemany('''
+        INSERT INTO achievements_template (achievement_type, achievement_name, description, reward_xp)
+        VALUES (:achievement_type, :achievement_name, :description, :reward_xp)
+        ON CONFLICT(achievement_type) DO UPDATE SET
+            achievement_name = excluded.achievement_name,
+            description = excluded.description,
+            reward_xp = excluded.reward_xp
+    ''', achievements)
+
+
+def seed_exercises(cursor, exercises):
+    """Заполнение базы упражнений"""
+    rows = [dict(exercise, instructions=json.dumps(exercise['instructions'], ensure_ascii=False)) for exercise in exercises]
+    cursor.executemany('''
+        INSERT INTO exercises
+        (name, description, category, muscle_group, equipment, difficulty, instructions, calories_burned)
+        VALUES (:name, :description, :category, :muscle_group, :equipment, :difficulty, :instructions, :calories_burned)
+        ON CONFLICT(name) WHERE is_custom = 0 DO UPDATE SET
+            description = excluded.description,
+            category = excluded.category,
+            muscle_group = excluded.muscle_group,
+            equipment = excluded.equipment,
+            difficulty = excluded.difficulty,
+            instructions = excluded.instructions,
+            calories_burned = excluded.calories_burned
+    ''', rows)
+
+
+def seed_foods(cursor, foods):
+    """Инициализация базы продуктов"""
+    cursor.executemany('''
+        INSERT INTO food_database (name, category, calories, protein, carbs, fat, serving_size)
+        VALUES (:name, :category, :calories, :protein, :carbs, :fat, :serving_size)
+        ON CONFLICT(name) WHERE is_custom = 0 DO UPDATE SET
+            category = excluded.category,
+            calories = excluded.calories,
+            protein = excluded.protein,
+            carbs = excluded.carbs,
+            fat = excluded.fat,
+            serving_size = excluded.serving_size
+    ''', foods)
+
+
+def apply_seeds(cursor, data=None):
+    data = data or SEED_DATA
+    seed_challenges(cursor, data['challenges'])
+    seed_achievements(cursor, data['achievements'])
+    seed_exercises(cursor, data['exercises'])
+    seed_foods(cursor, data['foods'])
@@ -0,0 +1,298 @@
+# send_queue.py
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный
+# чат (с небольшим запасом на всплеск) и 20 в минуту в группу
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+
+# Очереди по приоритету: ответы пользователю раньше массовых рассылок
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+# Сколько запросов из начала очереди просматривать в поисках готового чата
+SCAN_LIMIT = 64
+MAX_ATTEMPTS = 5
+# Сколько ждать отправки очереди при остановке, секунд
+DRAIN_TIMEOUT = 10
+# Отправок, по которым считаются задержки
+LATENCY_WINDOW = 1000
+# Сколько корзин чатов держать, прежде чем убрать простаивающие
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится токен (0 - уже есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Request:
+    __slots__ = ('callback', 'args', 'kwargs', 'chat_id', 'lane', 'key', 'futures', 'queued_at', 'attempts')
+
+    def __init__(self, callback, args, kwargs, chat_id, lane, key, future, queued_at):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.lane = lane
+        self.key = key
+        self.futures = [future]
+        self.queued_at = queued_at
+        self.attempts = 0
+
+
+class SendQueue(BaseRateLimiter):
+    """Общая очередь исходящих сообщений бота.
+
+    Подключается к Application как rate_limiter, поэтому через неё идут
+    все отправки и правки сообщений, включая reply_text и
+    edit_message_text в обработчиках. Запрос уходит, когда есть токен в
+    общей корзине бота и в корзине чата; в одном чате запросы идут строго
+    по очереди. Массовые отправки (rate_limit_args={'priority': 'bulk'})
+    ждут, пока не уйдут ответы пользователям. Повторные правки одного
+    сообщения, ещё не отправленные, схлопываются в последнюю. На 429
+    отправка приостанавливается на retry_after и запрос повторяется.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_attempts=MAX_ATTEMPTS):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self._lanes = {lane: deque() for lane in LANES}
+        self._pending = {}
+        self._chats = {}
+        self._busy = set()
+        self._global = None
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._worker = None
+        self._deliveries = set()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.flood_waits = 0
+
+    async def initialize(self):
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.global_rate, self.global_burst, loop.time())
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run(), name='send-queue')
+
+    async def shutdown(self):
+        """Остановка: дожидаемся отправки очереди (не дольше DRAIN_TIMEOUT)"""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self.backlog() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._worker.cancel()
+        self._worker = None
+        # Уже начатые отправки дожидаемся в пределах того же срока,
+        # оставшиеся отменяем - их ожидающие получат ошибку
+        deliveries = list(self._deliveries)
+        if deliveries:
+            gathered = asyncio.gather(*deliveries, return_exceptions=True)
+            try:
+                await asyncio.wait_for(asyncio.shield(gathered), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                for task in deliveries:
+                    task.cancel()
+                await gathered
+        for lane in self._lanes.values():
+            while lane:
+                self._fail(lane.popleft(), RuntimeError('Очередь отправки остановлена'))
+        self._pending.clear()
+        logger.info('Очередь отправки остановлена: %s', self.stats())
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        # Лимиты касаются только сообщений; ответы на callback и служебные
+        # запросы уходят сразу
+        if chat_id is None or not endpoint.startswith(('send', 'edit', 'copy', 'forward')):
+            return await callback(*args, **kwargs)
+
+        lane = BULK if (rate_limit_args or {}).get('priority') == BULK else INTERACTIVE
+        key = None
+        if endpoint.startswith('edit') and data.get('message_id') is not None:
+            key = (endpoint, chat_id, data['message_id'])
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queued = self._pending.get(key) if key else None
+        if queued is not None:
+            # Правка ещё не ушла: отправим только последний вариант
+            queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+            queued.futures.append(future)
+            self.coalesced += 1
+        else:
+            request = _Request(callback, args, kwargs, chat_id, lane, key, future, loop.time())
+            self._lanes[lane].append(request)
+            if key:
+                self._pending[key] = request
+            self._wakeup.set()
+        return await future
+
+    # --- Отправка ---
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # Полные корзины ничего не помнят - их можно забыть
+                self._chats = {chat: b for chat, b in self._chats.items() if not b.is_full(now)}
+            group = isinstance(chat_id, int) and chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(
+                GROUP_RATE if group else self.chat_rate, GROUP_BURST if group else self.chat_burst, now)
+        return bucket
+
+    def _take_ready(self, now):
+        """Первый запрос, чат которого готов; иначе (None, через сколько проверить снова)"""
+        wait = None
+        for lane in LANES:
+            queue = self._lanes[lane]
+            for index in range(min(len(queue), SCAN_LIMIT)):
+                request = queue[index]
+                if request.chat_id in self._busy:
+                    continue
+                delay = self._chat_bucket(request.chat_id, now).delay(now)
+                if delay:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                del queue[index]
+                if request.key:
+                    self._pending.pop(request.key, None)
+                return request, None
+        return None, wait
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            pause = max(self._paused_until - now, self._global.delay(now))
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            request, wait = self._take_ready(now)
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global.take(now)
+            self._chat_bucket(request.chat_id, now).take(now)
+            self._busy.add(request.chat_id)
+            task = asyncio.create_task(self._deliver(request))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, request):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as exc:
+            self.flood_waits += 1
+            retry_after = float(exc.retry_after)
+            # 429 - превышен лимит: останавливаем все отправки, а не только этот чат
+            self._paused_until = max(self._paused_until, loop.time() + retry_after)
+            logger.warning('Telegram просит подождать %.1f с (чат %s)', retry_after, request.chat_id)
+            self._retry(request, exc)
+        except asyncio.CancelledError:
+            self._fail(request, RuntimeError('Очередь отправки остановлена'))
+            raise
+        except Exception as exc:
+            self._fail(request, exc)
+        else:
+            self.sent += 1
+            self._latencies.append(loop.time() - request.queued_at)
+            for future in request.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._busy.discard(request.chat_id)
+            self._wakeup.set()
+
+    def _retry(self, request, exc):
+        request.attempts += 1
+        if request.attempts >= self.max_attempts:
+            self._fail(request, exc)
+            return
+        self.retries += 1
+        newer = self._pending.get(request.key) if request.key else None
+        if newer is not None:
+            # За время ожидания пришла новая правка - она и уйдёт
+            newer.futures.extend(request.futures)
+            return
+        self._lanes[request.lane].appendleft(request)
+        if request.key:
+            self._pending[request.key] = request
+
+    def _fail(self, request, exc):
+        self.failed += 1
+        for future in request.futures:
+            if not future.done():
+                future.set_exception(exc)
+
+    # --- Метрики ---
+
+    def backlog(self):
+        return sum(len(queue) for queue in self._lanes.values()) + len(self._busy)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        count = len(latencies)
+        return {
+            'backlog': {lane: len(queue) for lane, queue in self._lanes.items()},
+            'in_flight': len(self._busy),
+            'sent': self.sent,
+            'failed': self.failed,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'flood_waits': self.flood_waits,
+            'avg_latency_ms': round(sum(latencies) / count * 1000, 1) if count else 0.0,
+            'p95_latency_ms': round(latencies[min(count - 1, int(count * 0.95))] * 1000, 1) if count else 0.0,
+            'max_latency_ms': round(latencies[-1] * 1000, 1) if count else 0.0,
+        }
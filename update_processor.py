@@ -0,0 +1,133 @@
+# update_processor.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = 32
+# Сколько апдейтов может ждать своей очереди (в том числе за другими апдейтами
+# того же пользователя); с запасом, чтобы ожидание не отнимало слоты обработки
+MAX_ACCEPTED_UPDATES = 4096
+# Повторное нажатие той же кнопки в течение стольких секунд отбрасывается
+CALLBACK_DEBOUNCE = 1.5
+MAX_TAPS = 10000
+
+
+def update_key(update):
+    """Ключ очерёдности: пользователь (или чат), None - порядок не важен"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+def tap_key(update):
+    """Ключ нажатия кнопки: пользователь, сообщение и данные кнопки"""
+    query = update.callback_query if isinstance(update, Update) else None
+    if query is None:
+        return None
+    message_id = query.message.message_id if query.message is not None else query.inline_message_id
+    return query.from_user.id, message_id, query.data
+
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+    Апдейты разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates), апдейты одного пользователя - строго по очереди
+    поступления: каждый ждёт завершения предыдущего. Ожидающие своей очереди
+    апдейты не занимают слоты обработки. Повторные нажатия той же кнопки
+    в течение debounce секунд отбрасываются до обработчиков - на них только
+    отвечается answerCallbackQuery, чтобы у пользователя пропали часики.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES, debounce=CALLBACK_DEBOUNCE):
+        # Базовый семафор отпускает апдейты в порядке поступления, и с таким
+        # пределом он практически не ждёт - очередь пользователя выстраивается сразу
+        super().__init__(MAX_ACCEPTED_UPDATES)
+        self.debounce = debounce
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._tails = {}
+        self._taps = OrderedDict()
+        self.active = 0
+        self.waiting = 0
+        self.processed = 0
+        self.debounced = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _is_repeat_tap(self, update):
+        key = tap_key(update)
+        if key is None:
+            return False
+        now = time.monotonic()
+        # Нажатия упорядочены по времени - старые отрезаются с начала
+        while self._taps and (len(self._taps) >= MAX_TAPS or now - next(iter(self._taps.values())) > self.debounce):
+            self._taps.popitem(last=False)
+        if key in self._taps:
+            return True
+        self._taps[key] = now
+        return False
+
+    async def do_process_update(self, update, coroutine):
+        if self._is_repeat_tap(update):
+            self.debounced += 1
+            coroutine.close()
+            try:
+                await update.callback_query.answer()
+            except Exception as exc:
+                logger.debug('Не удалось ответить на повторное нажатие: %s', exc)
+            return
+
+        key = update_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        started = False
+        try:
+            if previous is not None:
+                self.waiting += 1
+                try:
+                    # shield: отмена ожидающего не должна отменять future чужого апдейта
+                    await asyncio.shield(previous)
+                finally:
+                    self.waiting -= 1
+            async with self._slots:
+                started = True
+                self.active += 1
+                try:
+                    await coroutine
+                finally:
+                    self.active -= 1
+                    self.processed += 1
+        finally:
+            if not started:
+                # Отмена до начала обработки
+                coroutine.close()
+            if not done.done():
+                done.set_result(None)
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'users': len(self._tails),
+            'processed': self.processed,
+            'debounced': self.debounced,
+        }
@@ -0,0 +1,214 @@
+# webhook_server.py
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import signal
+import time
+from collections import deque
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+from telegram.ext import TypeHandler
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/telegram'
+HEALTH_PATH = '/health'
+# Render ждёт 30 секунд после SIGTERM - успеваем доработать принятые апдейты
+DRAIN_TIMEOUT = 25
+# Группы служебных обработчиков: до и после всех обработчиков бота
+FIRST_GROUP = -1000
+LAST_GROUP = 1000
+LATENCY_WINDOW = 1000
+
+
+def webhook_config(token, environ=None):
+    """Настройки webhook из переменных окружения; None - работать через long polling.
+
+    BOT_MODE=webhook|polling (по умолчанию webhook, если известен публичный адрес),
+    WEBHOOK_URL (или RENDER_EXTERNAL_URL на Render), WEBHOOK_PATH, WEBHOOK_LISTEN,
+    PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_DROP_PENDING=1.
+    """
+    environ = os.environ if environ is None else environ
+    mode = environ.get('BOT_MODE', '').lower()
+    url = environ.get('WEBHOOK_URL') or environ.get('RENDER_EXTERNAL_URL')
+    if mode == 'polling' or (mode != 'webhook' and not url):
+        return None
+    if not url:
+        raise ValueError('Для BOT_MODE=webhook нужен WEBHOOK_URL')
+
+    path = '/' + environ.get('WEBHOOK_PATH', WEBHOOK_PATH).strip('/')
+    return {
+        'url': url.rstrip('/') + path,
+        'path': path,
+        'listen': environ.get('WEBHOOK_LISTEN', '0.0.0.0'),
+        'port': int(environ.get('PORT', 8080)),
+        # Telegram присылает секрет в заголовке - чужие POST отклоняются
+        'secret': environ.get('WEBHOOK_SECRET') or hashlib.sha256(token.encode()).hexdigest()[:32],
+        'max_connections': int(environ.get('WEBHOOK_MAX_CONNECTIONS', 40)),
+        'drop_pending': environ.get('WEBHOOK_DROP_PENDING') == '1',
+    }
+
+
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class UpdateMetrics:
+    """Время обработки апдейтов: от первой до последней группы обработчиков.
+
+    Считает и апдейты в обработке - по ним webhook-сервер понимает, что
+    при остановке всё принятое уже доработано.
+    """
+
+    def __init__(self):
+        self.in_progress = 0
+        self.processed = 0
+        self._started = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def install(self, application):
+        application.add_handler(TypeHandler(Update, self._on_start), group=FIRST_GROUP)
+        application.add_handler(TypeHandler(Update, self._on_finish), group=LAST_GROUP)
+
+    async def _on_start(self, update, context):
+        self.in_progress += 1
+        self._started[id(update)] = time.perf_counter()
+
+    async def _on_finish(self, update, context):
+        started = self._started.pop(id(update), None)
+        if started is not None:
+            self.in_progress -= 1
+            self.processed += 1
+            self._latencies.append(time.perf_counter() - started)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'in_progress': self.in_progress,
+            'processed': self.processed,
+            'handler_p50_ms': round(_percentile(latencies, 0.5) * 1000, 1) if latencies else 0.0,
+            'handler_p99_ms': round(_percentile(latencies, 0.99) * 1000, 1) if latencies else 0.0,
+        }
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    async def post(self):
+        server = self.server
+        if server.draining:
+            # Telegram повторит доставку - апдейт получит новый экземпляр бота
+            self.set_status(503)
+            return
+        secret = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(secret, server.config['secret']):
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        update = Update.de_json(data, server.application.bot)
+        if update is not None:
+            # Ответ Telegram сразу, обработка - в очереди приложения
+            await server.application.update_queue.put(update)
+            server.received += 1
+        self.set_status(200)
+
+
+class _HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    def get(self):
+        stats = self.server.stats()
+        self.set_status(503 if self.server.draining else 200)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(stats))
+
+
+class WebhookServer:
+    """HTTP-сервер webhook (tornado - тот же, что в python-telegram-bot[webhooks]).
+
+    Принимает апдейты на config['path'], отдаёт состояние на /health и при
+    остановке сначала перестаёт принимать апдейты, а затем ждёт, пока
+    обработчики доработают уже принятые.
+    """
+
+    def __init__(self, application, config, metrics, extra_stats=None):
+        self.application = application
+        self.config = config
+        self.metrics = metrics
+        self.extra_stats = extra_stats
+        self.draining = False
+        self.received = 0
+        self.started_at = time.monotonic()
+        self._server = None
+
+    async def start(self):
+        app = tornado.web.Application([
+            (self.config['path'], _WebhookHandler, {'server': self}),
+            (HEALTH_PATH, _HealthHandler, {'server': self}),
+        ])
+        self._server = tornado.httpserver.HTTPServer(app, xheaders=True)
+        self._server.listen(self.config['port'], self.config['listen'])
+        logger.info('Webhook слушает %s:%d%s', self.config['listen'], self.config['port'], self.config['path'])
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Перестаём принимать апдейты и ждём обработки принятых"""
+        self.draining = True
+        # Application отмечает апдейт в очереди выполненным после всех обработчиков -
+        # и при последовательной, и при параллельной обработке
+        try:
+            await asyncio.wait_for(self.application.update_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Остановка: не дождались обработки апдейтов (в работе %d)', self.metrics.in_progress)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+    def stats(self):
+        stats = {
+            'status': 'draining' if self.draining else 'ok',
+            'uptime_s': round(time.monotonic() - self.started_at),
+            'received': self.received,
+            'update_queue': self.application.update_queue.qsize(),
+        }
+        stats.update(self.metrics.stats())
+        if self.extra_stats is not None:
+            stats.update(self.extra_stats())
+        return stats
+
+
+async def serve(application, config, metrics, extra_stats=None, stop=None):
+    """Работа application через webhook до SIGTERM/SIGINT (или до stop.set())"""
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+    server = WebhookServer(application, config, metrics, extra_stats)
+    await application.initialize()
+    try:
+        await application.bot.set_webhook(
+            config['url'], secret_token=config['secret'], allowed_updates=Update.ALL_TYPES,
+            max_connections=config['max_connections'], drop_pending_updates=config['drop_pending'])
+        await application.start()
+        await server.start()
+        await stop.wait()
+        # Новые апдейты больше не принимаем, принятые дорабатываем
+        await server.drain()
+        await server.stop()
+        await application.stop()
+    finally:
+        await application.shutdown()
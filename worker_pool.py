@@ -0,0 +1,351 @@
+# worker_pool.py
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from bootstrap import bootstrap
+from db_pool import close_all, get_pool
+from update_processor import update_key
+from webhook_server import UpdateMetrics, serve, webhook_config
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'fitness_bot.db'
+# Точек на процесс в кольце: чем больше, тем ровнее доли пользователей
+RING_REPLICAS = 128
+# Перезапуск упавшего процесса: пауза растёт вдвое до предела и сбрасывается,
+# если процесс проработал STABLE_AFTER секунд
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 60.0
+SUPERVISE_INTERVAL = 0.5
+# Сколько ждать, пока рабочие процессы доработают принятые апдейты
+STOP_TIMEOUT = 30
+# Сколько апдейтов рабочий процесс держит у себя (в обработке и в очереди):
+# с запасом к MAX_CONCURRENT_UPDATES, и столько же теряется, если процесс упадёт
+WORKER_PREFETCH = 64
+
+
+def _hash(value):
+    # Не hash(): он случайный в каждом процессе
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Консистентное хэширование user_id по процессам.
+
+    При смене числа процессов к другому процессу переезжает лишь ~1/N
+    пользователей, остальные сохраняют прогретые кэши.
+    """
+
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = sorted((_hash(f'{node}:{replica}'), node) for node in range(nodes) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        index = bisect.bisect(self._points, _hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class Shard:
+    """Доля пользователей рабочего процесса index из count"""
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+        self.ring = HashRing(count)
+
+    @property
+    def primary(self):
+        """Общие для всего бота задачи (смена окон челленджей) - в первом процессе"""
+        return self.index == 0
+
+    def owns(self, user_id):
+        return self.ring.node(user_id) == self.index
+
+
+class _Inbox:
+    """Апдейты для рабочего процесса и их доставка по кредитам.
+
+    Процесс сам сообщает, сколько апдейтов готов принять: WORKER_PREFETCH
+    при запуске и по одному за каждый обработанный, - и получает не больше.
+    Остальные ждут здесь и переживают перезапуск процесса. Для каждого
+    запуска - свой pipe: сообщение, недочитанное упавшим процессом, не
+    достаётся следующему. multiprocessing.Queue здесь не годится: упавший во
+    время get() процесс навсегда оставляет её блокировку чтения занятой.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._generation = 0
+
+    def put(self, item):
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def qsize(self):
+        return len(self._items)
+
+    def connect(self, context):
+        """Pipe для нового запуска процесса; возвращает его конец для процесса"""
+        ours, theirs = context.Pipe()
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+        threading.Thread(target=self._send, args=(ours, self._generation),
+                         name=f'worker-{self.index}-inbox', daemon=True).start()
+        return theirs
+
+    def _next(self, generation):
+        """(True, апдейт) или (False, None), если процесс уже перезапущен"""
+        with self._cond:
+            while not self._items and generation == self._generation:
+                self._cond.wait()
+            if generation != self._generation:
+                return False, None
+            return True, self._items.popleft()
+
+    def _send(self, conn, generation):
+        credits = 0
+        try:
+            while True:
+                while credits == 0:
+                    credits += conn.recv()
+                current, item = self._next(generation)
+                if not current:
+                    # Процесс уже перезапущен - апдейты достанутся новому pipe
+                    return
+                try:
+                    conn.send(item)
+                except OSError:
+                    with self._cond:
+                        self._items.appendleft(item)
+                    raise
+                if item is None:
+                    return
+                credits -= 1
+        except (EOFError, OSError):
+            # Процесс завершился - ждём следующего запуска
+            pass
+        finally:
+            conn.close()
+
+
+class _CreditQueue(asyncio.Queue):
+    """update_queue рабочего процесса: каждый обработанный апдейт даёт
+    супервизору право прислать следующий"""
+
+    def __init__(self, on_done):
+        super().__init__()
+        self._on_done = on_done
+
+    def task_done(self):
+        super().task_done()
+        self._on_done()
+
+
+# --- Рабочий процесс ---
+
+def run_worker(token, index, count, conn):
+    """Точка входа рабочего процесса: FitnessBot без получения апдейтов"""
+    logging.basicConfig(format=f'%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO, force=True)
+    # Ctrl+C получает вся группа процессов - останавливает процессы супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_worker(token, Shard(index, count), conn))
+
+
+async def _serve_worker(token, shard, conn):
+    from main import FitnessBot
+
+    def give_credit():
+        try:
+            conn.send(1)
+        except OSError:
+            pass
+
+    bot = FitnessBot(token, shard=shard, update_queue=_CreditQueue(give_credit))
+    application = bot.application
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    def receive():
+        # Блокирующее чтение канала - в отдельном потоке; апдейтов в процессе
+        # не больше выданных кредитов
+        while True:
+            try:
+                data = conn.recv()
+            except (EOFError, OSError):
+                data = None
+            if data is None:
+                loop.call_soon_threadsafe(stop.set)
+                return
+            update = Update.de_json(data, application.bot)
+            loop.call_soon_threadsafe(application.update_queue.put_nowait, update)
+
+    await application.initialize()
+    try:
+        await application.start()
+        threading.Thread(target=receive, name=f'worker-{shard.index}-inbox', daemon=True).start()
+        conn.send(WORKER_PREFETCH)
+        logger.info('Рабочий процесс %d из %d запущен', shard.index, shard.count)
+        await stop.wait()
+        try:
+            await asyncio.wait_for(application.update_queue.join(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning('Рабочий процесс %d: не дождались обработки апдейтов', shard.index)
+        await application.stop()
+    finally:
+        await application.shutdown()
+        await bot.on_shutdown(application)
+
+
+# --- Процесс приёма апдейтов ---
+
+class WorkerPool:
+    """Рабочие процессы бота и маршрутизация апдейтов между ними.
+
+    Апдейт уходит в процесс, выбранный по консистентному хэшу user_id
+    (без пользователя - по чату), так что все апдейты пользователя
+    обрабатывает один процесс - по порядку и со своими кэшами. Процессу
+    передаётся не больше WORKER_PREFETCH апдейтов сверх обработанных,
+    остальные ждут в его канале здесь. Если процесс упал, ждущие апдейты
+    достанутся ему после перезапуска; теряются только уже переданные
+    ему и не обработанные - не больше WORKER_PREFETCH.
+    """
+
+    def __init__(self, token, count):
+        self.token = token
+        self.count = count
+        self.ring = HashRing(count)
+        # spawn: рабочим процессам не нужны потоки и соединения этого процесса
+        self._context = multiprocessing.get_context('spawn')
+        self._inboxes = [_Inbox(index) for index in range(count)]
+        self._processes = [None] * count
+        self._started_at = [0.0] * count
+        self._restart_at = [None] * count
+        self._delays = [RESTART_DELAY] * count
+        self._supervisor = None
+        self._stopping = False
+        self.routed = [0] * count
+        self.restarts = [0] * count
+
+    def _spawn(self, index):
+        conn = self._inboxes[index].connect(self._context)
+        process = self._context.Process(target=run_worker, name=f'fitness-worker-{index}',
+                                        args=(self.token, index, self.count, conn))
+        process.start()
+        # Свой экземпляр конца процесса закрываем, чтобы увидеть EOF, когда процесс завершится
+        conn.close()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+
+    async def start(self, application=None):
+        for index in range(self.count):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise(), name='worker-supervisor')
+        logger.info('Запущено рабочих процессов: %d', self.count)
+
+    async def route(self, update, context=None):
+        """Обработчик процесса приёма: апдейт - в канал процесса его пользователя"""
+        key = update_key(update)
+        index = 0 if key is None else self.ring.node(key)
+        self._inboxes[index].put(update.to_dict())
+        self.routed[index] += 1
+
+    async def _supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping or process.is_alive():
+                    continue
+                if self._restart_at[index] is None:
+                    uptime = now - self._started_at[index]
+                    if uptime >= STABLE_AFTER:
+                        self._delays[index] = RESTART_DELAY
+                    self._restart_at[index] = now + self._delays[index]
+                    logger.error('Рабочий процесс %d завершился (код %s) через %.0f с, перезапуск через %.0f с',
+                                 index, process.exitcode, uptime, self._delays[index])
+                    self._delays[index] = min(self._delays[index] * 2, MAX_RESTART_DELAY)
+                elif now >= self._restart_at[index]:
+                    process.close()
+                    self._spawn(index)
+                    self.restarts[index] += 1
+
+    async def stop(self, application=None):
+        """Остановка: процессы дорабатывают свои очереди и завершаются"""
+        self._stopping = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        for inbox in self._inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + STOP_TIMEOUT + 5
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('Рабочий процесс %d не остановился, завершаем принудительно', index)
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        logger.info('Рабочие процессы остановлены: %s', self.stats())
+
+    def stats(self):
+        return {
+            'workers': self.count,
+            'alive': sum(1 for process in self._processes if process is not None and process.is_alive()),
+            'routed': list(self.routed),
+            'queued': [inbox.qsize() for inbox in self._inboxes],
+            'restarts': list(self.restarts),
+        }
+
+
+def run_cluster(token, count):
+    """Бот в count рабочих процессах; этот процесс только принимает апдейты"""
+    # Схему базы готовим один раз до запуска процессов, а не наперегонки в каждом
+    bootstrap(get_pool(DB_PATH))
+    close_all()
+
+    pool = WorkerPool(token, count)
+    builder = Application.builder().token(token)
+    if os.environ.get('TELEGRAM_API_URL'):
+        builder = builder.base_url(os.environ['TELEGRAM_API_URL'])
+    config = webhook_config(token)
+    if config is None:
+        application = builder.post_init(pool.start).post_shutdown(pool.stop).build()
+        application.add_handler(TypeHandler(Update, pool.route))
+        application.run_polling()
+        return
+
+    application = builder.build()
+    metrics = UpdateMetrics()
+    metrics.install(application)
+    application.add_handler(TypeHandler(Update, pool.route))
+
+    async def main():
+        await pool.start()
+        try:
+            await serve(application, config, metrics, lambda: {'workers': pool.stats()})
+        finally:
+            await pool.stop()
+
+    asyncio.run(main())
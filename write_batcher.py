@@ -0,0 +1,264 @@
+# write_batcher.py
+import json
+import sqlite3
+import threading
+import time
+import logging
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Запросы для каждого типа отложенной записи
+STATEMENTS = {
+    'user': '''
+        INSERT INTO users (user_id, username, first_name, last_name)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_name = excluded.last_name
+    ''',
+    'workout': '''
+        INSERT INTO workouts (user_id, workout_name, duration, calories_burned, date)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'meal': '''
+        INSERT INTO meals (user_id, date, meal_type, food_items, total_calories, total_protein, total_carbs, total_fat)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+}
+
+# Столько раз подряд пакет может не записаться целиком; дальше он пишется
+# построчно, а строки, на которых падает запись, уходят в write_dead_letters
+MAX_FLUSH_ATTEMPTS = 5
+# Ошибки, вызванные содержимым строки, а не состоянием базы
+ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError,
+              sqlite3.DataError, OverflowError, ValueError)
+
+
+def _callback_name(callback):
+    owner = getattr(callback, '__self__', None)
+    name = getattr(callback, '__name__', repr(callback))
+    return f'{type(owner).__name__}.{name}' if owner is not None else name
+
+
+class WriteBatcher:
+    """Отложенная пакетная запись пользователей, тренировок и приёмов пищи.
+
+    События копятся в памяти и сбрасываются одной транзакцией через
+    executemany, когда набирается max_batch строк или проходит
+    flush_interval секунд. Повторные обновления одного пользователя
+    внутри пакета схлопываются в одно.
+
+    Слушатели выполняются каждый в своём savepoint: ошибка слушателя
+    откатывает только его изменения, строки пакета всё равно записываются,
+    а сами строки и ошибка сохраняются в write_dead_letters. Пакет, который
+    не записался MAX_FLUSH_ATTEMPTS раз подряд, пишется построчно, чтобы одна
+    плохая строка не держала очередь.
+    """
+
+    def __init__(self, pool, max_batch=500, flush_interval=1.0, max_queue=10000):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+        self._users = {}
+        self._rows = {'workout': [], 'meal': []}
+        self._listeners = {}
+        self._commit_listeners = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.dead_letters = 0
+        self._failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='db-write-batcher', daemon=True)
+        self._thread.start()
+
+    def add_listener(self, kind, callback):
+        """callback(cursor, rows) вызывается в транзакции сброса после записи
+        строк этого типа - например, чтобы обновить производные таблицы"""
+        self._listeners.setdefault(kind, []).append(callback)
+
+    def add_commit_listener(self, callback):
+        """callback({тип: строки}) вызывается после фиксации пакета - например,
+        чтобы сбросить кэши, которые не должны увидеть незафиксированные данные"""
+        self._commit_listeners.append(callback)
+
+    def queue_depth(self):
+        return len(self._users) + sum(len(rows) for rows in self._rows.values())
+
+    def _submit(self, kind, params, key=None):
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('Пакетная запись уже остановлена')
+            # Переполнение очереди: будим поток записи и ждём места
+            while self.queue_depth() >= self.max_queue:
+                self._cond.notify_all()
+                self._cond.wait(self.flush_interval)
+
+            if kind == 'user':
+                self._users[key] = params
+            else:
+                self._rows[kind].append(params)
+
+            if self.queue_depth() >= self.max_batch:
+                self._cond.notify_all()
+
+    def upsert_user(self, user_id, username, first_name, last_name):
+        self._submit('user', (user_id, username, first_name, last_name), key=user_id)
+
+    def log_workout(self, user_id, workout_name, duration, calories_burned, workout_date=None):
+        workout_date = workout_date or date.today().isoformat()
+        self._submit('workout', (user_id, workout_name, duration, calories_burned, workout_date))
+
+    def log_meal(self, user_id, meal_type, food_items, calories, protein, carbs, fat, meal_date=None):
+        meal_date = meal_date or date.today().isoformat()
+        self._submit('meal', (user_id, meal_date, meal_type, json.dumps(food_items, ensure_ascii=False),
+                              calories, protein, carbs, fat))
+
+    def _take_batch(self):
+        with self._cond:
+            batch = {'user': list(self._users.values())}
+            batch.update(self._rows)
+            self._users = {}
+            self._rows = {'workout': [], 'meal': []}
+            self._cond.notify_all()
+        return batch
+
+    def _restore_batch(self, batch):
+        # Возвращаем строки в начало очереди, чтобы не потерять их при ошибке
+        with self._cond:
+            for user in batch['user']:
+                self._users.setdefault(user[0], user)
+            for kind in self._rows:
+                self._rows[kind] = batch[kind] + self._rows[kind]
+
+    def _dead_letter(self, cursor, kind, stage, rows, exc):
+        logger.error('Пакетная запись: %s не обработал %d строк %s: %r', stage, len(rows), kind, exc)
+        cursor.execute('''
+            INSERT INTO write_dead_letters (kind, stage, rows, error) VALUES (?, ?, ?, ?)
+        ''', (kind, stage, json.dumps(rows, ensure_ascii=False, default=str), repr(exc)))
+        return len(rows)
+
+    def _notify(self, cursor, kind, rows):
+        """Слушатели типа kind; возвращает число строк, ушедших в write_dead_letters"""
+        dead = 0
+        for callback in self._listeners.get(kind, ()):
+            cursor.execute('SAVEPOINT batch_listener')
+            try:
+                callback(cursor, rows)
+            except Exception as exc:
+                cursor.execute('ROLLBACK TO batch_listener')
+                dead += self._dead_letter(cursor, kind, _callback_name(callback), rows, exc)
+            cursor.execute('RELEASE batch_listener')
+        return dead
+
+    def _write(self, cursor, batch, by_row):
+        """Запись пакета в открытой транзакции: (записанные строки по типам, строк в write_dead_letters)"""
+        written, dead = {}, 0
+        for kind, rows in batch.items():
+            if rows and not by_row:
+                cursor.executemany(STATEMENTS[kind], rows)
+            elif rows:
+                good = []
+                for row in rows:
+                    cursor.execute('SAVEPOINT batch_row')
+                    try:
+                        cursor.execute(STATEMENTS[kind], row)
+                    except ROW_ERRORS as exc:
+                        cursor.execute('ROLLBACK TO batch_row')
+                        dead += self._dead_letter(cursor, kind, 'insert', [row], exc)
+                    else:
+                        good.append(row)
+                    cursor.execute('RELEASE batch_row')
+                rows = good
+            if rows:
+                dead += self._notify(cursor, kind, rows)
+            written[kind] = rows
+        return written, dead
+
+    def flush(self):
+        """Сброс накопленных строк одной транзакцией, возвращает число строк"""
+        with self._flush_lock:
+            batch = self._take_batch()
+            total = sum(len(rows) for rows in batch.values())
+            if not total:
+                return 0
+
+            started = time.perf_counter()
+            by_row = self._failures >= MAX_FLUSH_ATTEMPTS
+            if by_row:
+                logger.warning('Пакет не записался %d раз подряд, пишем построчно', self._failures)
+            try:
+                with self.pool.transaction() as cursor:
+                    written, dead = self._write(cursor, batch, by_row)
+            except Exception:
+                self.errors += 1
+                self._failures += 1
+                self._restore_batch(batch)
+                raise
+            self._failures = 0
+            self.dead_letters += dead
+            batch = written
+            total = sum(len(rows) for rows in batch.values())
+
+            # Пакет уже записан: ошибка слушателя не должна вернуть его в очередь
+            for callback in self._commit_listeners:
+                try:
+                    callback(batch)
+                except Exception:
+                    logger.exception('Ошибка обработчика после записи пакета')
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.rows_written += total
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            return total
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and self.queue_depth() < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Ошибка пакетной записи в БД, повтор через %s с', self.flush_interval)
+                time.sleep(self.flush_interval)
+            if stopped:
+                return
+
+    def stats(self):
+        flushes = self.flushes or 1
+        return {
+            'queue_depth': self.queue_depth(),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'errors': self.errors,
+            'dead_letters': self.dead_letters,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / flushes, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+        }
+
+    def close(self):
+        """Остановка с финальным сбросом и checkpoint WAL на диск"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+        with self.pool.connection() as conn:
+            conn.execute('PRAGMA wal_checkpoint(FULL)')